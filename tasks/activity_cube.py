@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+(用户, 日期) 活动数据立方体
+
+每次运行对 habit_completions、todos、notes、pomodoros 各执行一次按 (user_id, day) 分组的聚合查询，
+合并成以 (user_id, day) 为索引的列式DataFrame。综合报告直接使用立方体；周报的数据库聚合模式和
+图表生成器可以接收立方体并切片得到按天指标，综合报告运行时可以让它们共用同一次加载。
+按类别、优先级、标签等维度的统计仍由各任务自己查询；每日摘要和每日洞察需要逐条的类别、标签和
+备注等明细，不从立方体生成。
+"""
+import argparse
+import logging
+import os
+from datetime import date, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+import pandas as pd
+
+from chart_render import make_series, render_charts
+from config import config
+from db import db
+from utils import get_date_range, save_dataframe_to_csv, save_summary_to_json
+
+logger = logging.getLogger(__name__)
+
+# 各数据源的指标列
+HABIT_METRICS = ['habits_total', 'habits_completed']
+TODO_METRICS = ['todos_created', 'todos_completed']
+NOTE_METRICS = ['notes_created', 'notes_updated']
+POMODORO_METRICS = ['pomodoros_total', 'pomodoros_completed', 'focus_minutes', 'completed_focus_minutes']
+METRICS = HABIT_METRICS + TODO_METRICS + NOTE_METRICS + POMODORO_METRICS
+
+# 习惯与周报、图表一样按 habit_completions 统计，日期统一按配置的时区计算（参数tz）
+HABITS_QUERY = """
+SELECT
+    h.user_id, hc.completion_date AS day,
+    COUNT(*) AS habits_total,
+    COUNT(*) FILTER (WHERE hc.is_completed) AS habits_completed
+FROM habits h
+JOIN habit_completions hc ON h.id = hc.habit_id
+WHERE hc.completion_date BETWEEN %(start_date)s AND %(end_date)s
+GROUP BY h.user_id, hc.completion_date
+"""
+
+TODOS_QUERY = """
+SELECT user_id, day, SUM(created) AS todos_created, SUM(completed) AS todos_completed
+FROM (
+    SELECT user_id, (created_at AT TIME ZONE %(tz)s)::date AS day, 1 AS created, 0 AS completed
+    FROM todos
+    WHERE (created_at AT TIME ZONE %(tz)s)::date BETWEEN %(start_date)s AND %(end_date)s
+    UNION ALL
+    SELECT user_id, (completed_at AT TIME ZONE %(tz)s)::date AS day, 0 AS created, 1 AS completed
+    FROM todos
+    WHERE status = 'completed'
+      AND (completed_at AT TIME ZONE %(tz)s)::date BETWEEN %(start_date)s AND %(end_date)s
+) todo_events
+GROUP BY user_id, day
+"""
+
+NOTES_QUERY = """
+SELECT user_id, day, SUM(created) AS notes_created, SUM(updated) AS notes_updated
+FROM (
+    SELECT user_id, (created_at AT TIME ZONE %(tz)s)::date AS day, 1 AS created, 0 AS updated
+    FROM notes
+    WHERE (created_at AT TIME ZONE %(tz)s)::date BETWEEN %(start_date)s AND %(end_date)s
+    UNION ALL
+    SELECT user_id, (updated_at AT TIME ZONE %(tz)s)::date AS day, 0 AS created, 1 AS updated
+    FROM notes
+    WHERE (updated_at AT TIME ZONE %(tz)s)::date BETWEEN %(start_date)s AND %(end_date)s
+      AND (updated_at AT TIME ZONE %(tz)s)::date <> (created_at AT TIME ZONE %(tz)s)::date
+) note_events
+GROUP BY user_id, day
+"""
+
+POMODOROS_QUERY = """
+SELECT
+    user_id, (start_time AT TIME ZONE %(tz)s)::date AS day,
+    COUNT(*) AS pomodoros_total,
+    COUNT(*) FILTER (WHERE status = 'completed') AS pomodoros_completed,
+    COALESCE(SUM(duration), 0) AS focus_minutes,
+    COALESCE(SUM(duration) FILTER (WHERE status = 'completed'), 0) AS completed_focus_minutes
+FROM pomodoros
+WHERE (start_time AT TIME ZONE %(tz)s)::date BETWEEN %(start_date)s AND %(end_date)s
+GROUP BY user_id, (start_time AT TIME ZONE %(tz)s)::date
+"""
+
+
+def add_rates(frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    在指标表上追加完成率和生产力得分
+
+    生产力得分的权重与周报相同: 习惯完成率占40%，待办完成率占60%，任一方没有数据时为50。
+    习惯完成率与周报一样按 habit_completions 计算；待办完成率只能由按天的计数得到，
+    按当期完成数 / 当期新建数计算（上限100），而周报按窗口内待办的明细状态计算，
+    因此同一期间的得分可能与周报略有不同。
+    """
+    frame = frame.copy()
+    habits_total = frame['habits_total'].where(frame['habits_total'] > 0)
+    todos_created = frame['todos_created'].where(frame['todos_created'] > 0)
+    frame['habit_completion_rate'] = frame['habits_completed'] / habits_total * 100
+    frame['todo_completion_rate'] = (frame['todos_completed'] / todos_created * 100).clip(upper=100)
+    score = frame['habit_completion_rate'] * 0.4 + frame['todo_completion_rate'] * 0.6
+    frame['productivity_score'] = score.fillna(50.0)
+    return frame
+
+
+def daily_from_details(habits_df: pd.DataFrame, todos_df: pd.DataFrame,
+                       start_date: date, end_date: date) -> pd.DataFrame:
+    """
+    由已查询的习惯完成记录和待办事项明细计算按天指标，列和索引与 ActivityCube.by_day() 一致
+
+    习惯按completion_date，待办按created_at/completed_at在配置时区下的日期计数（需为解析后的时间列），
+    用于已经查询了明细的任务，不必再为按天指标加载立方体。没有来源数据的指标为0。
+    """
+    days = pd.Index([start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)], name='day')
+    daily = pd.DataFrame(0, index=days, columns=METRICS, dtype='int64')
+
+    def count(values: pd.Series) -> pd.Series:
+        return values.dt.date.value_counts().reindex(days, fill_value=0).astype('int64')
+
+    if not habits_df.empty:
+        daily['habits_total'] = count(habits_df['completion_date'])
+        completed = habits_df['is_completed'].fillna(False).astype(bool)
+        daily['habits_completed'] = count(habits_df.loc[completed, 'completion_date'])
+    if not todos_df.empty:
+        daily['todos_created'] = count(todos_df['created_at'])
+        daily['todos_completed'] = count(todos_df.loc[todos_df['status'] == 'completed', 'completed_at'])
+    return daily
+
+
+class ActivityCube:
+    """以 (user_id, day) 为索引、各数据源指标为列的活动数据"""
+
+    def __init__(self, frame: pd.DataFrame, start_date: date, end_date: date):
+        self.frame = frame
+        self.start_date = start_date
+        self.end_date = end_date
+
+    @classmethod
+    def load(cls, start_date: date, end_date: date) -> 'ActivityCube':
+        """对每张源表执行一次聚合查询并构建立方体"""
+        params = {"start_date": start_date, "end_date": end_date, "tz": config.timezone}
+        frames = [db.query_to_dataframe(query, params)
+                  for query in (HABITS_QUERY, TODOS_QUERY, NOTES_QUERY, POMODOROS_QUERY)]
+        cube = cls.from_frames(frames, start_date, end_date)
+        logger.info(f"活动立方体: {len(cube.users())} 名用户, {len(cube.frame)} 个 (用户, 日期) 单元")
+        return cube
+
+    @classmethod
+    def from_frames(cls, frames: Iterable[pd.DataFrame], start_date: date, end_date: date) -> 'ActivityCube':
+        """合并各数据源按 (user_id, day) 聚合的结果，缺失的指标记为0"""
+        indexed = []
+        for frame in frames:
+            if frame.empty:
+                continue
+            frame = frame.copy()
+            frame['day'] = pd.to_datetime(frame['day']).dt.date
+            indexed.append(frame.set_index(['user_id', 'day']))
+
+        if indexed:
+            cube = pd.concat(indexed, axis=1, join='outer')
+        else:
+            cube = pd.DataFrame(index=pd.MultiIndex.from_arrays([[], []], names=['user_id', 'day']))
+        cube = cube.reindex(columns=METRICS).fillna(0).astype('int64').sort_index()
+        return cls(cube, start_date, end_date)
+
+    def covers(self, start_date: date, end_date: date) -> bool:
+        """立方体是否覆盖整个日期范围"""
+        return self.start_date <= start_date and end_date <= self.end_date
+
+    def days(self) -> List[date]:
+        """立方体覆盖的所有日期（包括没有任何活动的日期）"""
+        return [self.start_date + timedelta(days=i) for i in range((self.end_date - self.start_date).days + 1)]
+
+    def users(self) -> List[Any]:
+        """有活动记录的用户"""
+        return self.frame.index.get_level_values('user_id').unique().tolist()
+
+    def slice(self, users: Optional[Iterable[Any]] = None, start_date: Optional[date] = None,
+              end_date: Optional[date] = None) -> 'ActivityCube':
+        """按用户和日期范围切片，返回新的立方体"""
+        start_date = start_date or self.start_date
+        end_date = end_date or self.end_date
+        frame = self.frame
+        if users is not None:
+            frame = frame[frame.index.get_level_values('user_id').isin(list(users))]
+        day_values = frame.index.get_level_values('day')
+        frame = frame[(day_values >= start_date) & (day_values <= end_date)]
+        return ActivityCube(frame, start_date, end_date)
+
+    def user_days(self, user_id: Any) -> pd.DataFrame:
+        """某个用户每天的指标，没有活动的日期补0"""
+        if user_id in self.users():
+            frame = self.frame.xs(user_id, level='user_id')
+        else:
+            frame = self.frame.iloc[0:0].droplevel('user_id')
+        return frame.reindex(self.days(), fill_value=0).rename_axis('day')
+
+    def by_day(self) -> pd.DataFrame:
+        """所有用户按天汇总的指标，没有活动的日期补0"""
+        return self.frame.groupby(level='day').sum().reindex(self.days(), fill_value=0).rename_axis('day')
+
+    def by_user(self) -> pd.DataFrame:
+        """每个用户整个期间汇总的指标"""
+        return self.frame.groupby(level='user_id').sum()
+
+    def totals(self) -> Dict[str, int]:
+        """整个立方体的指标合计"""
+        return {metric: int(value) for metric, value in self.frame.sum().items()}
+
+    def daily_breakdown(self) -> Dict[str, Dict[str, Any]]:
+        """
+        按天的习惯完成、待办新建/完成和笔记新建/更新数量，日期为YYYY-MM-DD，只包含有记录的日期
+
+        返回结构与周报分析结果中的按天字段一致:
+            {"habits": {"daily_completion": ...}, "todos": {"daily_created": ..., "daily_completed": ...},
+             "notes": {"daily_created": ..., "daily_updated": ...}}
+        """
+        daily = self.by_day()
+        daily.index = daily.index.map(str)
+        habits = daily[daily['habits_total'] > 0]
+        completion = pd.DataFrame({'total': habits['habits_total'], 'completed': habits['habits_completed']})
+        completion['completion_rate'] = completion['completed'] / completion['total'] * 100
+
+        def counts(column: str) -> Dict[str, int]:
+            return daily.loc[daily[column] > 0, column].to_dict()
+
+        return {
+            "habits": {"daily_completion": completion.to_dict(orient='index')},
+            "todos": {"daily_created": counts('todos_created'), "daily_completed": counts('todos_completed')},
+            "notes": {"daily_created": counts('notes_created'), "daily_updated": counts('notes_updated')}
+        }
+
+    def chart_specs(self, prefix: str = 'activity') -> List[Dict[str, Any]]:
+        """按天汇总的趋势图描述，交给chart_render渲染"""
+        daily = add_rates(self.by_day())
+        daily.index = daily.index.map(str)
+        return [
+            {
+                "kind": "line",
+                "filename": f"{prefix}_completion_trend.png",
+                "title": "每日完成率趋势",
+                "xlabel": "日期",
+                "ylabel": "完成率 (%)",
+                "ylim": [0, 100],
+                "series": [
+                    make_series(daily['habit_completion_rate'].dropna().to_dict(), "习惯完成率", "blue"),
+                    make_series(daily['todo_completion_rate'].dropna().to_dict(), "待办完成率", "green")
+                ]
+            },
+            {
+                "kind": "bar",
+                "filename": f"{prefix}_focus_minutes.png",
+                "title": "每日专注时间",
+                "xlabel": "日期",
+                "ylabel": "分钟",
+                "series": [
+                    make_series(daily['focus_minutes'].to_dict(), "专注时间", "orange"),
+                    make_series(daily['completed_focus_minutes'].to_dict(), "完成的专注时间", "red")
+                ]
+            }
+        ]
+
+
+def _records(frame: pd.DataFrame) -> Dict[str, Dict[str, Any]]:
+    """把指标表转换为可写入JSON的 {索引: {指标: 值}}，缺失的完成率为None"""
+    frame = frame.astype(object).where(frame.notna(), None)
+    return {str(index): row for index, row in frame.to_dict(orient='index').items()}
+
+
+def generate_composite_report(days: int = 30, start_date: Optional[date] = None, end_date: Optional[date] = None,
+                              charts: bool = True, per_user: bool = False, weekly: bool = False,
+                              detail_charts: bool = False, output_dir: str = "output") -> Dict[str, Any]:
+    """
+    基于活动立方体生成综合报告：整体按天指标、每个用户的汇总指标和趋势图表
+
+    每张源表只查询一次；per_user 为True时还会为每个用户写入 output/<user_id>/ 下的按天指标。
+    weekly / detail_charts 为True时，周报（数据库聚合模式）和图表生成器的按天指标从同一个立方体切片，
+    它们的日期范围以今天为结尾，立方体没有覆盖时改为各自加载。
+    """
+    if not start_date or not end_date:
+        date_range = get_date_range(days)
+        start_date = date_range["start_date"].date()
+        end_date = date_range["end_date"].date()
+    start_date_str = start_date.strftime('%Y-%m-%d')
+    end_date_str = end_date.strftime('%Y-%m-%d')
+
+    logger.info(f"开始生成 {start_date_str} 至 {end_date_str} 的综合报告...")
+    cube = ActivityCube.load(start_date, end_date)
+
+    save_dataframe_to_csv(cube.frame.reset_index(), f"activity_cube_{start_date_str}_{end_date_str}.csv", output_dir)
+
+    report = {
+        "period": {
+            "start_date": start_date_str,
+            "end_date": end_date_str,
+            "days": len(cube.days())
+        },
+        "total_users": len(cube.users()),
+        "overall": _records(add_rates(pd.DataFrame([cube.totals()])))["0"],
+        "daily": _records(add_rates(cube.by_day())),
+        "users": _records(add_rates(cube.by_user()))
+    }
+    save_summary_to_json(report, f"composite_summary_{start_date_str}_{end_date_str}.json", output_dir)
+
+    if per_user:
+        for user_id in cube.users():
+            user_report = {
+                "user_id": user_id,
+                "period": report["period"],
+                "overall": report["users"][str(user_id)],
+                "daily": _records(add_rates(cube.user_days(user_id)))
+            }
+            save_summary_to_json(user_report, f"activity_{start_date_str}_{end_date_str}.json",
+                                 os.path.join(output_dir, str(user_id)))
+
+    if charts:
+        render_charts(cube.chart_specs(), output_dir)
+
+    if weekly:
+        from weekly_summary import generate_weekly_summary
+        weekly_range = get_date_range(7)
+        shared = cube.covers(weekly_range["start_date"].date(), weekly_range["end_date"].date())
+        if not shared:
+            logger.warning("活动立方体没有覆盖最近7天，周报单独加载按天数据")
+        generate_weekly_summary(7, pushdown=True, charts=charts, cube=cube if shared else None)
+
+    if detail_charts:
+        from generate_charts import generate_charts
+        chart_range = get_date_range(days)
+        shared = cube.covers(chart_range["start_date"].date(), chart_range["end_date"].date())
+        if not shared:
+            logger.warning(f"活动立方体没有覆盖最近{days}天，图表生成器使用自己查询的明细")
+        generate_charts(days, output_dir, cube=cube if shared else None)
+
+    logger.info(f"完成 {start_date_str} 至 {end_date_str} 的综合报告生成")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='基于活动立方体生成综合报告')
+    parser.add_argument('--days', type=int, default=30, help='天数范围')
+    parser.add_argument('--per-user', action='store_true', help='为每个用户单独输出按天指标')
+    parser.add_argument('--no-charts', action='store_true', help='不渲染图表')
+    parser.add_argument('--weekly', action='store_true', help='同时生成周报，按天数据从同一个立方体切片')
+    parser.add_argument('--detail-charts', action='store_true', help='同时运行图表生成器，按天数据从同一个立方体切片')
+    args = parser.parse_args()
+
+    result = generate_composite_report(args.days, charts=not args.no_charts, per_user=args.per_user,
+                                       weekly=args.weekly, detail_charts=args.detail_charts)
+    print(f"用户数: {result['total_users']}, 整体生产力得分: {result['overall']['productivity_score']:.2f}/100")
@@ -7,18 +7,124 @@ import os
 import json
 import logging
 import sys
-from typing import Dict, Any, Optional
+import time
+from typing import Dict, Any, Iterable, List, Optional
 from openai import OpenAI, BadRequestError, APITimeoutError, RateLimitError
 
+from model_router import ModelRouter
+from prompt_builder import build_compact_payload, estimate_tokens
+
 logger = logging.getLogger(__name__)
 
+# 每日洞察的生成参数，同步调用和批量请求共用
+INSIGHT_TEMPERATURE = 0.5
+INSIGHT_MAX_TOKENS = 1500
+
+# Batch API 的请求端点和完成时间窗口
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_COMPLETION_WINDOW = "24h"
+BATCH_FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+DAILY_INSIGHT_SYSTEM_PROMPT = """
+            你是一个专业的个人数据分析师，擅长从用户的习惯、待办事项、笔记和番茄钟数据中提取有价值的洞察。
+            你的任务是分析用户的数据，并生成一份详细的每日洞察报告。
+            请从以下几个方面进行分析：
+            1. 数据概览：简要总结当天的关键数据点
+            2. 习惯完成情况：分析习惯的完成率和模式
+            3. 待办事项分析：待办事项的完成情况和优先级处理
+            4. 番茄钟专注时间分析：专注时间分布和效率
+            5. 笔记内容分析：笔记的主题和关键点
+            6. 改进建议：基于数据提出具体的改进建议
+            7. 今日亮点：用户表现出色的地方
+            
+            请以第二人称（"你"）向用户提供分析，语气友好、专业且富有鼓励性。
+            将分析结果以易于阅读的Markdown格式返回。
+            """
+
+
+def build_daily_insight_messages(analysis_data: Dict[str, Any], date_str: str, user_id: str) -> List[Dict[str, str]]:
+    """构建每日洞察的对话消息，同步调用和批量请求使用同一份提示，数据部分使用紧凑序列化"""
+    payload, _ = build_compact_payload(analysis_data)
+    user_prompt = f"""
+            以下是用户ID为 {user_id} 在 {date_str} 的数据分析结果，空白的部分表示当天没有记录。
+            请分析这些数据并生成一份每日洞察报告。
+            
+            数据:
+            ```json
+            {payload}
+            ```
+            """
+    return [
+        {"role": "system", "content": DAILY_INSIGHT_SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt},
+    ]
+
+
+# 链式模式：各部分的子提示和最后的整合提示
+SECTION_MAX_TOKENS = 600
+
+SECTION_SYSTEM_PROMPTS = {
+    "habits": "你是一个个人数据分析师。请根据用户当天的习惯数据，分析习惯的完成率和模式，指出做得好的地方和需要改进的习惯。",
+    "todos": "你是一个个人数据分析师。请根据用户当天的待办事项数据，分析完成情况、逾期情况和优先级处理。",
+    "pomodoros": "你是一个个人数据分析师。请根据用户当天的番茄钟数据，分析专注时间的分布、完成情况和效率。",
+    "notes": "你是一个个人数据分析师。请根据用户当天的笔记数据，分析笔记的数量、主题和记录习惯。",
+}
+
+SECTION_OUTPUT_INSTRUCTION = "用第二人称（\"你\"）写3到5条简洁的要点，使用Markdown列表，不要标题。"
+
+MERGE_SYSTEM_PROMPT = """
+            你是一个专业的个人数据分析师。下面给出了用户当天各类数据的分项分析和整体数据。
+            请把它们整合为一份完整的每日洞察报告，包含：数据概览、习惯完成情况、待办事项分析、
+            番茄钟专注时间分析、笔记内容分析、改进建议和今日亮点。没有分项分析的部分说明当天没有记录。
+            请以第二人称（"你"）向用户提供分析，语气友好、专业且富有鼓励性，避免重复分项中的内容，
+            将结果以易于阅读的Markdown格式返回。
+            """
+
+
+def build_section_messages(section: str, section_data: Dict[str, Any], date_str: str) -> List[Dict[str, str]]:
+    """构建链式模式中单个部分的子提示"""
+    payload, _ = build_compact_payload({section: section_data})
+    return [
+        {"role": "system", "content": f"{SECTION_SYSTEM_PROMPTS[section]}{SECTION_OUTPUT_INSTRUCTION}"},
+        {"role": "user", "content": f"{date_str} 的数据:\n```json\n{payload}\n```"},
+    ]
+
+
+def build_merge_messages(section_reports: Dict[str, str], analysis_data: Dict[str, Any],
+                         date_str: str, user_id: str) -> List[Dict[str, str]]:
+    """构建链式模式中整合各部分分析的提示，只附带整体数据和每日总结"""
+    payload, _ = build_compact_payload({
+        "overall": analysis_data.get("overall"),
+        "daily_summary": analysis_data.get("daily_summary"),
+    })
+    reports = "\n\n".join(f"## {section}\n{report}" for section, report in section_reports.items())
+    user_prompt = f"""
+            以下是用户ID为 {user_id} 在 {date_str} 的分项分析和整体数据。
+            
+            分项分析:
+            {reports}
+            
+            整体数据:
+            ```json
+            {payload}
+            ```
+            """
+    return [
+        {"role": "system", "content": MERGE_SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt},
+    ]
+
+
+def messages_tokens(messages: List[Dict[str, str]]) -> int:
+    """估算对话消息的token数"""
+    return sum(estimate_tokens(message["content"]) for message in messages)
+
 
 class AIService:
     """OpenAI服务封装类，处理AI分析请求"""
 
     def __init__(self):
         """初始化OpenAI客户端"""
-        import random
         self.api_key = os.getenv("OPENAI_API_KEY")
         self.base_url = os.getenv("OPENAI_URL")
         openai_models_str = os.getenv("OPENAI_MODELS")
@@ -27,13 +133,14 @@ class AIService:
             logger.error("缺少OpenAI配置信息，请检查.env文件")
             sys.exit(1)
         
-        # 从逗号分隔的模型列表中随机选择一个
+        # 逗号分隔的模型列表，每次请求由路由器按延迟和错误率选择，self.model 为当前预计最快的模型
         self.models = [m.strip() for m in openai_models_str.split(",")]
-        self.model = random.choice(self.models)
+        self.router = ModelRouter(self.models)
+        self.model = self.router.choose(probe=False)
 
         try:
             self.client = OpenAI(api_key=self.api_key, base_url=self.base_url)
-            logger.info(f"OpenAI客户端初始化成功，使用模型: {self.model}")
+            logger.info(f"OpenAI客户端初始化成功，可用模型: {', '.join(self.models)}，当前首选: {self.model}")
         except Exception as e:
             logger.error(f"初始化OpenAI客户端失败: {str(e)}")
             sys.exit(1)
@@ -53,46 +160,8 @@ class AIService:
             包含AI分析结果的字典
         """
         try:
-            # 准备系统提示和用户提示
-            system_prompt = """
-            你是一个专业的个人数据分析师，擅长从用户的习惯、待办事项、笔记和番茄钟数据中提取有价值的洞察。
-            你的任务是分析用户的数据，并生成一份详细的每日洞察报告。
-            请从以下几个方面进行分析：
-            1. 数据概览：简要总结当天的关键数据点
-            2. 习惯完成情况：分析习惯的完成率和模式
-            3. 待办事项分析：待办事项的完成情况和优先级处理
-            4. 番茄钟专注时间分析：专注时间分布和效率
-            5. 笔记内容分析：笔记的主题和关键点
-            6. 改进建议：基于数据提出具体的改进建议
-            7. 今日亮点：用户表现出色的地方
-            
-            请以第二人称（"你"）向用户提供分析，语气友好、专业且富有鼓励性。
-            将分析结果以易于阅读的Markdown格式返回。
-            """
-
-            user_prompt = f"""
-            以下是用户ID为 {user_id} 在 {date_str} 的数据分析结果。
-            请分析这些数据并生成一份每日洞察报告。
-            
-            数据:
-            ```json
-            {json.dumps(analysis_data, ensure_ascii=False, indent=2)}
-            ```
-            """
-
             # 调用OpenAI API
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt},
-                ],
-                temperature=0.5,
-                max_tokens=1500,
-            )
-
-            # 提取AI响应内容
-            content = response.choices[0].message.content.strip()
+            content = self.complete(build_daily_insight_messages(analysis_data, date_str, user_id))
 
             # 构建结构化的返回格式
             content_json = {
@@ -117,6 +186,109 @@ class AIService:
             logger.error(f"调用OpenAI分析服务失败: {str(e)}")
             return {"success": False, "error": f"AI分析失败: {str(e)}"}
 
+    def complete(self, messages: List[Dict[str, str]], max_tokens: int = INSIGHT_MAX_TOKENS) -> str:
+        """由路由器选择模型完成一次对话，记录延迟和是否出错，返回去掉首尾空白的内容"""
+        payload_tokens = messages_tokens(messages)
+        model = self.router.choose(payload_tokens)
+        started = time.perf_counter()
+        try:
+            response = self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=INSIGHT_TEMPERATURE,
+                max_tokens=max_tokens,
+            )
+        except Exception:
+            self.router.record(model, time.perf_counter() - started, payload_tokens, success=False)
+            raise
+        self.router.record(model, time.perf_counter() - started, payload_tokens, success=True)
+        content = response.choices[0].message.content
+        return content.strip() if content else ""
+
+    def build_batch_request(self, custom_id: str, messages: List[Dict[str, str]],
+                            model: Optional[str] = None) -> Dict[str, Any]:
+        """构建Batch API请求文件中的一行，未指定模型时按提示大小选择（不试探）"""
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": {
+                "model": model or self.router.choose(messages_tokens(messages), probe=False),
+                "messages": messages,
+                "temperature": INSIGHT_TEMPERATURE,
+                "max_tokens": INSIGHT_MAX_TOKENS,
+            },
+        }
+
+    def write_batch_file(self, requests: Iterable[Dict[str, Any]], path: str) -> int:
+        """把请求写入JSONL文件，返回请求数量"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        count = 0
+        with open(path, "w", encoding="utf-8") as f:
+            for request in requests:
+                f.write(json.dumps(request, ensure_ascii=False) + "\n")
+                count += 1
+        return count
+
+    def submit_batch(self, path: str, metadata: Optional[Dict[str, str]] = None) -> str:
+        """上传请求文件并创建批处理任务，返回批处理ID"""
+        with open(path, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=BATCH_COMPLETION_WINDOW,
+            metadata=metadata,
+        )
+        logger.info(f"已提交批处理任务 {batch.id}，请求文件 {path}")
+        return batch.id
+
+    def wait_for_batch(self, batch_id: str, poll_interval: float = 60, timeout: Optional[float] = None):
+        """轮询批处理任务直到结束（完成、失败、过期或取消），超时抛出TimeoutError"""
+        started = time.monotonic()
+        while True:
+            batch = self.client.batches.retrieve(batch_id)
+            counts = batch.request_counts
+            if counts:
+                logger.info(f"批处理任务 {batch_id} 状态: {batch.status} "
+                            f"({counts.completed}/{counts.total} 完成, {counts.failed} 失败)")
+            if batch.status in BATCH_FINAL_STATUSES:
+                return batch
+            if timeout is not None and time.monotonic() - started > timeout:
+                raise TimeoutError(f"批处理任务 {batch_id} 在 {timeout} 秒内未完成，当前状态: {batch.status}")
+            time.sleep(poll_interval)
+
+    def fetch_batch_results(self, batch) -> Dict[str, Dict[str, Any]]:
+        """
+        下载批处理结果
+
+        返回:
+            {custom_id: {"success": True, "content": ...} 或 {"success": False, "error": ...}}
+        """
+        results: Dict[str, Dict[str, Any]] = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                response = item.get("response") or {}
+                body = response.get("body") or {}
+                if item.get("error") or response.get("status_code") != 200:
+                    error = item.get("error") or body.get("error") or f"HTTP {response.get('status_code')}"
+                    results[item["custom_id"]] = {"success": False, "error": str(error)}
+                    continue
+                content = body["choices"][0]["message"].get("content")
+                results[item["custom_id"]] = {
+                    "success": True,
+                    "content": content.strip() if content else "AI未能生成有效内容",
+                    "model": body.get("model"),
+                }
+        return results
+
 
 # 创建单例实例
 ai_service = AIService()
@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按日期范围回填摘要和洞察
+
+一次性查询整个日期范围的数据（每张表一次查询），在内存中按天拆分，
+再用线程池并行处理各天。每处理完一天都写入检查点文件，失败后重新运行会跳过已完成的日期。
+
+支持的任务:
+    summary     每日摘要 (daily_summary)
+    aggregates  滚动窗口摘要使用的按天聚合 (summary_aggregates)
+    insight     每个用户的每日AI洞察 (daily_insight)
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from db import COLUMN_TYPES, db, note_text_columns
+from prompt_builder import prompt_stats
+from utils import get_day_start, get_today
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_TASKS = ('summary', 'aggregates', 'insight')
+
+
+class BackfillCheckpoint:
+    """记录每个任务已完成的日期，保存为JSON文件，每次更新后立即落盘"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.state: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+
+    def is_done(self, task: str, day: date) -> bool:
+        return self.state.get(task, {}).get(day.isoformat(), {}).get("status") == "done"
+
+    def mark(self, task: str, day: date, status: str, **details) -> None:
+        with self.lock:
+            self.state.setdefault(task, {})[day.isoformat()] = {
+                "status": status,
+                "updated_at": datetime.now().isoformat(timespec='seconds'),
+                **details
+            }
+            self._save()
+
+    def _save(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        temp_file = f"{self.path}.tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2, default=str)
+        os.replace(temp_file, self.path)
+
+
+def date_span(start_date: date, end_date: date) -> List[date]:
+    """start_date 到 end_date（含）之间的所有日期"""
+    return [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+
+
+def index_by_day(df: pd.DataFrame, date_columns: Iterable[str]) -> Dict[date, np.ndarray]:
+    """
+    计算每一天对应的行位置，任一日期列等于该天的行都属于这一天
+
+    例如待办事项在创建日和完成日都会出现，与单日查询
+    WHERE DATE(created_at) = d OR DATE(completed_at) = d 的结果一致。
+    日期列可以是 datetime.date，也可以是按 COLUMN_TYPES 解析出的带时区时间戳，键统一为 datetime.date。
+    """
+    if df.empty:
+        return {}
+    positions = np.arange(len(df))
+    pairs = pd.concat(
+        [pd.DataFrame({'day': pd.to_datetime(df[column]).dt.date.to_numpy(), 'pos': positions})
+         for column in date_columns],
+        ignore_index=True
+    ).dropna(subset=['day']).drop_duplicates()
+    return {day: group['pos'].to_numpy() for day, group in pairs.groupby('day')}
+
+
+def _take(df: pd.DataFrame, index: Dict[date, np.ndarray], day: date) -> pd.DataFrame:
+    """取出某一天的行，没有数据时返回保留列结构的空DataFrame"""
+    positions = index.get(day)
+    if positions is None:
+        return df.iloc[0:0]
+    return df.iloc[positions].reset_index(drop=True)
+
+
+def load_summary_range(start_date: date, end_date: date) -> Dict[str, pd.DataFrame]:
+    """查询范围内每日摘要需要的数据，日期列在数据库中计算，拆分结果与单日查询一致"""
+    params = {"start_date": start_date, "end_date": end_date}
+    habits_df = db.query_to_dataframe("""
+    SELECT
+        h.id, h.name, h.description, h.category,
+        hc.completion_date, hc.is_completed
+    FROM habits h
+    JOIN habit_completions hc ON h.id = hc.habit_id
+    WHERE hc.completion_date BETWEEN %(start_date)s AND %(end_date)s
+    ORDER BY h.category, h.name
+    """, params, **COLUMN_TYPES['habits'])
+    todos_df = db.query_to_dataframe("""
+    SELECT
+        id, title, description, status, due_date, completed_at,
+        priority, created_at, updated_at, tags,
+        DATE(created_at) AS created_date, DATE(completed_at) AS completed_date
+    FROM todos
+    WHERE (DATE(created_at) BETWEEN %(start_date)s AND %(end_date)s)
+       OR (DATE(completed_at) BETWEEN %(start_date)s AND %(end_date)s)
+    ORDER BY priority DESC, created_at
+    """, params, **COLUMN_TYPES['todos'])
+    notes_df = db.query_to_dataframe(f"""
+    SELECT
+        id, title, {note_text_columns()}, tags, created_at, updated_at,
+        DATE(created_at) AS created_date, DATE(updated_at) AS updated_date
+    FROM notes
+    WHERE (DATE(created_at) BETWEEN %(start_date)s AND %(end_date)s)
+       OR (DATE(updated_at) BETWEEN %(start_date)s AND %(end_date)s)
+    ORDER BY created_at
+    """, params, **COLUMN_TYPES['notes'])
+    return {
+        "habits": habits_df,
+        "todos": todos_df,
+        "notes": notes_df,
+        "habits_index": index_by_day(habits_df, ['completion_date']),
+        "todos_index": index_by_day(todos_df, ['created_date', 'completed_date']),
+        "notes_index": index_by_day(notes_df, ['created_date', 'updated_date'])
+    }
+
+
+def backfill_summary_day(data: Dict[str, Any], day: date) -> Dict[str, Any]:
+    """用拆分出的单日数据生成每日摘要"""
+    from daily_summary import summarize_day
+
+    habits_df = _take(data["habits"], data["habits_index"], day)
+    todos_df = _take(data["todos"], data["todos_index"], day).drop(columns=['created_date', 'completed_date'])
+    notes_df = _take(data["notes"], data["notes_index"], day).drop(columns=['created_date', 'updated_date'])
+    summary = summarize_day(get_day_start(day), habits_df, todos_df, notes_df)
+    return {"productivity_score": summary["overall"]["productivity_score"]}
+
+
+def load_insight_range(start_date: date, end_date: date) -> Dict[str, Any]:
+    """查询范围内所有用户的洞察数据（每张表一次查询），带 user_id 和按天拆分用的日期列"""
+    params = {"start_date": start_date, "end_date": end_date}
+    habits_df = db.query_to_dataframe("""
+    SELECT
+        h.user_id, h.id, h.name, h.description, h.category, h.frequency,
+        he.completed_at, he.status, he.comment, he.difficulty,
+        DATE(he.completed_at) AS entry_date
+    FROM habits h
+    JOIN habit_entries he ON h.id = he.habit_id
+    WHERE DATE(he.completed_at) BETWEEN %(start_date)s AND %(end_date)s
+    ORDER BY h.category, h.name
+    """, params, **COLUMN_TYPES['habit_entries'])
+    todos_df = db.query_to_dataframe("""
+    SELECT
+        user_id, id, title, description, status, priority, due_date,
+        completed_at, created_at, updated_at,
+        DATE(created_at) AS created_date, DATE(completed_at) AS completed_date,
+        DATE(updated_at) AS updated_date
+    FROM todos
+    WHERE (DATE(created_at) BETWEEN %(start_date)s AND %(end_date)s)
+       OR (DATE(completed_at) BETWEEN %(start_date)s AND %(end_date)s)
+       OR (DATE(updated_at) BETWEEN %(start_date)s AND %(end_date)s)
+    ORDER BY priority DESC, created_at
+    """, params, **COLUMN_TYPES['todos'])
+    notes_df = db.query_to_dataframe(f"""
+    SELECT
+        user_id, id, title, {note_text_columns()}, category, created_at, updated_at,
+        DATE(created_at) AS created_date, DATE(updated_at) AS updated_date
+    FROM notes
+    WHERE (DATE(created_at) BETWEEN %(start_date)s AND %(end_date)s)
+       OR (DATE(updated_at) BETWEEN %(start_date)s AND %(end_date)s)
+    ORDER BY created_at
+    """, params, **COLUMN_TYPES['notes'])
+    pomodoros_df = db.query_to_dataframe("""
+    SELECT
+        user_id, id, title, description, duration, status,
+        start_time, end_time, habit_id, todo_id, goal_id,
+        DATE(start_time) AS start_date
+    FROM pomodoros
+    WHERE DATE(start_time) BETWEEN %(start_date)s AND %(end_date)s
+    ORDER BY start_time
+    """, params, **COLUMN_TYPES['pomodoros'])
+    summaries = db.execute_query("""
+    SELECT
+        user_id, id, date, content, ai_summary, ai_feedback_actions
+    FROM daily_summaries
+    WHERE date BETWEEN %(start_date)s AND %(end_date)s
+    """, {"start_date": start_date.isoformat(), "end_date": end_date.isoformat()})
+    tag_rows = db.execute_query("""
+    SELECT
+        ptr.pomodoro_id, t.id, t.name, t.color
+    FROM pomodoro_tag_relations ptr
+    JOIN pomodoros p ON p.id = ptr.pomodoro_id
+    JOIN tags t ON ptr.tag_id = t.id AND t.user_id = p.user_id
+    WHERE DATE(p.start_time) BETWEEN %(start_date)s AND %(end_date)s
+    """, params)
+
+    tags_by_pomodoro: Dict[int, List[Dict]] = {}
+    for row in tag_rows:
+        tags_by_pomodoro.setdefault(row['pomodoro_id'], []).append({
+            'id': row['id'],
+            'name': row['name'],
+            'color': row['color']
+        })
+
+    summaries_by_key = {}
+    for row in summaries:
+        user_id = row.pop('user_id')
+        summaries_by_key[(user_id, str(row['date'])[:10])] = row
+
+    return {
+        "habits": habits_df,
+        "todos": todos_df,
+        "notes": notes_df,
+        "pomodoros": pomodoros_df,
+        "habits_index": index_by_day(habits_df, ['entry_date']),
+        "todos_index": index_by_day(todos_df, ['created_date', 'completed_date', 'updated_date']),
+        "notes_index": index_by_day(notes_df, ['created_date', 'updated_date']),
+        "pomodoros_index": index_by_day(pomodoros_df, ['start_date']),
+        "daily_summaries": summaries_by_key,
+        "pomodoro_tags": tags_by_pomodoro
+    }
+
+
+# 只用于按天拆分的日期列，传给分析函数前去掉，使每个用户的数据与单日查询的结果列一致
+SPLIT_DATE_COLUMNS = ['entry_date', 'created_date', 'completed_date', 'updated_date', 'start_date']
+
+
+def backfill_insight_day(data: Dict[str, Any], day: date, force: bool = False) -> Dict[str, Any]:
+    """为某一天有数据的每个用户创建AI洞察"""
+    from daily_insight import process_user_day
+
+    day_str = day.isoformat()
+    by_user: Dict[str, Dict[Any, pd.DataFrame]] = {}
+    empty: Dict[str, pd.DataFrame] = {}
+    for name in ('habits', 'todos', 'notes', 'pomodoros'):
+        frame = _take(data[name], data[f"{name}_index"], day)
+        frame = frame.drop(columns=[column for column in SPLIT_DATE_COLUMNS if column in frame.columns])
+        by_user[name] = {
+            user_id: group.drop(columns=['user_id']).reset_index(drop=True)
+            for user_id, group in frame.groupby('user_id', observed=True)
+        }
+        empty[name] = frame.drop(columns=['user_id']).iloc[0:0]
+
+    users = set(user_id for user_id, summary_date in data["daily_summaries"] if summary_date == day_str)
+    for frames in by_user.values():
+        users.update(frames)
+
+    def user_frame(name: str, user_id: Any) -> pd.DataFrame:
+        return by_user[name].get(user_id, empty[name])
+
+    target_date = get_day_start(day)
+    results = {"users": len(users), "success": 0, "no_data": 0, "errors": {}}
+    for user_id in sorted(users, key=str):
+        pomodoros_df = user_frame('pomodoros', user_id)
+        pomodoro_tags = {
+            pomodoro_id: data["pomodoro_tags"][pomodoro_id]
+            for pomodoro_id in pomodoros_df['id'].tolist() if pomodoro_id in data["pomodoro_tags"]
+        }
+        try:
+            result = process_user_day(
+                user_id, target_date,
+                user_frame('habits', user_id), user_frame('todos', user_id), user_frame('notes', user_id),
+                pomodoros_df, pomodoro_tags, data["daily_summaries"].get((user_id, day_str), {}), force
+            )
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
+
+        if result.get("success"):
+            results["success"] += 1
+        elif result.get("reason") == "no_data":
+            results["no_data"] += 1
+        else:
+            results["errors"][str(user_id)] = result.get("error")
+
+    if results["errors"]:
+        raise RuntimeError(f"{len(results['errors'])} 名用户的洞察创建失败: {results['errors']}")
+    return results
+
+
+def backfill_aggregates(days: List[date], checkpoint: BackfillCheckpoint) -> None:
+    """一次查询、计算并写入所有待处理日期的按天聚合"""
+    from summary_aggregates import compute_daily_aggregates, load_window_data, save_daily_aggregates
+
+    habits_df, todos_df, notes_df = load_window_data(min(days), max(days))
+    save_daily_aggregates(compute_daily_aggregates(habits_df, todos_df, notes_df, days))
+    # 还没有结束的日期不会被存储，不记入检查点
+    today = get_today().date()
+    for day in days:
+        if day < today:
+            checkpoint.mark('aggregates', day, 'done')
+    logger.info(f"已回填 {len(days)} 天的按天聚合")
+
+
+def _run_days(task: str, days: List[date], worker, checkpoint: BackfillCheckpoint, workers: int) -> Dict[str, int]:
+    """并行处理各天，每天完成后写检查点"""
+    counts = {"done": 0, "failed": 0}
+
+    def run(day: date) -> bool:
+        try:
+            details = worker(day) or {}
+            checkpoint.mark(task, day, 'done', **details)
+            logger.info(f"[{task}] {day} 完成")
+            return True
+        except Exception as e:
+            checkpoint.mark(task, day, 'failed', error=str(e))
+            logger.error(f"[{task}] {day} 失败: {str(e)}")
+            return False
+
+    if workers <= 1:
+        outcomes = [run(day) for day in days]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            outcomes = [future.result() for future in as_completed([executor.submit(run, day) for day in days])]
+
+    counts["done"] = sum(outcomes)
+    counts["failed"] = len(outcomes) - counts["done"]
+    return counts
+
+
+def run_backfill(start_date: date, end_date: date, tasks: Iterable[str] = ('summary',),
+                 workers: int = 4, checkpoint_path: Optional[str] = None,
+                 force: bool = False) -> Dict[str, Dict[str, int]]:
+    """
+    回填 start_date 到 end_date（含）之间每一天的数据
+
+    参数:
+        tasks: 要回填的任务，见 BACKFILL_TASKS
+        workers: 并行处理的天数
+        checkpoint_path: 检查点文件路径，默认 output/backfill_checkpoint.json
+        force: 忽略检查点，重新处理已完成的日期
+    """
+    if end_date < start_date:
+        raise ValueError(f"结束日期 {end_date} 早于开始日期 {start_date}")
+    unknown = set(tasks) - set(BACKFILL_TASKS)
+    if unknown:
+        raise ValueError(f"未知的回填任务: {', '.join(sorted(unknown))}")
+
+    checkpoint = BackfillCheckpoint(checkpoint_path or os.path.join("output", "backfill_checkpoint.json"))
+    all_days = date_span(start_date, end_date)
+    results = {}
+
+    for task in tasks:
+        pending = [day for day in all_days if force or not checkpoint.is_done(task, day)]
+        logger.info(f"[{task}] 共 {len(all_days)} 天，待处理 {len(pending)} 天")
+        if not pending:
+            results[task] = {"done": 0, "failed": 0, "skipped": len(all_days)}
+            continue
+
+        if task == 'aggregates':
+            backfill_aggregates(pending, checkpoint)
+            results[task] = {"done": len(pending), "failed": 0}
+        elif task == 'summary':
+            data = load_summary_range(min(pending), max(pending))
+            results[task] = _run_days(task, pending, lambda day: backfill_summary_day(data, day), checkpoint, workers)
+        else:
+            data = load_insight_range(min(pending), max(pending))
+            from ai_service import ai_service
+            prompt_stats.reset()
+            ai_service.router.reset_run()
+            results[task] = _run_days(task, pending, lambda day: backfill_insight_day(data, day, force),
+                                      checkpoint, workers)
+            prompt_stats.log_summary()
+            ai_service.router.save()
+        results[task]["skipped"] = len(all_days) - len(pending)
+        logger.info(f"[{task}] 完成 {results[task]['done']} 天，失败 {results[task]['failed']} 天")
+
+    return results
+
+
+def parse_date(value: str) -> date:
+    """解析 YYYY-MM-DD 格式的日期"""
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='按日期范围回填摘要和洞察')
+    parser.add_argument('--start', required=True, type=parse_date, help='开始日期 (YYYY-MM-DD)')
+    parser.add_argument('--end', required=True, type=parse_date, help='结束日期 (YYYY-MM-DD)，包含当天')
+    parser.add_argument('--tasks', default='summary', help=f"逗号分隔的任务列表: {', '.join(BACKFILL_TASKS)}")
+    parser.add_argument('--workers', type=int, default=4, help='并行处理的天数')
+    parser.add_argument('--checkpoint', help='检查点文件路径')
+    parser.add_argument('--force', action='store_true', help='忽略检查点，重新处理所有日期')
+    args = parser.parse_args()
+
+    results = run_backfill(args.start, args.end, [t.strip() for t in args.tasks.split(',') if t.strip()],
+                           args.workers, args.checkpoint, args.force)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
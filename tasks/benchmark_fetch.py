@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+查询结果读取方式基准测试
+
+对同一个查询分别使用普通路径（psycopg2逐行读取后由pandas组装）和Arrow路径
+（ADBC驱动通过二进制COPY直接解码为Arrow列）读取，比较耗时和DataFrame内存占用。
+
+用法:
+    python benchmark_fetch.py --table todos --days 365 --repeat 3
+"""
+import argparse
+import logging
+import time
+from typing import Any, Callable, Dict, List
+
+import pandas as pd
+from tabulate import tabulate
+
+from db import COLUMN_TYPES, arrow_fetch_available, db
+from utils import get_date_range
+
+logger = logging.getLogger(__name__)
+
+BENCHMARK_QUERIES = {
+    'todos': """
+    SELECT
+        id, title, description, status, due_date, completed_at,
+        priority, created_at, updated_at, tags
+    FROM todos
+    WHERE (DATE(created_at) BETWEEN %(start_date)s AND %(end_date)s)
+       OR (DATE(completed_at) BETWEEN %(start_date)s AND %(end_date)s)
+    """,
+    'habit_entries': """
+    SELECT
+        h.id, h.name, h.category, h.frequency,
+        he.completed_at, he.status, he.comment, he.difficulty
+    FROM habits h
+    JOIN habit_entries he ON h.id = he.habit_id
+    WHERE DATE(he.completed_at) BETWEEN %(start_date)s AND %(end_date)s
+    """,
+    'notes': """
+    SELECT
+        id, title, content, category, created_at, updated_at
+    FROM notes
+    WHERE (DATE(created_at) BETWEEN %(start_date)s AND %(end_date)s)
+       OR (DATE(updated_at) BETWEEN %(start_date)s AND %(end_date)s)
+    """,
+    'pomodoros': """
+    SELECT
+        id, title, description, duration, status,
+        start_time, end_time, habit_id, todo_id, goal_id
+    FROM pomodoros
+    WHERE DATE(start_time) BETWEEN %(start_date)s AND %(end_date)s
+    """
+}
+
+
+def time_fetch(fetch: Callable[[], pd.DataFrame], repeat: int = 3) -> Dict[str, Any]:
+    """重复执行读取函数，记录最快和平均耗时以及结果的内存占用"""
+    timings: List[float] = []
+    df = pd.DataFrame()
+    for _ in range(repeat):
+        started = time.perf_counter()
+        df = fetch()
+        timings.append(time.perf_counter() - started)
+    return {
+        "rows": len(df),
+        "best_seconds": min(timings),
+        "mean_seconds": sum(timings) / len(timings),
+        "memory_mb": df.memory_usage(deep=True).sum() / 1024 / 1024
+    }
+
+
+def run_benchmark(table: str = 'todos', days: int = 365, repeat: int = 3) -> Dict[str, Dict[str, Any]]:
+    """用同一个查询和列类型比较普通路径与Arrow路径"""
+    date_range = get_date_range(days)
+    params = {
+        "start_date": date_range["start_date"].date(),
+        "end_date": date_range["end_date"].date()
+    }
+    query = BENCHMARK_QUERIES[table]
+    column_types = COLUMN_TYPES[table]
+
+    results = {
+        "default": time_fetch(lambda: db.query_to_dataframe(query, params, arrow=False, **column_types), repeat)
+    }
+    if arrow_fetch_available():
+        results["arrow"] = time_fetch(lambda: db.query_to_dataframe(query, params, arrow=True, **column_types), repeat)
+    else:
+        logger.warning("未安装 adbc-driver-postgresql 或 pyarrow，只测试普通路径")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='比较普通查询和Arrow读取的耗时与内存占用')
+    parser.add_argument('--table', choices=sorted(BENCHMARK_QUERIES), default='todos', help='测试的数据表')
+    parser.add_argument('--days', type=int, default=365, help='查询的天数范围')
+    parser.add_argument('--repeat', type=int, default=3, help='每种方式重复次数')
+    args = parser.parse_args()
+
+    results = run_benchmark(args.table, args.days, args.repeat)
+    rows = [
+        [path, result["rows"], f"{result['best_seconds']:.3f}", f"{result['mean_seconds']:.3f}",
+         f"{result['memory_mb']:.1f}"]
+        for path, result in results.items()
+    ]
+    print(tabulate(rows, headers=["读取方式", "行数", "最快(秒)", "平均(秒)", "内存(MB)"], tablefmt="grid"))
+    if "arrow" in results and results["arrow"]["best_seconds"] > 0:
+        print(f"Arrow路径加速: {results['default']['best_seconds'] / results['arrow']['best_seconds']:.2f}x")
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+按内容寻址的图表缓存
+
+以图表类型、样式、DPI和输入数据的哈希作为键缓存已渲染的图片。
+键相同时直接把缓存的图片硬链接（跨文件系统时复制）到输出路径，跳过渲染；
+缓存目录按总大小淘汰最久未使用的文件，并统计命中率。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+import pandas as pd
+import matplotlib
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+def _hash_data(hasher, data: Any) -> None:
+    """把图表的输入数据写入哈希"""
+    if isinstance(data, pd.DataFrame):
+        hasher.update(repr(list(data.columns)).encode('utf-8'))
+        hasher.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    elif isinstance(data, pd.Series):
+        hasher.update(repr(data.name).encode('utf-8'))
+        hasher.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    elif isinstance(data, np.ndarray):
+        hasher.update(f"{data.dtype}{data.shape}".encode('utf-8'))
+        hasher.update(np.ascontiguousarray(data).tobytes())
+    elif isinstance(data, (list, tuple)):
+        hasher.update(f"seq{len(data)}".encode('utf-8'))
+        for item in data:
+            _hash_data(hasher, item)
+    else:
+        hasher.update(json.dumps(data, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8'))
+
+
+class ChartCache:
+    """图表缓存，缓存文件以键命名保存在cache_dir中，按修改时间做LRU淘汰"""
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: Optional[int] = None):
+        if not cache_dir:
+            cache_dir = config.chart_cache_dir or os.path.join(os.path.dirname(__file__), 'output', '.chart_cache')
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes if max_bytes is not None else config.chart_cache_max_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(chart_type: str, data: Any, style: str = '', dpi: Optional[int] = None, **params) -> str:
+        """根据图表类型、样式、DPI、其他绘图参数和输入数据计算缓存键"""
+        hasher = hashlib.sha256()
+        header = {
+            "chart_type": chart_type,
+            "style": style,
+            "dpi": dpi,
+            "params": params,
+            "matplotlib": matplotlib.__version__
+        }
+        hasher.update(json.dumps(header, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8'))
+        _hash_data(hasher, data)
+        return hasher.hexdigest()
+
+    def _path(self, key: str, output_file: str) -> str:
+        return os.path.join(self.cache_dir, key + os.path.splitext(output_file)[1])
+
+    @staticmethod
+    def _link(source: str, target: str) -> None:
+        """硬链接文件，失败时（如跨文件系统）改为复制"""
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copy2(source, target)
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def fetch(self, key: str, output_file: str) -> bool:
+        """
+        命中时把缓存的图片放到output_file并返回True
+
+        未命中时会先删除已有的output_file，避免随后渲染时覆盖与缓存共享的硬链接文件。
+        """
+        cached = self._path(key, output_file)
+        self._remove(output_file)
+        if os.path.exists(cached):
+            try:
+                self._link(cached, output_file)
+                os.utime(cached)
+                self.hits += 1
+                return True
+            except OSError as e:
+                logger.warning(f"读取图表缓存失败: {str(e)}")
+        self.misses += 1
+        return False
+
+    def store(self, key: str, output_file: str) -> None:
+        """把新渲染的图片放入缓存，然后按容量淘汰旧文件"""
+        if not os.path.exists(output_file):
+            return
+        cached = self._path(key, output_file)
+        temp_file = f"{cached}.{os.getpid()}.tmp"
+        try:
+            self._remove(temp_file)
+            self._link(output_file, temp_file)
+            os.replace(temp_file, cached)
+        except OSError as e:
+            logger.warning(f"写入图表缓存失败: {str(e)}")
+            self._remove(temp_file)
+            return
+        self.evict()
+
+    def render(self, key: str, output_file: str, render_fn: Callable[[], Any]) -> str:
+        """读穿方式渲染：命中时直接复用缓存，否则调用render_fn生成output_file后写入缓存"""
+        if not self.fetch(key, output_file):
+            render_fn()
+            self.store(key, output_file)
+        return output_file
+
+    def evict(self) -> int:
+        """缓存总大小超过max_bytes时删除最久未使用的文件，返回删除的文件数"""
+        entries = []
+        total = 0
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+            removed += 1
+        return removed
+
+    def info(self) -> Dict[str, Any]:
+        """命中统计信息"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0
+        }
+
+    def log_stats(self) -> None:
+        """输出命中率"""
+        info = self.info()
+        if info["hits"] + info["misses"]:
+            logger.info(f"图表缓存: 命中 {info['hits']} 次, 未命中 {info['misses']} 次, 命中率 {info['hit_rate']:.1%}")
+
+
+_default_cache = None
+
+
+def get_chart_cache() -> ChartCache:
+    """获取进程内共享的默认图表缓存"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ChartCache()
+    return _default_cache
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+延迟图表渲染
+
+分析函数只返回图表描述（chart spec，纯数据的字典），由这里的渲染阶段统一绘制。
+渲染可以跳过、在当前进程中执行，或者分发到进程池；matplotlib只在真正渲染时才导入，
+只需要数据的调用方完全不会加载绘图库。
+
+图表描述格式:
+    {
+        "kind": "line" | "bar",
+        "filename": "weekly_habits_trend.png",
+        "title": "...", "xlabel": "...", "ylabel": "...",
+        "ylim": [0, 100],                    # 可选
+        "figsize": [10, 6],                  # 可选
+        "series": [{"x": [...], "y": [...], "label": "...", "color": "..."}]
+    }
+"""
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+ChartSpec = Dict[str, Any]
+
+
+def make_series(data: Dict[Any, Any], label: Optional[str] = None, color: Optional[str] = None) -> Dict[str, Any]:
+    """把 {日期: 数值} 字典转换为图表描述中的一条数据序列，按x排序，x统一为字符串"""
+    points = sorted((str(key), value) for key, value in data.items())
+    return {
+        "x": [x for x, _ in points],
+        "y": [y for _, y in points],
+        "label": label,
+        "color": color
+    }
+
+
+def render_chart(spec: ChartSpec, output_dir: str = "output") -> str:
+    """按图表描述绘制并保存一张图表，返回文件路径"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import numpy as np
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+    output_file = os.path.join(output_dir, spec["filename"])
+
+    fig, ax = plt.subplots(figsize=tuple(spec.get("figsize", (12, 6))))
+    series = spec.get("series", [])
+    if spec["kind"] == "line":
+        for item in series:
+            ax.plot(item["x"], item["y"], label=item.get("label"), color=item.get("color"), marker='o')
+        ax.grid(True)
+    else:
+        # 多条柱状序列按x的并集对齐，缺失的日期记为0
+        categories = sorted({x for item in series for x in item["x"]})
+        positions = np.arange(len(categories))
+        for item in series:
+            values = dict(zip(item["x"], item["y"]))
+            ax.bar(positions, [values.get(x, 0) for x in categories],
+                   color=item.get("color"), alpha=0.6, label=item.get("label"))
+        ax.set_xticks(positions)
+        ax.set_xticklabels(categories, rotation=90)
+        ax.grid(True, axis='y')
+
+    ax.set_title(spec.get("title", ""))
+    ax.set_xlabel(spec.get("xlabel", ""))
+    ax.set_ylabel(spec.get("ylabel", ""))
+    if spec.get("ylim"):
+        ax.set_ylim(*spec["ylim"])
+    if any(item.get("label") for item in series):
+        ax.legend()
+
+    fig.tight_layout()
+    fig.savefig(output_file)
+    plt.close(fig)
+    return output_file
+
+
+def render_charts(specs: List[ChartSpec], output_dir: str = "output", workers: Optional[int] = None) -> List[str]:
+    """
+    渲染一组图表描述
+
+    参数:
+        workers: 渲染进程数，None或1时在当前进程中依次渲染
+    返回:
+        成功保存的文件路径列表
+    """
+    files = []
+    if not specs:
+        return files
+
+    if not workers or workers <= 1 or len(specs) == 1:
+        for spec in specs:
+            try:
+                files.append(render_chart(spec, output_dir))
+            except Exception as e:
+                logger.error(f"渲染图表 {spec.get('filename')} 失败: {str(e)}")
+        return files
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(render_chart, spec, output_dir): spec.get("filename") for spec in specs}
+        for future in as_completed(futures):
+            try:
+                files.append(future.result())
+            except Exception as e:
+                logger.error(f"渲染图表 {futures[future]} 失败: {str(e)}")
+    return files
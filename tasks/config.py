@@ -15,6 +15,10 @@ class DatabaseConfig(BaseModel):
     connection_string: str = os.getenv("POSTGRES_URL", "")
     if connection_string and not connection_string.startswith("postgresql://") and connection_string.startswith("postgres://"):
         connection_string = connection_string.replace("postgres://", "postgresql://", 1)
+    # 查询结果的类型后端: 空值(NumPy)、numpy_nullable 或 pyarrow
+    dtype_backend: str = os.getenv("DB_DTYPE_BACKEND", "")
+    # 安装了 adbc-driver-postgresql 时通过Arrow读取查询结果
+    arrow_fetch: bool = os.getenv("DB_ARROW_FETCH", "False").lower() == "true"
 
     def get_connection_string(self) -> str:
         """获取数据库连接字符串"""
@@ -28,6 +32,13 @@ class Config(BaseModel):
     debug: bool = os.getenv("DEBUG", "False").lower() == "true"
     log_level: str = os.getenv("LOG_LEVEL", "INFO")
     timezone: str = os.getenv("TZ", "Asia/Shanghai")
+    chart_cache_dir: str = os.getenv("CHART_CACHE_DIR", "")
+    chart_cache_max_mb: int = int(os.getenv("CHART_CACHE_MAX_MB", "512"))
+    # 每日洞察提示中数据部分的token预算
+    prompt_token_budget: int = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))
+    # 模型路由的统计文件和随机试探其他模型的概率
+    model_router_stats_path: str = os.getenv("MODEL_ROUTER_STATS", "output/model_router.json")
+    model_probe_rate: float = float(os.getenv("MODEL_PROBE_RATE", "0.1"))
 
 # 创建全局配置实例
 config = Config()
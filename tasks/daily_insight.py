@@ -10,21 +10,32 @@ import pandas as pd
 import json
 import os
 import argparse
-import sys
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from typing import Dict, List, Any, Optional, Tuple
 
-from db import db
-from utils import get_yesterday, save_dataframe_to_csv, save_summary_to_json
+from psycopg2.extras import Json, execute_values
+
+from db import COLUMN_TYPES, db, note_text_columns
+from utils import get_day_start, get_yesterday, save_dataframe_to_csv, save_summary_to_json
 from data_analysis import (
     analyze_habits_data, analyze_todos_data, 
     analyze_notes_data, analyze_pomodoros_data,
     combine_analysis_data
 )
-from ai_service import ai_service
+from ai_service import (
+    INSIGHT_MAX_TOKENS, SECTION_MAX_TOKENS, ai_service, build_daily_insight_messages,
+    build_merge_messages, build_section_messages
+)
+from prompt_builder import compact_value, prompt_stats
 
 logger = logging.getLogger(__name__)
 
+# 链式模式分别分析的部分
+CHAIN_SECTIONS = ("habits", "todos", "pomodoros", "notes")
+
 def get_yesterday_habits_data(user_id: str, target_date: Optional[datetime] = None) -> pd.DataFrame:
     """获取指定日期的习惯数据"""
     date = target_date if target_date else get_yesterday()
@@ -38,7 +49,7 @@ def get_yesterday_habits_data(user_id: str, target_date: Optional[datetime] = No
     AND h.user_id = %(user_id)s
     ORDER BY h.category, h.name
     """
-    return db.query_to_dataframe(query, {"date": date.date(), "user_id": user_id})
+    return db.query_to_dataframe(query, {"date": date.date(), "user_id": user_id}, **COLUMN_TYPES['habit_entries'])
 
 def get_yesterday_todos(user_id: str, target_date: Optional[datetime] = None) -> pd.DataFrame:
     """获取指定日期的待办事项数据"""
@@ -52,20 +63,21 @@ def get_yesterday_todos(user_id: str, target_date: Optional[datetime] = None) ->
     AND user_id = %(user_id)s
     ORDER BY priority DESC, created_at
     """
-    return db.query_to_dataframe(query, {"date": date.date(), "user_id": user_id})
+    return db.query_to_dataframe(query, {"date": date.date(), "user_id": user_id}, **COLUMN_TYPES['todos'])
 
-def get_yesterday_notes(user_id: str, target_date: Optional[datetime] = None) -> pd.DataFrame:
-    """获取指定日期的笔记数据"""
+def get_yesterday_notes(user_id: str, target_date: Optional[datetime] = None,
+                        include_content: bool = False) -> pd.DataFrame:
+    """获取指定日期的笔记数据，默认只返回正文长度和行数，include_content为True时附带正文"""
     date = target_date if target_date else get_yesterday()
-    query = """
+    query = f"""
     SELECT 
-        id, title, content, category, created_at, updated_at
+        id, title, {note_text_columns(include_content)}, category, created_at, updated_at
     FROM notes
     WHERE (DATE(created_at) = %(date)s OR DATE(updated_at) = %(date)s)
     AND user_id = %(user_id)s
     ORDER BY created_at
     """
-    return db.query_to_dataframe(query, {"date": date.date(), "user_id": user_id})
+    return db.query_to_dataframe(query, {"date": date.date(), "user_id": user_id}, **COLUMN_TYPES['notes'])
 
 def get_yesterday_pomodoros(user_id: str, target_date: Optional[datetime] = None) -> pd.DataFrame:
     """获取指定日期的番茄钟数据"""
@@ -79,7 +91,7 @@ def get_yesterday_pomodoros(user_id: str, target_date: Optional[datetime] = None
     AND user_id = %(user_id)s
     ORDER BY start_time
     """
-    return db.query_to_dataframe(query, {"date": date.date(), "user_id": user_id})
+    return db.query_to_dataframe(query, {"date": date.date(), "user_id": user_id}, **COLUMN_TYPES['pomodoros'])
 
 def get_yesterday_daily_summary(user_id: str, target_date: Optional[datetime] = None) -> Dict:
     """获取指定日期的每日总结数据"""
@@ -145,7 +157,7 @@ def analyze_habits_data(df: pd.DataFrame) -> Dict[str, Any]:
     # 按类别统计
     category_stats = {}
     if 'category' in df.columns:
-        category_counts = df.groupby(['category', 'status']).size().unstack(fill_value=0)
+        category_counts = df.groupby(['category', 'status'], observed=True).size().unstack(fill_value=0)
         for category in category_counts.index:
             category_stats[category] = {
                 'total': category_counts.loc[category].sum(),
@@ -157,7 +169,7 @@ def analyze_habits_data(df: pd.DataFrame) -> Dict[str, Any]:
     # 按难度统计 (如果有难度数据)
     difficulty_stats = {}
     if 'difficulty' in df.columns and not df['difficulty'].isna().all():
-        difficulty_counts = df.groupby(['difficulty']).size()
+        difficulty_counts = df.groupby(['difficulty'], observed=True).size()
         for difficulty in difficulty_counts.index:
             if pd.notna(difficulty):  # 确保不是 NaN
                 difficulty_stats[difficulty] = difficulty_counts[difficulty]
@@ -171,8 +183,8 @@ def analyze_habits_data(df: pd.DataFrame) -> Dict[str, Any]:
         "difficulty_stats": difficulty_stats
     }
 
-def analyze_todos_data(df: pd.DataFrame) -> Dict[str, Any]:
-    """分析待办事项数据"""
+def analyze_todos_data(df: pd.DataFrame, target_date: Optional[datetime] = None) -> Dict[str, Any]:
+    """分析待办事项数据，target_date为统计的日期，默认昨天"""
     if df.empty:
         return {"message": "昨天没有待办事项数据记录"}
     
@@ -182,13 +194,13 @@ def analyze_todos_data(df: pd.DataFrame) -> Dict[str, Any]:
     completion_rate = (completed_todos / total_todos) * 100 if total_todos > 0 else 0
     
     # 新创建的待办事项
-    yesterday = get_yesterday().date()
-    new_todos = df[pd.to_datetime(df['created_at']).dt.date == yesterday].shape[0]
+    yesterday = (target_date or get_yesterday()).date()
+    new_todos = df[df['created_at'].dt.date == yesterday].shape[0]
     
     # 按优先级统计
     priority_stats = {}
     if 'priority' in df.columns:
-        priority_counts = df.groupby(['priority', 'status']).size().unstack(fill_value=0)
+        priority_counts = df.groupby(['priority', 'status'], observed=True).size().unstack(fill_value=0)
         for priority in priority_counts.index:
             priority_stats[priority] = {
                 'total': priority_counts.loc[priority].sum(),
@@ -199,8 +211,8 @@ def analyze_todos_data(df: pd.DataFrame) -> Dict[str, Any]:
     # 到期情况统计
     overdue_todos = 0
     if 'due_date' in df.columns and not df['due_date'].isna().all():
-        yesterday_dt = get_yesterday()
-        overdue_todos = df[(pd.to_datetime(df['due_date']) < yesterday_dt) & (df['status'] != 'completed')].shape[0]
+        yesterday_dt = target_date or get_yesterday()
+        overdue_todos = df[(df['due_date'] < yesterday_dt) & (df['status'] != 'completed')].shape[0]
     
     return {
         "total_todos": total_todos,
@@ -211,29 +223,31 @@ def analyze_todos_data(df: pd.DataFrame) -> Dict[str, Any]:
         "overdue_todos": overdue_todos
     }
 
-def analyze_notes_data(df: pd.DataFrame) -> Dict[str, Any]:
-    """分析笔记数据"""
+def analyze_notes_data(df: pd.DataFrame, target_date: Optional[datetime] = None) -> Dict[str, Any]:
+    """分析笔记数据，target_date为统计的日期，默认昨天"""
     if df.empty:
         return {"message": "昨天没有笔记数据记录"}
     
     # 统计新建和更新的笔记
-    yesterday = get_yesterday().date()
-    new_notes = df[pd.to_datetime(df['created_at']).dt.date == yesterday].shape[0]
-    updated_notes = df[(pd.to_datetime(df['updated_at']).dt.date == yesterday) & 
-                     (pd.to_datetime(df['created_at']).dt.date != yesterday)].shape[0]
+    yesterday = (target_date or get_yesterday()).date()
+    new_notes = df[df['created_at'].dt.date == yesterday].shape[0]
+    updated_notes = df[(df['updated_at'].dt.date == yesterday) & 
+                     (df['created_at'].dt.date != yesterday)].shape[0]
     
     # 按类别统计
     category_stats = {}
     if 'category' in df.columns and not df['category'].isna().all():
-        category_counts = df.groupby('category').size()
+        category_counts = df.groupby('category', observed=True).size()
         for category in category_counts.index:
             if pd.notna(category):  # 确保不是 NaN
                 category_stats[category] = category_counts[category]
     
     # 内容长度分析
+    # 优先使用查询中计算好的长度，只有带正文的数据才在本地计算
     content_length_stats = {}
-    if 'content' in df.columns:
+    if 'content_length' not in df.columns and 'content' in df.columns:
         df['content_length'] = df['content'].str.len()
+    if 'content_length' in df.columns:
         content_length_stats = {
             'average': df['content_length'].mean(),
             'max': df['content_length'].max(),
@@ -254,7 +268,7 @@ def analyze_pomodoros_data(df: pd.DataFrame, tags_by_pomodoro: Dict[int, List[Di
         return {"message": "昨天没有番茄钟数据记录"}
     
     # 统计番茄钟状态
-    status_counts = df['status'].value_counts().to_dict()
+    status_counts = df.groupby('status', observed=True).size().to_dict()
     
     # 计算总专注时间(分钟)
     total_duration = df['duration'].sum()
@@ -265,7 +279,7 @@ def analyze_pomodoros_data(df: pd.DataFrame, tags_by_pomodoro: Dict[int, List[Di
     # 按时段分布统计
     hourly_distribution = {}
     if 'start_time' in df.columns:
-        df['hour'] = pd.to_datetime(df['start_time']).dt.hour
+        df['hour'] = df['start_time'].dt.hour
         hour_counts = df.groupby('hour').size()
         for hour in hour_counts.index:
             hourly_distribution[int(hour)] = int(hour_counts[hour])
@@ -298,120 +312,136 @@ def analyze_pomodoros_data(df: pd.DataFrame, tags_by_pomodoro: Dict[int, List[Di
         "task_relation_stats": task_relation_stats
     }
 
-def create_ai_insight_for_user(user_id: str, analysis_data: Dict[str, Any], target_date: Optional[datetime] = None, force: bool = False) -> Dict[str, Any]:
-    """
-    为用户创建AI洞察，将分析数据发送到AI服务并存储结果
-    """
-    date = target_date if target_date else get_yesterday()
+def build_insight_data(user_id: str, date: datetime) -> Dict[str, Any]:
+    """构建某个用户某一天的洞察记录（AI内容由调用方填充）"""
     date_str = date.strftime('%Y-%m-%d')
-    
-    # 准备洞察数据结构
-    insight_data = {
+    return {
         "user_id": user_id,
         "kind": "daily_summary",
         "title": f"{date_str} 每日数据分析",
         "time_period_start": date.isoformat(),
         "time_period_end": date.isoformat(),
-        "content": json.dumps(analysis_data, ensure_ascii=False),  # 先保存原始数据
         "metadata": {
             "date": date_str,
             "data_sources": ["habits", "todos", "notes", "pomodoros", "daily_summaries"]
         }
     }
+
+def apply_ai_content(insight_data: Dict[str, Any], content: Optional[str]) -> Dict[str, Any]:
+    """把AI生成的报告写入洞察记录"""
+    content = content.strip() if content else "AI未能生成有效内容"
+    insight_data["content"] = content
+    insight_data["content_json"] = {
+        "summary": "AI生成的每日洞察报告",
+        "report": content,
+        "date": insight_data["metadata"]["date"],
+        "userId": insight_data["user_id"]
+    }
+    return insight_data
+
+def create_ai_insight_for_user(user_id: str, analysis_data: Dict[str, Any], target_date: Optional[datetime] = None, force: bool = False) -> Dict[str, Any]:
+    """
+    为用户创建AI洞察，将分析数据发送到AI服务并存储结果
+    """
+    date = target_date if target_date else get_yesterday()
+    date_str = date.strftime('%Y-%m-%d')
+    
+    # 准备洞察数据结构，先保存原始数据
+    insight_data = build_insight_data(user_id, date)
+    insight_data["content"] = json.dumps(analysis_data, ensure_ascii=False)
     
-    # 尝试使用OpenAI API来生成分析
+    # 由 ai_service 按提示大小、各模型的延迟和错误率选择模型，与链式模式和回填共用同一调用路径
     try:
-        # 从环境变量获取OpenAI配置
-        openai_api_key = os.getenv("OPENAI_API_KEY")
-        openai_base_url = os.getenv("OPENAI_URL")
-        openai_models_str = os.getenv("OPENAI_MODELS")
-        
-        if not all([openai_api_key, openai_base_url, openai_models_str]):
-            logger.error("缺少OpenAI配置信息，请检查.env文件")
-            sys.exit(1)
-        
-        # 从逗号分隔的模型列表中随机选择一个
-        import random
-        openai_model = random.choice([m.strip() for m in openai_models_str.split(",")])
-        
-        # 初始化OpenAI客户端
-        try:
-            from openai import OpenAI
-            
-            client = OpenAI(
-                api_key=openai_api_key,
-                base_url=openai_base_url
-            )
-            
-            # 准备系统提示和用户提示
-            system_prompt = """
-            你是一个专业的个人数据分析师，擅长从用户的习惯、待办事项、笔记和番茄钟数据中提取有价值的洞察。
-            你的任务是分析用户的数据，并生成一份详细的每日洞察报告。
-            请从以下几个方面进行分析：
-            1. 数据概览：简要总结当天的关键数据点
-            2. 习惯完成情况：分析习惯的完成率和模式
-            3. 待办事项分析：待办事项的完成情况和优先级处理
-            4. 番茄钟专注时间分析：专注时间分布和效率
-            5. 笔记内容分析：笔记的主题和关键点
-            6. 改进建议：基于数据提出具体的改进建议
-            7. 今日亮点：用户表现出色的地方
-            
-            请以第二人称（"你"）向用户提供分析，语气友好、专业且富有鼓励性。
-            将分析结果以易于阅读的Markdown格式返回。
-            """
-            
-            user_prompt = f"""
-            以下是用户ID为 {user_id} 在 {date_str} 的数据分析结果。
-            请分析这些数据并生成一份每日洞察报告。
-            
-            数据:
-            ```json
-            {json.dumps(analysis_data, ensure_ascii=False, indent=2)}
-            ```
-            """
-            
-            # 调用OpenAI API
-            response = client.chat.completions.create(
-                model=openai_model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.5,
-                max_tokens=1500
-            )
-            
-            # 提取AI响应内容
-            content = response.choices[0].message.content
-            if content is None:
-                content = "AI未能生成有效内容"
-            else:
-                content = content.strip()
-            
-            # 构建结构化的返回格式
-            content_json = {
-                "summary": "AI生成的每日洞察报告",
-                "report": content,
-                "date": date_str,
-                "userId": user_id
-            }
-            
-            # 使用AI生成的内容更新洞察
-            insight_data["content"] = content
-            insight_data["content_json"] = content_json
-            logger.info(f"AI分析成功生成: {date_str}")
-            
-        except Exception as e:
-            error_msg = f"OpenAI API调用失败: {str(e)}"
-            logger.error(error_msg)
-            sys.exit(1)  # 出错直接退出
-            
+        content = ai_service.complete(build_daily_insight_messages(analysis_data, date_str, user_id))
     except Exception as e:
-        error_msg = f"准备AI分析服务失败: {str(e)}"
-        logger.error(error_msg)
-        sys.exit(1)  # 出错直接退出
+        logger.error(f"OpenAI API调用失败: {str(e)}")
+        return {"success": False, "error": f"AI分析失败: {str(e)}"}
+    apply_ai_content(insight_data, content)
+    logger.info(f"AI分析成功生成: {date_str}")
     
-    # 将数据存储到数据库
+    return save_ai_insight(insight_data, date)
+
+def section_hash(data: Any) -> str:
+    """数据的摘要，用于判断链式模式中某一部分与上次运行相比是否变化"""
+    serialized = json.dumps(compact_value(data), ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()[:16]
+
+def get_previous_chain_result(user_id: str, date: datetime) -> Dict[str, Any]:
+    """读取上次链式运行保存在洞察metadata中的分项结果和整合后的报告"""
+    query = """
+    SELECT content, metadata FROM ai_insights
+    WHERE user_id = %(user_id)s
+    AND kind = 'daily_summary'
+    AND DATE(time_period_start) = %(date)s
+    """
+    rows = db.execute_query(query, {"user_id": user_id, "date": date.date()})
+    if not rows:
+        return {}
+    metadata = rows[0]["metadata"] or {}
+    if isinstance(metadata, str):
+        metadata = json.loads(metadata)
+    chain = metadata.get("chain") or {}
+    return {**chain, "report": rows[0]["content"]} if chain else {}
+
+def create_chain_insight_for_user(user_id: str, analysis_data: Dict[str, Any], target_date: Optional[datetime] = None,
+                                  force: bool = False) -> Dict[str, Any]:
+    """
+    链式模式创建AI洞察
+
+    习惯、待办事项、番茄钟和笔记分别作为较短的子提示并发请求，再用一个整合提示合并为最终报告，
+    每个用户的耗时接近最慢的一个子请求加上整合请求。各部分的数据摘要和分析结果保存在洞察的metadata中，
+    再次运行时数据没有变化的部分直接复用上次的结果；force为True时全部重新生成。
+    """
+    date = target_date if target_date else get_yesterday()
+    date_str = date.strftime('%Y-%m-%d')
+    previous = {} if force else get_previous_chain_result(user_id, date)
+    previous_sections = previous.get("sections", {})
+    
+    sections: Dict[str, Dict[str, str]] = {}
+    pending: Dict[str, str] = {}
+    for section in CHAIN_SECTIONS:
+        if compact_value(analysis_data.get(section)) is None:
+            continue
+        digest = section_hash(analysis_data[section])
+        cached = previous_sections.get(section) or {}
+        if cached.get("hash") == digest and cached.get("content"):
+            sections[section] = cached
+        else:
+            pending[section] = digest
+    
+    started = time.perf_counter()
+    try:
+        if pending:
+            with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+                futures = {
+                    executor.submit(ai_service.complete, build_section_messages(section, analysis_data[section], date_str),
+                                    SECTION_MAX_TOKENS): section
+                    for section in pending
+                }
+                for future in as_completed(futures):
+                    section = futures[future]
+                    sections[section] = {"hash": pending[section], "content": future.result()}
+        
+        section_reports = {section: sections[section]["content"] for section in CHAIN_SECTIONS if section in sections}
+        merge_messages = build_merge_messages(section_reports, analysis_data, date_str, user_id)
+        merge_hash = section_hash(merge_messages)
+        if previous.get("merge_hash") == merge_hash and previous.get("report"):
+            content = previous["report"]
+        else:
+            content = ai_service.complete(merge_messages, INSIGHT_MAX_TOKENS)
+    except Exception as e:
+        logger.error(f"链式分析调用失败: {str(e)}")
+        return {"success": False, "error": f"链式分析调用失败: {str(e)}"}
+    
+    logger.info(f"链式分析成功生成: {date_str}, 新生成 {len(pending)} 个部分, "
+                f"复用 {len(sections) - len(pending)} 个部分, 耗时 {time.perf_counter() - started:.1f} 秒")
+    insight_data = apply_ai_content(build_insight_data(user_id, date), content)
+    insight_data["metadata"]["chain"] = {"sections": sections, "merge_hash": merge_hash}
+    return save_ai_insight(insight_data, date)
+
+def save_ai_insight(insight_data: Dict[str, Any], date: datetime) -> Dict[str, Any]:
+    """存储一条洞察记录，已存在该用户该日的洞察时更新"""
+    user_id = insight_data["user_id"]
     try:
         # 检查是否已存在该用户的该日洞察
         check_query = """
@@ -478,6 +508,115 @@ def create_ai_insight_for_user(user_id: str, analysis_data: Dict[str, Any], targ
         logger.error(f"存储AI洞察失败: {str(e)}")
         return {"success": False, "error": str(e)}
 
+def save_ai_insights(insights: List[Dict[str, Any]]) -> Dict[str, int]:
+    """
+    批量存储洞察记录：一次查询已有记录，已有的批量更新，其余批量插入，全部在一个事务中完成
+    """
+    if not insights:
+        return {"created": 0, "updated": 0}
+    
+    keys = tuple((insight["user_id"], insight["metadata"]["date"]) for insight in insights)
+    with db.get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+            SELECT id, user_id, DATE(time_period_start)::text AS day
+            FROM ai_insights
+            WHERE kind = 'daily_summary'
+            AND (user_id, DATE(time_period_start)::text) IN %(keys)s
+            """, {"keys": keys})
+            existing = {(user_id, day): insight_id for insight_id, user_id, day in cursor.fetchall()}
+            
+            updates = []
+            inserts = []
+            for insight in insights:
+                insight_id = existing.get((insight["user_id"], insight["metadata"]["date"]))
+                content_json = Json(insight.get("content_json", {}))
+                if insight_id is not None:
+                    updates.append((insight_id, insight["title"], insight["content"], content_json,
+                                    Json(insight["metadata"])))
+                else:
+                    inserts.append((insight["user_id"], insight["kind"], insight["title"], insight["content"],
+                                    content_json, insight["time_period_start"], insight["time_period_end"],
+                                    Json(insight["metadata"])))
+            
+            if updates:
+                execute_values(cursor, """
+                UPDATE ai_insights AS a
+                SET title = v.title,
+                    content = v.content,
+                    content_json = v.content_json::jsonb,
+                    metadata = v.metadata::jsonb,
+                    updated_at = NOW()
+                FROM (VALUES %s) AS v(id, title, content, content_json, metadata)
+                WHERE a.id = v.id
+                """, updates)
+            if inserts:
+                execute_values(cursor, """
+                INSERT INTO ai_insights (
+                    user_id, kind, title, content, content_json,
+                    time_period_start, time_period_end, metadata, created_at, updated_at
+                )
+                VALUES %s
+                """, inserts, template="(%s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())")
+            conn.commit()
+    
+    logger.info(f"批量存储每日洞察: 新建 {len(inserts)} 条, 更新 {len(updates)} 条")
+    return {"created": len(inserts), "updated": len(updates)}
+
+def batch_custom_id(user_id: str, date_str: str) -> str:
+    """批处理请求的custom_id，结果按它对应回用户和日期"""
+    return f"daily_insight|{date_str}|{user_id}"
+
+def parse_batch_custom_id(custom_id: str) -> Tuple[str, str]:
+    """解析custom_id，返回 (user_id, date_str)"""
+    _, date_str, user_id = custom_id.split("|", 2)
+    return user_id, date_str
+
+def submit_insight_batch(analyses: Dict[str, Dict[str, Any]], date: datetime, output_dir: str = "output") -> Optional[str]:
+    """
+    把所有用户当天的洞察请求写入Batch API格式的JSONL文件并提交
+
+    参数:
+        analyses: {user_id: 整合后的分析数据}
+    返回:
+        批处理ID，没有请求时返回None
+    """
+    if not analyses:
+        return None
+    date_str = date.strftime('%Y-%m-%d')
+    requests = (
+        ai_service.build_batch_request(
+            batch_custom_id(user_id, date_str),
+            build_daily_insight_messages(analysis, date_str, user_id)
+        )
+        for user_id, analysis in analyses.items()
+    )
+    path = os.path.join(output_dir, "insight_batches", f"daily_insight_{date_str}.jsonl")
+    count = ai_service.write_batch_file(requests, path)
+    logger.info(f"已写入 {count} 个洞察请求到 {path}")
+    return ai_service.submit_batch(path, metadata={"kind": "daily_summary", "date": date_str})
+
+def ingest_insight_batch(batch_id: str, poll_interval: float = 60, timeout: Optional[float] = None) -> Dict[str, Dict[str, Any]]:
+    """等待批处理完成，把成功的结果批量写入ai_insights，返回每个用户的结果"""
+    batch = ai_service.wait_for_batch(batch_id, poll_interval, timeout)
+    if batch.status != "completed":
+        logger.error(f"批处理任务 {batch_id} 未成功完成，状态: {batch.status}")
+    
+    results = ai_service.fetch_batch_results(batch)
+    insights = []
+    user_results = {}
+    for custom_id, result in results.items():
+        user_id, date_str = parse_batch_custom_id(custom_id)
+        if not result["success"]:
+            user_results[user_id] = {"success": False, "error": result["error"]}
+            continue
+        date = get_day_start(datetime.strptime(date_str, '%Y-%m-%d').date())
+        insights.append(apply_ai_content(build_insight_data(user_id, date), result["content"]))
+        user_results[user_id] = {"success": True, "operation": "batch"}
+    
+    save_ai_insights(insights)
+    return user_results
+
 def get_active_users() -> List[str]:
     """
     获取活跃用户列表(最近30天有数据的用户)
@@ -505,7 +644,71 @@ def get_active_users() -> List[str]:
     result = db.execute_query(query)
     return [row['user_id'] for row in result]
 
-def generate_daily_insights(user_id: Optional[str] = None, target_date: Optional[str] = None, force: bool = False, use_chain: bool = False) -> Dict[str, Any]:
+def prepare_user_day(user_id: str, date: datetime, habits_df: pd.DataFrame, todos_df: pd.DataFrame,
+                     notes_df: pd.DataFrame, pomodoros_df: pd.DataFrame,
+                     pomodoro_tags: Dict[int, List[Dict]], daily_summary: Dict) -> Optional[Dict[str, Any]]:
+    """
+    分析用户某一天的数据，返回整合后的分析结果，没有数据时返回None
+
+    数据可以来自单日查询，也可以来自按天拆分的批量查询（见backfill.py）。
+    """
+    date_str = date.strftime('%Y-%m-%d')
+    
+    # 分析数据
+    habits_analysis = analyze_habits_data(habits_df)
+    todos_analysis = analyze_todos_data(todos_df, date)
+    notes_analysis = analyze_notes_data(notes_df, date)
+    pomodoros_analysis = analyze_pomodoros_data(pomodoros_df, pomodoro_tags)
+    
+    # 整合所有数据
+    combined_analysis = combine_analysis_data(
+        user_id,
+        date_str,
+        habits_analysis,
+        todos_analysis,
+        notes_analysis,
+        pomodoros_analysis,
+        daily_summary
+    )
+    
+    # 保存分析结果用于调试
+    debug_filename = f"daily_insight_{user_id}_{date_str}.json"
+    save_summary_to_json(combined_analysis, debug_filename)
+    
+    if not combined_analysis["overall"]["has_data"]:
+        logger.info(f"用户 {user_id} 在 {date_str} 没有数据，跳过创建洞察")
+        return None
+    return combined_analysis
+
+def process_user_day(user_id: str, date: datetime, habits_df: pd.DataFrame, todos_df: pd.DataFrame,
+                     notes_df: pd.DataFrame, pomodoros_df: pd.DataFrame,
+                     pomodoro_tags: Dict[int, List[Dict]], daily_summary: Dict,
+                     force: bool = False, use_chain: bool = False) -> Dict[str, Any]:
+    """分析用户某一天的数据并创建AI洞察，use_chain为True时使用链式模式"""
+    combined_analysis = prepare_user_day(user_id, date, habits_df, todos_df, notes_df,
+                                         pomodoros_df, pomodoro_tags, daily_summary)
+    if combined_analysis is None:
+        return {"success": False, "reason": "no_data"}
+    if use_chain:
+        return create_chain_insight_for_user(user_id, combined_analysis, date, force)
+    return create_ai_insight_for_user(user_id, combined_analysis, date, force)
+
+def load_user_day(user_id: str, date: datetime) -> Tuple:
+    """查询用户某一天用于洞察的全部数据，返回 prepare_user_day 需要的参数"""
+    habits_df = get_yesterday_habits_data(user_id, date)
+    todos_df = get_yesterday_todos(user_id, date)
+    notes_df = get_yesterday_notes(user_id, date)
+    pomodoros_df = get_yesterday_pomodoros(user_id, date)
+    daily_summary = get_yesterday_daily_summary(user_id, date)
+    
+    # 获取番茄钟标签数据
+    pomodoro_ids = pomodoros_df['id'].tolist() if not pomodoros_df.empty else []
+    pomodoro_tags = get_pomodoro_tags(user_id, pomodoro_ids)
+    return user_id, date, habits_df, todos_df, notes_df, pomodoros_df, pomodoro_tags, daily_summary
+
+def generate_daily_insights(user_id: Optional[str] = None, target_date: Optional[str] = None, force: bool = False,
+                            use_chain: bool = False, use_batch: bool = False, batch_poll_interval: float = 60,
+                            batch_timeout: Optional[float] = None) -> Dict[str, Any]:
     """
     为用户生成每日洞察报告
     
@@ -513,6 +716,10 @@ def generate_daily_insights(user_id: Optional[str] = None, target_date: Optional
         user_id: 指定用户ID，如果不指定则处理所有活跃用户
         target_date: 指定目标日期(YYYY-MM-DD格式)，如果不指定则使用昨天
         force: 是否强制重新生成已存在的洞察
+        use_chain: 链式模式：各类数据分别并发分析后再整合，数据没有变化的部分复用上次的结果
+        use_batch: 使用Batch API离线生成：所有用户的请求写入一个文件提交，完成后批量写入数据库
+        batch_poll_interval: 批处理模式下轮询任务状态的间隔(秒)
+        batch_timeout: 批处理模式下最长等待时间(秒)，None表示一直等待
         
     返回:
         包含处理结果信息的字典
@@ -520,7 +727,7 @@ def generate_daily_insights(user_id: Optional[str] = None, target_date: Optional
     # 处理日期参数
     if target_date:
         try:
-            date = datetime.strptime(target_date, '%Y-%m-%d')
+            date = get_day_start(datetime.strptime(target_date, '%Y-%m-%d').date())
         except ValueError:
             logger.error(f"日期格式无效: {target_date}，应为YYYY-MM-DD格式")
             return {"success": False, "error": f"日期格式无效: {target_date}"}
@@ -530,6 +737,8 @@ def generate_daily_insights(user_id: Optional[str] = None, target_date: Optional
     date_str = date.strftime('%Y-%m-%d')
     
     logger.info(f"开始为 {date_str} 生成每日洞察...")
+    prompt_stats.reset()
+    ai_service.router.reset_run()
     
     # 获取要处理的用户列表
     if user_id:
@@ -549,78 +758,88 @@ def generate_daily_insights(user_id: Optional[str] = None, target_date: Optional
         "user_results": {}
     }
     
+    if use_batch:
+        if use_chain:
+            logger.warning("批处理模式不支持链式分析，忽略链式模式")
+        return _generate_daily_insights_batch(users_to_process, date, results, batch_poll_interval, batch_timeout)
+    
     # 为每个用户生成洞察
     for current_user_id in users_to_process:
         try:
             logger.info(f"正在处理用户 {current_user_id} 的数据...")
             
-            # 获取各类数据
-            habits_df = get_yesterday_habits_data(current_user_id, date)
-            todos_df = get_yesterday_todos(current_user_id, date)
-            notes_df = get_yesterday_notes(current_user_id, date)
-            pomodoros_df = get_yesterday_pomodoros(current_user_id, date)
-            daily_summary = get_yesterday_daily_summary(current_user_id, date)
-            
-            # 获取番茄钟标签数据
-            pomodoro_ids = pomodoros_df['id'].tolist() if not pomodoros_df.empty else []
-            pomodoro_tags = get_pomodoro_tags(current_user_id, pomodoro_ids)
-            
-            # 分析数据
-            habits_analysis = analyze_habits_data(habits_df)
-            todos_analysis = analyze_todos_data(todos_df)
-            notes_analysis = analyze_notes_data(notes_df)
-            pomodoros_analysis = analyze_pomodoros_data(pomodoros_df, pomodoro_tags)
-            
-            # 整合所有数据
-            combined_analysis = combine_analysis_data(
-                current_user_id,
-                date_str,
-                habits_analysis,
-                todos_analysis,
-                notes_analysis,
-                pomodoros_analysis,
-                daily_summary
-            )
-            
-            # 保存分析结果用于调试
-            debug_filename = f"daily_insight_{current_user_id}_{date_str}.json"
-            save_summary_to_json(combined_analysis, debug_filename)
-            
-            # 如果有数据，创建AI洞察
-            if combined_analysis["overall"]["has_data"]:
-                    # 使用传统方式分析
-                insight_result = create_ai_insight_for_user(current_user_id, combined_analysis, date, force)
-                    
-                results["user_results"][current_user_id] = insight_result
-                if insight_result.get("success", False):
-                    results["success_count"] += 1
-                else:
-                    results["error_count"] += 1
-                    logger.error(f"为用户 {current_user_id} 创建洞察失败: {insight_result.get('error')}")
-            else:
-                logger.info(f"用户 {current_user_id} 在 {date_str} 没有数据，跳过创建洞察")
-                results["user_results"][current_user_id] = {"success": False, "reason": "no_data"}
+            insight_result = process_user_day(*load_user_day(current_user_id, date), force, use_chain)
+            results["user_results"][current_user_id] = insight_result
+            if insight_result.get("success", False):
+                results["success_count"] += 1
+            elif insight_result.get("reason") != "no_data":
+                results["error_count"] += 1
+                logger.error(f"为用户 {current_user_id} 创建洞察失败: {insight_result.get('error')}")
         except Exception as e:
             logger.error(f"处理用户 {current_user_id} 数据时出错: {str(e)}")
             results["error_count"] += 1
             results["user_results"][current_user_id] = {"success": False, "error": str(e)}
     
+    prompt_stats.log_summary()
+    ai_service.router.save()
     logger.info(f"完成 {date_str} 的每日洞察生成: 成功 {results['success_count']}, 失败 {results['error_count']}")
     return results
 
+def _generate_daily_insights_batch(users: List[str], date: datetime, results: Dict[str, Any],
+                                   poll_interval: float, timeout: Optional[float]) -> Dict[str, Any]:
+    """批处理模式：先分析所有用户，再一次性提交请求并批量写入结果"""
+    date_str = date.strftime('%Y-%m-%d')
+    analyses = {}
+    for current_user_id in users:
+        try:
+            combined_analysis = prepare_user_day(*load_user_day(current_user_id, date))
+            if combined_analysis is None:
+                results["user_results"][current_user_id] = {"success": False, "reason": "no_data"}
+            else:
+                analyses[current_user_id] = combined_analysis
+        except Exception as e:
+            logger.error(f"处理用户 {current_user_id} 数据时出错: {str(e)}")
+            results["error_count"] += 1
+            results["user_results"][current_user_id] = {"success": False, "error": str(e)}
+    
+    batch_id = submit_insight_batch(analyses, date)
+    prompt_stats.log_summary()
+    ai_service.router.save()
+    if batch_id is None:
+        logger.info(f"{date_str} 没有需要生成洞察的用户")
+        return results
+    results["batch_id"] = batch_id
+    
+    batch_results = ingest_insight_batch(batch_id, poll_interval, timeout)
+    for current_user_id in analyses:
+        user_result = batch_results.get(current_user_id, {"success": False, "error": "批处理结果中缺少该用户"})
+        results["user_results"][current_user_id] = user_result
+        if user_result["success"]:
+            results["success_count"] += 1
+        else:
+            results["error_count"] += 1
+            logger.error(f"为用户 {current_user_id} 创建洞察失败: {user_result.get('error')}")
+    
+    logger.info(f"完成 {date_str} 的批量洞察生成: 成功 {results['success_count']}, 失败 {results['error_count']}")
+    return results
+
 if __name__ == "__main__":
     # 解析命令行参数
     parser = argparse.ArgumentParser(description='生成每日数据洞察')
     parser.add_argument('--user-id', help='用户ID，不指定则处理所有活跃用户')
     parser.add_argument('--date', help='指定日期(YYYY-MM-DD)，默认为昨天')
     parser.add_argument('--force', action='store_true', help='强制重新生成已存在的洞察')
-    parser.add_argument('--chain', action='store_true', help='使用链式分析模式，分步骤处理不同数据类型')
+    parser.add_argument('--chain', action='store_true', help='使用链式分析模式，各类数据并发分析后整合，复用没有变化的部分')
+    parser.add_argument('--batch', action='store_true', help='使用Batch API离线生成并批量写入洞察')
+    parser.add_argument('--poll-interval', type=float, default=60, help='批处理模式下轮询任务状态的间隔(秒)')
     args = parser.parse_args()
     
     results = generate_daily_insights(
         user_id=args.user_id,
         target_date=args.date,
         force=args.force,
-        use_chain=args.chain
+        use_chain=args.chain,
+        use_batch=args.batch,
+        batch_poll_interval=args.poll_interval
     )
     print(f"每日洞察生成完成: 成功 {results['success_count']}/{results['total_users']}")
@@ -5,12 +5,11 @@
 """
 import logging
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 from datetime import datetime, timedelta
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 
-from db import db
+from db import COLUMN_TYPES, db, note_text_columns
+from tag_analysis import tag_counts as count_tags
 from utils import get_yesterday, save_dataframe_to_csv, save_summary_to_json
 
 logger = logging.getLogger(__name__)
@@ -27,7 +26,7 @@ def get_yesterday_habits_data() -> pd.DataFrame:
     WHERE hc.completion_date = %(yesterday)s
     ORDER BY h.category, h.name
     """
-    return db.query_to_dataframe(query, {"yesterday": yesterday.date()})
+    return db.query_to_dataframe(query, {"yesterday": yesterday.date()}, **COLUMN_TYPES['habits'])
 
 def get_yesterday_todos() -> pd.DataFrame:
     """获取昨天的待办事项数据"""
@@ -40,19 +39,19 @@ def get_yesterday_todos() -> pd.DataFrame:
     WHERE DATE(created_at) = %(yesterday)s OR DATE(completed_at) = %(yesterday)s
     ORDER BY priority DESC, created_at
     """
-    return db.query_to_dataframe(query, {"yesterday": yesterday.date()})
+    return db.query_to_dataframe(query, {"yesterday": yesterday.date()}, **COLUMN_TYPES['todos'])
 
-def get_yesterday_notes() -> pd.DataFrame:
-    """获取昨天的笔记数据"""
+def get_yesterday_notes(include_content: bool = False) -> pd.DataFrame:
+    """获取昨天的笔记数据，默认只返回正文长度和行数，include_content为True时附带正文"""
     yesterday = get_yesterday()
-    query = """
+    query = f"""
     SELECT 
-        id, title, content, tags, created_at, updated_at
+        id, title, {note_text_columns(include_content)}, tags, created_at, updated_at
     FROM notes
     WHERE DATE(created_at) = %(yesterday)s OR DATE(updated_at) = %(yesterday)s
     ORDER BY created_at
     """
-    return db.query_to_dataframe(query, {"yesterday": yesterday.date()})
+    return db.query_to_dataframe(query, {"yesterday": yesterday.date()}, **COLUMN_TYPES['notes'])
 
 def analyze_habits(df: pd.DataFrame) -> Dict[str, Any]:
     """分析习惯数据"""
@@ -63,7 +62,7 @@ def analyze_habits(df: pd.DataFrame) -> Dict[str, Any]:
     completion_rate = df['is_completed'].mean() * 100
     
     # 按类别统计
-    category_stats = df.groupby('category').agg(
+    category_stats = df.groupby('category', observed=True).agg(
         total=('id', 'count'),
         completed=('is_completed', 'sum')
     )
@@ -85,17 +84,13 @@ def analyze_todos(df: pd.DataFrame) -> Dict[str, Any]:
     completion_rate = len(completed) / len(df) * 100 if len(df) > 0 else 0
     
     # 按优先级统计
-    priority_stats = df.groupby('priority').agg(
+    priority_stats = df.assign(is_completed=df['status'] == 'completed').groupby('priority', observed=True).agg(
         total=('id', 'count'),
-        completed=(pd.Series(df['status'] == 'completed'), 'sum')
+        completed=('is_completed', 'sum')
     )
     
     # 分析标签
-    tags = []
-    for tags_list in df['tags'].dropna():
-        if isinstance(tags_list, list):
-            tags.extend(tags_list)
-    tag_counts = pd.Series(tags).value_counts().to_dict()
+    tag_counts = count_tags(df['tags'])
     
     return {
         "total_todos": len(df),
@@ -105,23 +100,19 @@ def analyze_todos(df: pd.DataFrame) -> Dict[str, Any]:
         "common_tags": tag_counts
     }
 
-def analyze_notes(df: pd.DataFrame) -> Dict[str, Any]:
-    """分析笔记数据"""
+def analyze_notes(df: pd.DataFrame, target_date: Optional[datetime] = None) -> Dict[str, Any]:
+    """分析笔记数据，target_date为统计的日期，默认昨天"""
     if df.empty:
         return {"message": "昨天没有笔记数据记录"}
     
     # 统计新建和更新的笔记
-    yesterday = get_yesterday().date()
-    new_notes = df[pd.to_datetime(df['created_at']).dt.date == yesterday]
-    updated_notes = df[(pd.to_datetime(df['updated_at']).dt.date == yesterday) & 
-                      (pd.to_datetime(df['created_at']).dt.date != yesterday)]
+    yesterday = (target_date or get_yesterday()).date()
+    new_notes = df[df['created_at'].dt.date == yesterday]
+    updated_notes = df[(df['updated_at'].dt.date == yesterday) & 
+                      (df['created_at'].dt.date != yesterday)]
     
     # 分析标签
-    tags = []
-    for tags_list in df['tags'].dropna():
-        if isinstance(tags_list, list):
-            tags.extend(tags_list)
-    tag_counts = pd.Series(tags).value_counts().to_dict()
+    tag_counts = count_tags(df['tags'])
     
     return {
         "total_notes": len(df),
@@ -133,28 +124,34 @@ def analyze_notes(df: pd.DataFrame) -> Dict[str, Any]:
 def generate_daily_summary() -> Dict[str, Any]:
     """生成每日摘要报告"""
     yesterday = get_yesterday()
-    yesterday_str = yesterday.strftime('%Y-%m-%d')
     
-    logger.info(f"开始生成 {yesterday_str} 的每日摘要...")
+    logger.info(f"开始生成 {yesterday.strftime('%Y-%m-%d')} 的每日摘要...")
     
     # 获取数据
     habits_df = get_yesterday_habits_data()
     todos_df = get_yesterday_todos()
     notes_df = get_yesterday_notes()
     
+    return summarize_day(yesterday, habits_df, todos_df, notes_df)
+
+def summarize_day(target_date: datetime, habits_df: pd.DataFrame, todos_df: pd.DataFrame,
+                  notes_df: pd.DataFrame) -> Dict[str, Any]:
+    """根据某一天的数据生成并保存每日摘要，数据可以来自单日查询或按天拆分的批量查询"""
+    date_str = target_date.strftime('%Y-%m-%d')
+    
     # 保存原始数据
-    save_dataframe_to_csv(habits_df, f"habits_{yesterday_str}.csv")
-    save_dataframe_to_csv(todos_df, f"todos_{yesterday_str}.csv")
-    save_dataframe_to_csv(notes_df, f"notes_{yesterday_str}.csv")
+    save_dataframe_to_csv(habits_df, f"habits_{date_str}.csv")
+    save_dataframe_to_csv(todos_df, f"todos_{date_str}.csv")
+    save_dataframe_to_csv(notes_df, f"notes_{date_str}.csv")
     
     # 分析数据
     habits_analysis = analyze_habits(habits_df)
     todos_analysis = analyze_todos(todos_df)
-    notes_analysis = analyze_notes(notes_df)
+    notes_analysis = analyze_notes(notes_df, target_date)
     
     # 生成摘要
     summary = {
-        "date": yesterday_str,
+        "date": date_str,
         "habits": habits_analysis,
         "todos": todos_analysis,
         "notes": notes_analysis,
@@ -164,9 +161,9 @@ def generate_daily_summary() -> Dict[str, Any]:
     }
     
     # 保存摘要
-    save_summary_to_json(summary, f"daily_summary_{yesterday_str}.json")
+    save_summary_to_json(summary, f"daily_summary_{date_str}.json")
     
-    logger.info(f"完成 {yesterday_str} 的每日摘要生成")
+    logger.info(f"完成 {date_str} 的每日摘要生成")
     return summary
 
 def calculate_productivity_score(habits_analysis: Dict[str, Any], todos_analysis: Dict[str, Any]) -> float:
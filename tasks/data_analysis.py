@@ -32,7 +32,7 @@ def analyze_habits_data(df: pd.DataFrame) -> Dict[str, Any]:
     # 按类别统计
     category_stats = {}
     if 'category' in df.columns:
-        category_counts = df.groupby(['category', 'status']).size().unstack(fill_value=0)
+        category_counts = df.groupby(['category', 'status'], observed=True).size().unstack(fill_value=0)
         for category in category_counts.index:
             category_stats[category] = {
                 'total': category_counts.loc[category].sum(),
@@ -44,7 +44,7 @@ def analyze_habits_data(df: pd.DataFrame) -> Dict[str, Any]:
     # 按难度统计 (如果有难度数据)
     difficulty_stats = {}
     if 'difficulty' in df.columns and not df['difficulty'].isna().all():
-        difficulty_counts = df.groupby(['difficulty']).size()
+        difficulty_counts = df.groupby(['difficulty'], observed=True).size()
         for difficulty in difficulty_counts.index:
             if pd.notna(difficulty):  # 确保不是 NaN
                 difficulty_stats[difficulty] = difficulty_counts[difficulty]
@@ -58,8 +58,8 @@ def analyze_habits_data(df: pd.DataFrame) -> Dict[str, Any]:
         "difficulty_stats": difficulty_stats
     }
 
-def analyze_todos_data(df: pd.DataFrame) -> Dict[str, Any]:
-    """分析待办事项数据"""
+def analyze_todos_data(df: pd.DataFrame, target_date: Optional[datetime] = None) -> Dict[str, Any]:
+    """分析待办事项数据，target_date为统计的日期，默认昨天"""
     if df.empty:
         return {"message": "昨天没有待办事项数据记录"}
     
@@ -69,13 +69,13 @@ def analyze_todos_data(df: pd.DataFrame) -> Dict[str, Any]:
     completion_rate = (completed_todos / total_todos) * 100 if total_todos > 0 else 0
     
     # 新创建的待办事项
-    yesterday = get_yesterday().date()
-    new_todos = df[pd.to_datetime(df['created_at']).dt.date == yesterday].shape[0]
+    yesterday = (target_date or get_yesterday()).date()
+    new_todos = df[df['created_at'].dt.date == yesterday].shape[0]
     
     # 按优先级统计
     priority_stats = {}
     if 'priority' in df.columns:
-        priority_counts = df.groupby(['priority', 'status']).size().unstack(fill_value=0)
+        priority_counts = df.groupby(['priority', 'status'], observed=True).size().unstack(fill_value=0)
         for priority in priority_counts.index:
             priority_stats[priority] = {
                 'total': priority_counts.loc[priority].sum(),
@@ -86,8 +86,8 @@ def analyze_todos_data(df: pd.DataFrame) -> Dict[str, Any]:
     # 到期情况统计
     overdue_todos = 0
     if 'due_date' in df.columns and not df['due_date'].isna().all():
-        yesterday_dt = get_yesterday()
-        overdue_todos = df[(pd.to_datetime(df['due_date']) < yesterday_dt) & (df['status'] != 'completed')].shape[0]
+        yesterday_dt = target_date or get_yesterday()
+        overdue_todos = df[(df['due_date'] < yesterday_dt) & (df['status'] != 'completed')].shape[0]
     
     return {
         "total_todos": total_todos,
@@ -98,29 +98,31 @@ def analyze_todos_data(df: pd.DataFrame) -> Dict[str, Any]:
         "overdue_todos": overdue_todos
     }
 
-def analyze_notes_data(df: pd.DataFrame) -> Dict[str, Any]:
-    """分析笔记数据"""
+def analyze_notes_data(df: pd.DataFrame, target_date: Optional[datetime] = None) -> Dict[str, Any]:
+    """分析笔记数据，target_date为统计的日期，默认昨天"""
     if df.empty:
         return {"message": "昨天没有笔记数据记录"}
     
     # 统计新建和更新的笔记
-    yesterday = get_yesterday().date()
-    new_notes = df[pd.to_datetime(df['created_at']).dt.date == yesterday].shape[0]
-    updated_notes = df[(pd.to_datetime(df['updated_at']).dt.date == yesterday) & 
-                     (pd.to_datetime(df['created_at']).dt.date != yesterday)].shape[0]
+    yesterday = (target_date or get_yesterday()).date()
+    new_notes = df[df['created_at'].dt.date == yesterday].shape[0]
+    updated_notes = df[(df['updated_at'].dt.date == yesterday) & 
+                     (df['created_at'].dt.date != yesterday)].shape[0]
     
     # 按类别统计
     category_stats = {}
     if 'category' in df.columns and not df['category'].isna().all():
-        category_counts = df.groupby('category').size()
+        category_counts = df.groupby('category', observed=True).size()
         for category in category_counts.index:
             if pd.notna(category):  # 确保不是 NaN
                 category_stats[category] = category_counts[category]
     
     # 内容长度分析
+    # 优先使用查询中计算好的长度，只有带正文的数据才在本地计算
     content_length_stats = {}
-    if 'content' in df.columns:
+    if 'content_length' not in df.columns and 'content' in df.columns:
         df['content_length'] = df['content'].str.len()
+    if 'content_length' in df.columns:
         content_length_stats = {
             'average': df['content_length'].mean(),
             'max': df['content_length'].max(),
@@ -141,7 +143,7 @@ def analyze_pomodoros_data(df: pd.DataFrame, tags_by_pomodoro: Dict[int, List[Di
         return {"message": "昨天没有番茄钟数据记录"}
     
     # 统计番茄钟状态
-    status_counts = df['status'].value_counts().to_dict()
+    status_counts = df.groupby('status', observed=True).size().to_dict()
     
     # 计算总专注时间(分钟)
     total_duration = df['duration'].sum()
@@ -152,7 +154,7 @@ def analyze_pomodoros_data(df: pd.DataFrame, tags_by_pomodoro: Dict[int, List[Di
     # 按时段分布统计
     hourly_distribution = {}
     if 'start_time' in df.columns:
-        df['hour'] = pd.to_datetime(df['start_time']).dt.hour
+        df['hour'] = df['start_time'].dt.hour
         hour_counts = df.groupby('hour').size()
         for hour in hour_counts.index:
             hourly_distribution[int(hour)] = int(hour_counts[hour])
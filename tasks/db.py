@@ -1,7 +1,9 @@
+import importlib.util
 import logging
 import os
+import re
 from contextlib import contextmanager
-from typing import Any, Dict, Generator, List, Optional, Tuple
+from typing import TYPE_CHECKING, Any, Dict, Generator, List, Optional, Tuple
 
 import pandas as pd
 import psycopg2
@@ -11,6 +13,9 @@ from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
+if TYPE_CHECKING:
+    import pyarrow
+
 # 加载.env文件中的环境变量
 load_dotenv()
 
@@ -30,6 +35,77 @@ Base = declarative_base()
 
 logger = logging.getLogger(__name__)
 
+# 常用表的列类型，作为 query_to_dataframe 的 dtypes / parse_dates 参数使用:
+#     db.query_to_dataframe(query, params, **COLUMN_TYPES['todos'])
+# 低基数的文本列使用category，可空整数使用Int64，时间戳列解析为配置时区下的 datetime64[ns, tz]。
+# 只会转换查询结果中实际存在的列，查询可以只选择其中一部分列。
+COLUMN_TYPES: Dict[str, Dict[str, Any]] = {
+    'habits': {
+        'dtypes': {'category': 'category', 'frequency': 'category', 'user_id': 'category',
+                   'is_completed': 'boolean', 'habit_id': 'Int64'},
+        'parse_dates': ['completion_date', 'created_at']
+    },
+    'habit_entries': {
+        'dtypes': {'category': 'category', 'frequency': 'category', 'status': 'category',
+                   'difficulty': 'category', 'user_id': 'category', 'habit_id': 'Int64'},
+        'parse_dates': ['completed_at', 'created_at']
+    },
+    'todos': {
+        'dtypes': {'status': 'category', 'priority': 'category', 'user_id': 'category'},
+        'parse_dates': ['created_at', 'updated_at', 'completed_at', 'due_date']
+    },
+    'notes': {
+        'dtypes': {'category': 'category', 'user_id': 'category',
+                   'content_length': 'Int64', 'line_count': 'Int64'},
+        'parse_dates': ['created_at', 'updated_at']
+    },
+    'pomodoros': {
+        'dtypes': {'status': 'category', 'user_id': 'category', 'duration': 'Int64',
+                   'habit_id': 'Int64', 'todo_id': 'Int64', 'goal_id': 'Int64'},
+        'parse_dates': ['start_time', 'end_time', 'created_at']
+    }
+}
+
+
+
+def note_text_columns(include_content: bool = False) -> str:
+    """
+    笔记正文相关的查询列
+
+    默认只返回在数据库中计算的正文长度和行数，不传输正文本身；
+    include_content 为True时额外返回完整的 content 列，只给确实需要正文的调用方使用。
+    """
+    columns = [
+        "COALESCE(char_length(content), 0) AS content_length",
+        "COALESCE(char_length(content) - char_length(replace(content, E'\\n', '')) + 1, 0) AS line_count"
+    ]
+    if include_content:
+        columns.append("content")
+    return ", ".join(columns)
+
+
+def to_local_datetime(series: pd.Series) -> pd.Series:
+    """把时间列转换为配置时区下的 datetime64[ns, tz]，不带时区的值视为本地时间"""
+    if not pd.api.types.is_datetime64_any_dtype(series):
+        values = series.dropna()
+        aware = not values.empty and getattr(values.iloc[0], 'tzinfo', None) is not None
+        series = pd.to_datetime(series, utc=aware)
+    if series.dt.tz is None:
+        return series.dt.tz_localize(config.timezone)
+    return series.dt.tz_convert(config.timezone)
+
+
+def apply_column_types(df: pd.DataFrame, dtypes: Optional[Dict[str, Any]] = None,
+                       parse_dates: Optional[List[str]] = None) -> pd.DataFrame:
+    """按列类型映射转换DataFrame，忽略结果中不存在的列"""
+    for column in parse_dates or []:
+        if column in df.columns:
+            df[column] = to_local_datetime(df[column])
+    present = {column: dtype for column, dtype in (dtypes or {}).items() if column in df.columns}
+    if present:
+        df = df.astype(present)
+    return df
+
 class Database:
     """数据库管理类"""
     
@@ -46,17 +122,58 @@ class Database:
         finally:
             conn.close()
     
-    def query_to_dataframe(self, query: str, params: Optional[Dict[str, Any]] = None) -> pd.DataFrame:
-        """执行SQL查询并返回DataFrame"""
+    def query_to_dataframe(self, query: str, params: Optional[Dict[str, Any]] = None,
+                           dtypes: Optional[Dict[str, Any]] = None, parse_dates: Optional[List[str]] = None,
+                           dtype_backend: Optional[str] = None, arrow: Optional[bool] = None) -> pd.DataFrame:
+        """
+        执行SQL查询并返回DataFrame
+
+        参数:
+            dtypes: 列类型映射，例如 {'status': 'category', 'duration': 'Int64'}
+            parse_dates: 需要解析为配置时区下 datetime64[ns, tz] 的时间列
+            dtype_backend: 'numpy_nullable' 或 'pyarrow'，默认使用配置中的 DB_DTYPE_BACKEND
+            arrow: 是否通过Arrow读取结果，默认使用配置中的 DB_ARROW_FETCH；
+                   驱动不可用或读取失败时回退到普通查询
+        """
+        dtype_backend = dtype_backend or config.db.dtype_backend or None
+        if dtype_backend == 'pyarrow' and not _pyarrow_available():
+            logger.warning("未安装pyarrow，改用默认的NumPy类型")
+            dtype_backend = None
+
+        use_arrow = config.db.arrow_fetch if arrow is None else arrow
+        if use_arrow and arrow_fetch_available():
+            try:
+                table = self.query_to_arrow(query, params)
+                return apply_column_types(arrow_to_pandas(table, dtype_backend), dtypes, parse_dates)
+            except Exception as e:
+                logger.warning(f"Arrow读取失败，回退到普通查询: {str(e)}")
+
         try:
-            if params:
-                return pd.read_sql_query(query, self.engine, params=params)
-            return pd.read_sql_query(query, self.engine)
+            kwargs = {"params": params} if params else {}
+            if dtype_backend:
+                kwargs["dtype_backend"] = dtype_backend
+            df = pd.read_sql_query(query, self.engine, **kwargs)
+            return apply_column_types(df, dtypes, parse_dates)
         except Exception as e:
             logger.error(f"执行查询出错: {str(e)}")
             logger.error(f"查询: {query}")
             logger.error(f"参数: {params}")
             raise
+
+    def query_to_arrow(self, query: str, params: Optional[Dict[str, Any]] = None) -> "pyarrow.Table":
+        """
+        通过ADBC PostgreSQL驱动执行查询，返回Arrow表
+
+        驱动使用二进制COPY协议读取结果并直接解码为Arrow列，不会为每一行创建Python对象。
+        需要安装可选依赖 adbc-driver-postgresql 和 pyarrow。
+        """
+        import adbc_driver_postgresql.dbapi
+
+        positional_query, values = to_positional_query(query, params)
+        with adbc_driver_postgresql.dbapi.connect(self.conn_string) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(positional_query, values or None)
+                return cursor.fetch_arrow_table()
     
     def execute_query(self, query: str, params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
         """执行SQL查询并返回字典列表"""
@@ -95,6 +212,57 @@ class Database:
                     logger.error(f"查询: {query}")
                     raise
 
+def to_positional_query(query: str, params: Optional[Dict[str, Any]] = None) -> Tuple[str, List[Any]]:
+    """把 %(name)s 形式的命名参数转换为ADBC使用的 $1, $2 位置参数，同名参数共用一个位置"""
+    if not params:
+        return query, []
+    positions: Dict[str, int] = {}
+    values: List[Any] = []
+
+    def replace(match: "re.Match") -> str:
+        if match.group(0) == '%%':
+            return '%'
+        name = match.group(1)
+        if name not in positions:
+            values.append(params[name])
+            positions[name] = len(values)
+        return f"${positions[name]}"
+
+    return re.sub(r"%%|%\((\w+)\)s", replace, query), values
+
+
+def arrow_to_pandas(table: "pyarrow.Table", dtype_backend: Optional[str] = None) -> pd.DataFrame:
+    """
+    把Arrow表转换为DataFrame
+
+    数组列（例如tags）转换为Python列表，与psycopg2读取的结果一致；
+    dtype_backend 为pyarrow时其余列保留Arrow类型。
+    """
+    import pyarrow as pa
+
+    list_columns = [field.name for field in table.schema
+                    if pa.types.is_list(field.type) or pa.types.is_large_list(field.type)]
+    types_mapper = pd.ArrowDtype if dtype_backend == 'pyarrow' else None
+    df = table.drop(list_columns).to_pandas(types_mapper=types_mapper)
+    for name in list_columns:
+        df[name] = table.column(name).to_pylist()
+    return df[table.column_names]
+
+
+def _module_available(name: str) -> bool:
+    """检查可选依赖是否已安装，不导入模块"""
+    return importlib.util.find_spec(name) is not None
+
+
+def arrow_fetch_available() -> bool:
+    """Arrow读取路径依赖可选的 adbc-driver-postgresql 和 pyarrow"""
+    return _module_available("adbc_driver_postgresql") and _module_available("pyarrow")
+
+
+def _pyarrow_available() -> bool:
+    """pyarrow是可选依赖，只在使用pyarrow类型后端时需要"""
+    return _module_available("pyarrow")
+
 # 创建全局数据库实例
 db = Database()
 
@@ -15,7 +15,10 @@ import os
 import argparse
 from typing import Dict, List, Any, Optional, Tuple
 
-from db import db
+from activity_cube import ActivityCube, add_rates, daily_from_details
+from chart_cache import get_chart_cache
+from db import COLUMN_TYPES, db
+from heatmap_grid import render_heatmap_grid
 from utils import get_date_range, save_dataframe_to_csv
 from config import config
 
@@ -35,6 +38,23 @@ sns.set_style("whitegrid")  # 设置Seaborn绘图风格
 plt.rcParams['figure.figsize'] = (12, 8)  # 设置图表大小
 plt.rcParams['savefig.dpi'] = 300  # 设置保存图片的DPI
 
+# 图表缓存键中的样式版本，修改图表样式后需要更新以使已缓存的图片失效
+CHART_STYLE = 'generate_charts-whitegrid-v1'
+
+def fetch_cached_chart(chart_type: str, data: Any, filename: str, **params) -> Tuple[str, bool]:
+    """
+    计算图表的缓存键，输入数据未变化时把缓存的图片放到filename
+    
+    返回:
+        (缓存键, 是否命中)，未命中时渲染完成后需调用 get_chart_cache().store(缓存键, filename)
+    """
+    output_dir = os.path.dirname(filename)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    cache = get_chart_cache()
+    cache_key = cache.make_key(chart_type, data, style=CHART_STYLE, dpi=plt.rcParams['savefig.dpi'], **params)
+    return cache_key, cache.fetch(cache_key, filename)
+
 def get_habits_data(start_date=None, end_date=None, days=30) -> pd.DataFrame:
     """获取习惯数据"""
     if not start_date or not end_date:
@@ -54,7 +74,7 @@ def get_habits_data(start_date=None, end_date=None, days=30) -> pd.DataFrame:
     return db.query_to_dataframe(query, {
         "start_date": start_date,
         "end_date": end_date
-    })
+    }, arrow=True, **COLUMN_TYPES['habits'])
 
 def get_todos_data(start_date=None, end_date=None, days=30) -> pd.DataFrame:
     """获取待办事项数据"""
@@ -68,14 +88,15 @@ def get_todos_data(start_date=None, end_date=None, days=30) -> pd.DataFrame:
         id, title, description, status, due_date, completed_at, 
         priority, created_at, updated_at, tags
     FROM todos
-    WHERE (DATE(created_at) BETWEEN %(start_date)s AND %(end_date)s) 
-       OR (DATE(completed_at) BETWEEN %(start_date)s AND %(end_date)s)
+    WHERE ((created_at AT TIME ZONE %(tz)s)::date BETWEEN %(start_date)s AND %(end_date)s) 
+       OR ((completed_at AT TIME ZONE %(tz)s)::date BETWEEN %(start_date)s AND %(end_date)s)
     ORDER BY priority DESC, created_at
     """
     return db.query_to_dataframe(query, {
         "start_date": start_date,
-        "end_date": end_date
-    })
+        "end_date": end_date,
+        "tz": config.timezone
+    }, arrow=True, **COLUMN_TYPES['todos'])
 
 def plot_habits_completion_trend(df: pd.DataFrame, output_dir: str = "output") -> str:
     """绘制习惯完成趋势图"""
@@ -83,21 +104,26 @@ def plot_habits_completion_trend(df: pd.DataFrame, output_dir: str = "output") -
         logger.warning("没有习惯数据，无法生成趋势图")
         return ""
     
-    # 确保日期列的类型正确
-    df['completion_date'] = pd.to_datetime(df['completion_date'])
-    
     # 按日期和类别统计完成率
-    daily_completion = df.groupby([df['completion_date'].dt.date, 'category']).agg(
+    daily_completion = df.groupby([df['completion_date'].dt.date, 'category'], observed=True).agg(
         total=('id', 'count'),
         completed=('is_completed', 'sum')
     ).reset_index()
     daily_completion['completion_rate'] = (daily_completion['completed'] / daily_completion['total']) * 100
+    overall_avg = df['is_completed'].mean() * 100
+    
+    filename = os.path.join(output_dir, "habits_completion_trend.png")
+    cache_key, cached = fetch_cached_chart('habits_completion_trend', daily_completion, filename,
+                                           overall_avg=float(overall_avg))
+    if cached:
+        logger.info(f"习惯完成趋势图未变化，复用缓存 {filename}")
+        return filename
     
     # 创建图表
     plt.figure(figsize=(14, 8))
     
     # 按类别分组绘制
-    for category, group in daily_completion.groupby('category'):
+    for category, group in daily_completion.groupby('category', observed=True):
         plt.plot(group['completion_date'], group['completion_rate'], 
                 marker='o', linestyle='-', label=category)
     
@@ -109,30 +135,29 @@ def plot_habits_completion_trend(df: pd.DataFrame, output_dir: str = "output") -
     plt.legend(title='类别', loc='best')
     
     # 添加平均线
-    overall_avg = df['is_completed'].mean() * 100
     plt.axhline(y=overall_avg, color='r', linestyle='--', 
                label=f'整体平均: {overall_avg:.1f}%')
     
     # 保存图表
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    
-    filename = os.path.join(output_dir, "habits_completion_trend.png")
     plt.savefig(filename)
     plt.close()
+    get_chart_cache().store(cache_key, filename)
     logger.info(f"习惯完成趋势图已保存到 {filename}")
     
     return filename
 
-def plot_habits_heatmap(df: pd.DataFrame, output_dir: str = "output") -> str:
-    """绘制习惯热力图"""
+def plot_habits_heatmap(df: pd.DataFrame, output_dir: str = "output",
+                        layout: str = "grid", per_page: int = 12) -> str:
+    """
+    绘制习惯热力图
+    
+    layout为"grid"时所有习惯画在同一张分页网格图中（共用颜色条），
+    为"single"时每个习惯单独保存一张图。
+    """
     if df.empty:
         logger.warning("没有习惯数据，无法生成热力图")
         return ""
     
-    # 确保日期列的类型正确
-    df['completion_date'] = pd.to_datetime(df['completion_date'])
-    
     # 提取日期和星期几
     df['date'] = df['completion_date'].dt.date
     df['weekday'] = df['completion_date'].dt.weekday  # 0=周一, 6=周日
@@ -146,11 +171,42 @@ def plot_habits_heatmap(df: pd.DataFrame, output_dir: str = "output") -> str:
         aggfunc='mean'
     ).fillna(0)
     
+    weekday_names = ['周一', '周二', '周三', '周四', '周五', '周六', '周日']
+    
+    if layout == "grid":
+        # 从已有的透视表中按习惯切出 (星期 × 周) 矩阵，画在同一张网格图中
+        panels = [
+            (habit_name, habit_data.reset_index(level=0, drop=True).reindex(range(7), fill_value=0).to_numpy())
+            for habit_name, habit_data in pivot_df.groupby(level=0)
+        ]
+        files = render_heatmap_grid(
+            panels,
+            os.path.join(output_dir, "habits_heatmap_grid"),
+            per_page=per_page,
+            vmin=0,
+            vmax=1,
+            cbar_label='完成率',
+            xticklabels=[str(week) for week in pivot_df.columns],
+            yticklabels=weekday_names,
+            suptitle='习惯每周完成情况',
+            cache=get_chart_cache(),
+            cache_style=CHART_STYLE
+        )
+        logger.info(f"{len(panels)} 个习惯的热力图已保存到 {len(files)} 张网格图中")
+        return output_dir
+    
     # 每个习惯生成一个热力图
     for habit_name, habit_data in pivot_df.groupby(level=0):
         # 重置多级索引，只保留weekday
         habit_data = habit_data.reset_index(level=0, drop=True)
         
+        # 文件名中不能包含特殊字符
+        safe_name = "".join([c if c.isalnum() else "_" for c in habit_name])
+        filename = os.path.join(output_dir, f"habit_heatmap_{safe_name}.png")
+        cache_key, cached = fetch_cached_chart('habit_heatmap', habit_data, filename, habit_name=habit_name)
+        if cached:
+            continue
+        
         plt.figure(figsize=(12, 4))
         
         # 绘制热力图
@@ -164,7 +220,6 @@ def plot_habits_heatmap(df: pd.DataFrame, output_dir: str = "output") -> str:
         )
         
         # 设置y轴标签为星期几
-        weekday_names = ['周一', '周二', '周三', '周四', '周五', '周六', '周日']
         ax.set_yticklabels(weekday_names)
         
         # 设置标题和标签
@@ -172,14 +227,9 @@ def plot_habits_heatmap(df: pd.DataFrame, output_dir: str = "output") -> str:
         plt.xlabel('周数', fontsize=12)
         
         # 保存图表
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-        
-        # 文件名中不能包含特殊字符
-        safe_name = "".join([c if c.isalnum() else "_" for c in habit_name])
-        filename = os.path.join(output_dir, f"habit_heatmap_{safe_name}.png")
         plt.savefig(filename)
         plt.close()
+        get_chart_cache().store(cache_key, filename)
         logger.info(f"习惯 '{habit_name}' 热力图已保存到 {filename}")
     
     return output_dir
@@ -193,6 +243,12 @@ def plot_todos_priority_pie(df: pd.DataFrame, output_dir: str = "output") -> str
     # 按优先级统计
     priority_counts = df['priority'].value_counts().sort_index()
     
+    filename = os.path.join(output_dir, "todos_priority_pie.png")
+    cache_key, cached = fetch_cached_chart('todos_priority_pie', priority_counts, filename)
+    if cached:
+        logger.info(f"待办事项优先级饼图未变化，复用缓存 {filename}")
+        return filename
+    
     # 创建图表
     plt.figure(figsize=(10, 8))
     
@@ -214,33 +270,28 @@ def plot_todos_priority_pie(df: pd.DataFrame, output_dir: str = "output") -> str
     plt.axis('equal')  # 保证饼图是圆形的
     
     # 保存图表
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    
-    filename = os.path.join(output_dir, "todos_priority_pie.png")
     plt.savefig(filename)
     plt.close()
+    get_chart_cache().store(cache_key, filename)
     logger.info(f"待办事项优先级饼图已保存到 {filename}")
     
     return filename
 
-def plot_todos_status_trend(df: pd.DataFrame, output_dir: str = "output") -> str:
-    """绘制待办事项状态趋势图"""
-    if df.empty:
+def plot_todos_status_trend(daily: pd.DataFrame, output_dir: str = "output") -> str:
+    """绘制待办事项状态趋势图，daily为活动立方体按天汇总的指标"""
+    if not (daily['todos_created'].any() or daily['todos_completed'].any()):
         logger.warning("没有待办事项数据，无法生成趋势图")
         return ""
     
-    # 转换日期列
-    df['created_at'] = pd.to_datetime(df['created_at'])
-    df['completed_at'] = pd.to_datetime(df['completed_at'])
+    # 每天的待办创建和完成数量
+    created_counts = daily['todos_created']
+    completed_counts = daily['todos_completed']
     
-    # 提取日期
-    df['created_date'] = df['created_at'].dt.date
-    df['completed_date'] = df['completed_at'].dt.date
-    
-    # 计算每天的待办创建和完成数量
-    created_counts = df.groupby('created_date').size()
-    completed_counts = df.dropna(subset=['completed_date']).groupby('completed_date').size()
+    filename = os.path.join(output_dir, "todos_status_trend.png")
+    cache_key, cached = fetch_cached_chart('todos_status_trend', [created_counts, completed_counts], filename)
+    if cached:
+        logger.info(f"待办事项状态趋势图未变化，复用缓存 {filename}")
+        return filename
     
     # 创建图表
     plt.figure(figsize=(14, 8))
@@ -259,20 +310,9 @@ def plot_todos_status_trend(df: pd.DataFrame, output_dir: str = "output") -> str
     plt.legend()
     
     # 计算累计创建和完成数量
-    all_dates = sorted(set(list(created_counts.index) + list(completed_counts.index)))
-    cumulative_created = []
-    cumulative_completed = []
-    running_created = 0
-    running_completed = 0
-    
-    for date in all_dates:
-        if date in created_counts:
-            running_created += created_counts[date]
-        if date in completed_counts:
-            running_completed += completed_counts[date]
-        
-        cumulative_created.append(running_created)
-        cumulative_completed.append(running_completed)
+    all_dates = daily.index
+    cumulative_created = created_counts.cumsum()
+    cumulative_completed = completed_counts.cumsum()
     
     # 添加第二个y轴
     ax2 = plt.gca().twinx()
@@ -284,59 +324,21 @@ def plot_todos_status_trend(df: pd.DataFrame, output_dir: str = "output") -> str
     ax2.legend(loc='upper right')
     
     # 保存图表
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    
-    filename = os.path.join(output_dir, "todos_status_trend.png")
     plt.savefig(filename)
     plt.close()
+    get_chart_cache().store(cache_key, filename)
     logger.info(f"待办事项状态趋势图已保存到 {filename}")
     
     return filename
 
-def plot_productivity_calendar(habits_df: pd.DataFrame, todos_df: pd.DataFrame, 
-                             output_dir: str = "output") -> str:
-    """绘制生产力日历热力图"""
-    if habits_df.empty and todos_df.empty:
+def plot_productivity_calendar(daily: pd.DataFrame, output_dir: str = "output") -> str:
+    """绘制生产力日历热力图，daily为活动立方体按天汇总的指标，得分与综合报告一致"""
+    # 只给有习惯或待办记录的日期计算生产力得分
+    active = (daily['habits_total'] > 0) | (daily['todos_created'] > 0) | (daily['todos_completed'] > 0)
+    if not active.any():
         logger.warning("没有数据，无法生成生产力日历")
         return ""
-    
-    # 计算每天的生产力得分
-    
-    # 1. 习惯得分
-    daily_habits = pd.DataFrame()
-    if not habits_df.empty:
-        habits_df['completion_date'] = pd.to_datetime(habits_df['completion_date'])
-        daily_habits = habits_df.groupby(habits_df['completion_date'].dt.date).agg(
-            habit_score=('is_completed', 'mean')
-        ) * 100  # 转换为0-100分
-    
-    # 2. 待办得分
-    daily_todos = pd.DataFrame()
-    if not todos_df.empty:
-        todos_df['completed_at'] = pd.to_datetime(todos_df['completed_at'])
-        todos_df['date'] = todos_df['completed_at'].dt.date
-        
-        # 按日期分组
-        daily_todos = todos_df.groupby('date').apply(
-            lambda x: len(x[x['status'] == 'completed']) / len(x) if len(x) > 0 else 0
-        ).to_frame('todo_score') * 100  # 转换为0-100分
-    
-    # 合并得分
-    daily_scores = pd.DataFrame()
-    if not daily_habits.empty and not daily_todos.empty:
-        daily_scores = daily_habits.join(daily_todos, how='outer').fillna(0)
-        daily_scores['productivity_score'] = daily_scores['habit_score'] * 0.4 + daily_scores['todo_score'] * 0.6
-    elif not daily_habits.empty:
-        daily_scores = daily_habits
-        daily_scores['productivity_score'] = daily_scores['habit_score']
-    elif not daily_todos.empty:
-        daily_scores = daily_todos
-        daily_scores['productivity_score'] = daily_scores['todo_score']
-    
-    if daily_scores.empty:
-        logger.warning("无法计算生产力得分，日历热力图生成失败")
-        return ""
+    daily_scores = add_rates(daily[active])
     
     # 准备绘制日历热力图
     all_dates = daily_scores.index
@@ -345,10 +347,11 @@ def plot_productivity_calendar(habits_df: pd.DataFrame, todos_df: pd.DataFrame,
     
     # 创建日期范围内的所有日期
     date_range = pd.date_range(start=start_date, end=end_date)
-    date_df = pd.DataFrame(index=date_range.date)
+    date_df = pd.DataFrame(index=date_range)
     
     # 合并得分数据
-    date_df = date_df.join(daily_scores[['productivity_score']], how='left').fillna(0)
+    scores = daily_scores[['productivity_score']].set_axis(pd.to_datetime(daily_scores.index))
+    date_df = date_df.join(scores, how='left').fillna(0)
     
     # 添加年、月、日、星期几列
     date_df['year'] = date_df.index.year
@@ -367,8 +370,8 @@ def plot_productivity_calendar(habits_df: pd.DataFrame, todos_df: pd.DataFrame,
             # 填入数据
             for _, row in month_data.iterrows():
                 # 计算该日期在日历中的位置
-                day = row['day']
-                weekday = row['weekday']
+                day = int(row['day'])
+                weekday = int(row['weekday'])
                 
                 # 计算第几周
                 first_day = datetime(year, month, 1)
@@ -384,6 +387,12 @@ def plot_productivity_calendar(habits_df: pd.DataFrame, todos_df: pd.DataFrame,
                 'calendar': month_calendar
             })
     
+    filename = os.path.join(output_dir, "productivity_calendar.png")
+    cache_key, cached = fetch_cached_chart('productivity_calendar', date_df, filename)
+    if cached:
+        logger.info(f"生产力日历热力图未变化，复用缓存 {filename}")
+        return filename
+    
     # 绘制日历热力图
     month_names = ['一月', '二月', '三月', '四月', '五月', '六月', 
                   '七月', '八月', '九月', '十月', '十一月', '十二月']
@@ -420,18 +429,20 @@ def plot_productivity_calendar(habits_df: pd.DataFrame, todos_df: pd.DataFrame,
     plt.tight_layout()
     
     # 保存图表
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    
-    filename = os.path.join(output_dir, "productivity_calendar.png")
     plt.savefig(filename)
     plt.close()
+    get_chart_cache().store(cache_key, filename)
     logger.info(f"生产力日历热力图已保存到 {filename}")
     
     return filename
 
-def generate_charts(days=30, output_dir="output"):
-    """生成所有图表"""
+def generate_charts(days=30, output_dir="output", heatmap_layout="grid", cube: Optional[ActivityCube] = None):
+    """
+    生成所有图表
+
+    按天的待办趋势和生产力日历使用与活动立方体相同的按天指标：调用方传入cube时切片到本次的日期范围，
+    否则直接由本次查询的习惯和待办明细计算，每张表只查询一次。
+    """
     logger.info(f"开始生成最近 {days} 天的数据图表...")
     
     # 获取数据
@@ -441,6 +452,10 @@ def generate_charts(days=30, output_dir="output"):
     
     habits_df = get_habits_data(start_date, end_date)
     todos_df = get_todos_data(start_date, end_date)
+    if cube is not None:
+        daily = cube.slice(start_date=start_date, end_date=end_date).by_day()
+    else:
+        daily = daily_from_details(habits_df, todos_df, start_date, end_date)
     
     # 保存原始数据
     save_dataframe_to_csv(habits_df, f"chart_habits_data.csv", output_dir)
@@ -452,15 +467,15 @@ def generate_charts(days=30, output_dir="output"):
     # 习惯数据图表
     if not habits_df.empty:
         chart_files['habits_completion_trend'] = plot_habits_completion_trend(habits_df, output_dir)
-        chart_files['habits_heatmap'] = plot_habits_heatmap(habits_df, output_dir)
+        chart_files['habits_heatmap'] = plot_habits_heatmap(habits_df, output_dir, layout=heatmap_layout)
     
     # 待办事项图表
     if not todos_df.empty:
         chart_files['todos_priority_pie'] = plot_todos_priority_pie(todos_df, output_dir)
-        chart_files['todos_status_trend'] = plot_todos_status_trend(todos_df, output_dir)
+        chart_files['todos_status_trend'] = plot_todos_status_trend(daily, output_dir)
     
     # 生产力日历
-    chart_files['productivity_calendar'] = plot_productivity_calendar(habits_df, todos_df, output_dir)
+    chart_files['productivity_calendar'] = plot_productivity_calendar(daily, output_dir)
     
     # 保存图表信息
     chart_info = {
@@ -479,6 +494,7 @@ def generate_charts(days=30, output_dir="output"):
         json.dump(chart_info, f, ensure_ascii=False, indent=2, default=str)
     
     logger.info(f"数据图表生成完成，共 {len(chart_files)} 个图表")
+    get_chart_cache().log_stats()
     return chart_info
 
 def main():
@@ -492,6 +508,8 @@ def main():
                       help='开始日期 (YYYY-MM-DD)')
     parser.add_argument('--end-date',
                       help='结束日期 (YYYY-MM-DD)')
+    parser.add_argument('--heatmap-layout', choices=['grid', 'single'], default='grid',
+                      help='习惯热力图布局: grid (所有习惯画在一张网格图中), single (每个习惯一张图)')
     
     args = parser.parse_args()
     
@@ -506,7 +524,7 @@ def main():
         else:
             days = args.days
         
-        generate_charts(days, args.output)
+        generate_charts(days, args.output, args.heatmap_layout)
         return 0
         
     except Exception as e:
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+习惯打卡位图
+
+以位图形式紧凑表示单个习惯的打卡历史：自起始日起每个自然日占一位，
+成功打卡和失败打卡分别存放在两个位图中。连续天数、时间段计数和
+星期分布等统计都通过整数位运算完成，多年的历史也只需几百字节。
+"""
+
+import datetime
+from datetime import timedelta
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+DAYS_PER_WEEK = 7
+
+
+def _to_date(value: Any) -> datetime.date:
+    """将打卡时间统一转换为日期"""
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return value
+
+
+@lru_cache(maxsize=256)
+def _stride_mask(length: int, offset: int) -> int:
+    """从offset开始每隔7位置1的掩码，用于按星期统计"""
+    if offset >= length:
+        return 0
+    repeats = (length - offset + DAYS_PER_WEEK - 1) // DAYS_PER_WEEK
+    # (2^(7n) - 1) / (2^7 - 1) = 1 + 2^7 + 2^14 + ... 共n项
+    pattern = ((1 << (DAYS_PER_WEEK * repeats)) - 1) // ((1 << DAYS_PER_WEEK) - 1)
+    return (pattern << offset) & ((1 << length) - 1)
+
+
+class HabitBitmap:
+    """单个习惯的打卡位图，第i位对应 start_date + i 天"""
+
+    def __init__(self, start_date: datetime.date, length: int,
+                 checkin_bits: int = 0, failed_bits: int = 0):
+        self.start_date = start_date
+        self.length = max(length, checkin_bits.bit_length(), failed_bits.bit_length())
+        self.checkin_bits = checkin_bits
+        self.failed_bits = failed_bits
+
+    @classmethod
+    def from_dates(cls, checkin_dates: Iterable[datetime.date],
+                   failed_dates: Iterable[datetime.date] = (),
+                   start_date: Optional[datetime.date] = None,
+                   end_date: Optional[datetime.date] = None) -> 'HabitBitmap':
+        """根据打卡日期集合构建位图"""
+        checkin_dates = set(checkin_dates)
+        failed_dates = set(failed_dates)
+        all_dates = checkin_dates | failed_dates
+
+        if start_date is None:
+            start_date = min(all_dates) if all_dates else datetime.date.today()
+        if end_date is None:
+            end_date = max(all_dates | {datetime.date.today()})
+
+        checkin_bits = 0
+        for day in checkin_dates:
+            index = (day - start_date).days
+            if index >= 0:
+                checkin_bits |= 1 << index
+
+        failed_bits = 0
+        for day in failed_dates:
+            index = (day - start_date).days
+            if index >= 0:
+                failed_bits |= 1 << index
+
+        length = (end_date - start_date).days + 1
+        return cls(start_date, length, checkin_bits, failed_bits)
+
+    @classmethod
+    def from_entries(cls, entries: Iterable[Dict[str, Any]],
+                     start_date: Optional[datetime.date] = None,
+                     end_date: Optional[datetime.date] = None) -> 'HabitBitmap':
+        """根据habit_entries记录构建位图，status为failed的记录进入失败位图"""
+        checkin_dates = set()
+        failed_dates = set()
+        for entry in entries:
+            day = _to_date(entry['completed_at'])
+            if entry.get('status') == 'failed':
+                failed_dates.add(day)
+            else:
+                checkin_dates.add(day)
+        return cls.from_dates(checkin_dates, failed_dates, start_date, end_date)
+
+    @classmethod
+    def from_bytes(cls, start_date: datetime.date, length: int,
+                   checkin_bytes: Optional[bytes], failed_bytes: Optional[bytes] = None) -> 'HabitBitmap':
+        """从数据库中存储的bytea还原位图"""
+        checkin_bits = int.from_bytes(bytes(checkin_bytes or b''), 'little')
+        failed_bits = int.from_bytes(bytes(failed_bytes or b''), 'little')
+        return cls(start_date, length, checkin_bits, failed_bits)
+
+    def end_date(self) -> datetime.date:
+        """位图覆盖的最后一天"""
+        return self.start_date + timedelta(days=max(self.length, 1) - 1)
+
+    def extend(self, since: datetime.date, checkin_dates: Iterable[datetime.date],
+               failed_dates: Iterable[datetime.date] = (),
+               end_date: Optional[datetime.date] = None) -> 'HabitBitmap':
+        """
+        用since及之后的打卡日期更新位图，返回新的位图
+
+        since之前的位保持不变，since及之后的位按传入的日期重建，
+        因此since之后（含since当天）的全部打卡日期都需要传入。
+        """
+        keep = max(self._index(since), 0)
+        mask = (1 << keep) - 1
+        newer = HabitBitmap.from_dates(checkin_dates, failed_dates, self.start_date, end_date)
+        return HabitBitmap(
+            self.start_date,
+            max(newer.length, keep),
+            (self.checkin_bits & mask) | (newer.checkin_bits & ~mask),
+            (self.failed_bits & mask) | (newer.failed_bits & ~mask)
+        )
+
+    def to_bytes(self) -> Dict[str, Any]:
+        """序列化为可存入bytea列的字节串（小端序，第0位为起始日）"""
+        size = (self.length + 7) // 8
+        return {
+            "bitmap_start": self.start_date,
+            "bitmap_length": self.length,
+            "checkin_bitmap": self.checkin_bits.to_bytes(size, 'little'),
+            "failed_bitmap": self.failed_bits.to_bytes(size, 'little')
+        }
+
+    def __repr__(self) -> str:
+        return (f"HabitBitmap(start_date={self.start_date}, length={self.length}, "
+                f"check_ins={self.total_check_ins()}, failed_days={self.failed_days()})")
+
+    def _bits(self, failed: bool) -> int:
+        return self.failed_bits if failed else self.checkin_bits
+
+    def _index(self, day: datetime.date) -> int:
+        return (day - self.start_date).days
+
+    def has_check_in(self, day: datetime.date) -> bool:
+        """指定日期是否有成功打卡"""
+        index = self._index(day)
+        return index >= 0 and bool((self.checkin_bits >> index) & 1)
+
+    def total_check_ins(self) -> int:
+        """成功打卡的天数"""
+        return self.checkin_bits.bit_count()
+
+    def failed_days(self) -> int:
+        """有失败记录的天数"""
+        return self.failed_bits.bit_count()
+
+    def last_check_in_date(self) -> Optional[datetime.date]:
+        """最后一次成功打卡的日期"""
+        if not self.checkin_bits:
+            return None
+        return self.start_date + timedelta(days=self.checkin_bits.bit_length() - 1)
+
+    def current_streak(self, as_of: Optional[datetime.date] = None) -> int:
+        """
+        截至as_of（含）向前的连续打卡天数
+
+        默认从昨天开始统计，避免当天还没打卡时影响连续打卡记录。
+        """
+        if as_of is None:
+            as_of = datetime.date.today() - timedelta(days=1)
+        index = self._index(as_of)
+        if index < 0 or not (self.checkin_bits >> index) & 1:
+            return 0
+
+        window = (1 << (index + 1)) - 1
+        gaps = ~self.checkin_bits & window
+        if not gaps:
+            return index + 1
+        # 最高位的空缺即为连续区间的左边界
+        return index - (gaps.bit_length() - 1)
+
+    def longest_streak(self) -> int:
+        """最长连续打卡天数，每次与右移一位后的自身相与会使每段连续区间缩短一天"""
+        bits = self.checkin_bits
+        longest = 0
+        while bits:
+            bits &= bits >> 1
+            longest += 1
+        return longest
+
+    def count_in_range(self, start: Optional[datetime.date] = None,
+                       end: Optional[datetime.date] = None, failed: bool = False) -> int:
+        """统计[start, end]区间内的打卡（或失败）天数"""
+        low = max(self._index(start), 0) if start else 0
+        high = min(self._index(end), self.length - 1) if end else self.length - 1
+        if high < low:
+            return 0
+        window = (1 << (high - low + 1)) - 1
+        return ((self._bits(failed) >> low) & window).bit_count()
+
+    def weekday_histogram(self, start: Optional[datetime.date] = None,
+                          end: Optional[datetime.date] = None, failed: bool = False) -> List[int]:
+        """按星期统计打卡天数，返回周一到周日的7个计数"""
+        low = max(self._index(start), 0) if start else 0
+        high = min(self._index(end), self.length - 1) if end else self.length - 1
+        if high < low:
+            return [0] * DAYS_PER_WEEK
+
+        span = high - low + 1
+        bits = (self._bits(failed) >> low) & ((1 << span) - 1)
+        first_weekday = (self.start_date + timedelta(days=low)).weekday()
+
+        histogram = [0] * DAYS_PER_WEEK
+        for offset in range(DAYS_PER_WEEK):
+            weekday = (first_weekday + offset) % DAYS_PER_WEEK
+            histogram[weekday] = (bits & _stride_mask(span, offset)).bit_count()
+        return histogram
+
+    def to_array(self, start: Optional[datetime.date] = None,
+                 end: Optional[datetime.date] = None, failed: bool = False) -> np.ndarray:
+        """展开为按天的uint8数组（1=打卡），用于热力图等需要逐日数据的场景"""
+        start = start or self.start_date
+        end = end or (self.start_date + timedelta(days=self.length - 1))
+        span = (end - start).days + 1
+        if span <= 0:
+            return np.zeros(0, dtype=np.uint8)
+
+        low = self._index(start)
+        bits = self._bits(failed)
+        if low >= 0:
+            bits >>= low
+            pad = 0
+        else:
+            pad = min(-low, span)
+        keep = span - pad
+        bits &= (1 << keep) - 1
+
+        raw = np.frombuffer(bits.to_bytes((span + 7) // 8, 'little'), dtype=np.uint8)
+        days = np.unpackbits(raw, bitorder='little')[:keep]
+        if pad:
+            days = np.concatenate([np.zeros(pad, dtype=np.uint8), days])
+        return days
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+习惯应打卡日历掩码
+
+根据习惯的打卡频率和打卡日（checkin_days）计算统计周期内每天是否应打卡。
+同一周期内打卡规则相同的习惯共享同一份掩码（按规则缓存），
+批量计算完成率时只需对掩码做少量数组求和。
+"""
+
+import datetime
+from collections import Counter
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# 打卡日使用1-7表示周一到周日
+ALL_WEEKDAYS = (1, 2, 3, 4, 5, 6, 7)
+
+
+def checkin_days_key(habit: Dict[str, Any]) -> Tuple[int, ...]:
+    """
+    将习惯的checkin_days规范化为可缓存的元组
+
+    与原有逻辑保持一致：缺少该字段时视为每天都要打卡，字段不是列表时视为没有打卡日。
+    """
+    if habit.get('frequency') != 'daily':
+        return ()
+    checkin_days = habit.get('checkin_days', list(ALL_WEEKDAYS))
+    if not isinstance(checkin_days, list):
+        return ()
+    return tuple(sorted(set(checkin_days)))
+
+
+@lru_cache(maxsize=1024)
+def expected_checkin_mask(period_start: datetime.date, period_end: datetime.date,
+                          frequency: Optional[str],
+                          checkin_days: Tuple[int, ...] = ALL_WEEKDAYS) -> Tuple[int, np.ndarray]:
+    """
+    计算[period_start, period_end]内应打卡的天数和逐日布尔掩码
+
+    参数:
+        frequency: 打卡频率，'daily'、'weekly' 或 'monthly'
+        checkin_days: 每日习惯的打卡日（1-7），其他频率忽略
+
+    返回:
+        (应打卡次数, 只读的布尔数组，第i个元素对应 period_start + i 天)
+
+    每周习惯在周期内每7天应打卡一次（从周期第一天算起），
+    每月习惯在周期第一天和之后每个月的1号各应打卡一次。
+    """
+    days = (period_end - period_start).days + 1
+    if days <= 0:
+        mask = np.zeros(0, dtype=bool)
+    elif frequency == 'daily':
+        weekdays = (np.arange(days) + period_start.weekday()) % 7 + 1
+        mask = np.isin(weekdays, checkin_days)
+    elif frequency == 'weekly':
+        mask = np.arange(days) % 7 == 0
+    elif frequency == 'monthly':
+        dates = np.arange(np.datetime64(period_start, 'D'), np.datetime64(period_end, 'D') + 1)
+        mask = dates == dates.astype('datetime64[M]').astype('datetime64[D]')
+        mask[0] = True
+    else:
+        mask = np.zeros(days, dtype=bool)
+
+    mask.setflags(write=False)
+    return int(mask.sum()), mask
+
+
+def expected_checkin_counts(habits: List[Dict[str, Any]], period_start: datetime.date,
+                            period_end: datetime.date) -> np.ndarray:
+    """计算每个习惯在周期内应打卡的次数，返回与habits顺序一致的整数数组"""
+    return np.array([
+        expected_checkin_mask(period_start, period_end, habit.get('frequency'), checkin_days_key(habit))[0]
+        for habit in habits
+    ], dtype=np.int64)
+
+
+def scheduled_daily_habit_counts(habits: List[Dict[str, Any]], period_start: datetime.date,
+                                 period_end: datetime.date) -> np.ndarray:
+    """计算周期内每天应打卡的每日习惯数量，相同打卡日的习惯合并为一次掩码累加"""
+    days = max((period_end - period_start).days + 1, 0)
+    counts = np.zeros(days, dtype=np.int64)
+    schedules = Counter(checkin_days_key(habit) for habit in habits if habit.get('frequency') == 'daily')
+    for checkin_days, habit_count in schedules.items():
+        _, mask = expected_checkin_mask(period_start, period_end, 'daily', checkin_days)
+        counts += mask * habit_count
+    return counts
+
+
+def completion_rates(check_ins: np.ndarray, expected: np.ndarray) -> np.ndarray:
+    """按应打卡次数计算完成率（0-1），应打卡次数为0时完成率为0"""
+    check_ins = np.asarray(check_ins, dtype=float)
+    expected = np.asarray(expected, dtype=float)
+    return np.divide(check_ins, expected, out=np.zeros_like(check_ins), where=expected > 0)
@@ -12,13 +12,17 @@ import os
 import json
 import argparse
 import datetime
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import timedelta
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 
+from chart_cache import get_chart_cache
 from habit_stats import HabitStatsService
+from heatmap_grid import render_heatmap_grid
 from db import get_db_connection
 
 # 设置matplotlib中文字体支持
@@ -28,79 +32,150 @@ try:
 except:
     print("警告: 未能正确设置中文字体，图表中的中文可能无法正确显示")
 
+# 图表缓存键中的样式版本，修改图表样式后需要更新以使已缓存的图片失效
+CHART_STYLE = 'habit_report-v1'
 
-def create_output_dir():
-    """创建输出目录"""
+
+def create_output_dir(user_id=None):
+    """创建输出目录，指定user_id时使用 output/<user_id> 子目录"""
     output_dir = os.path.join(os.path.dirname(__file__), 'output')
+    if user_id is not None:
+        output_dir = os.path.join(output_dir, str(user_id))
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
         
     return output_dir
 
 
-def generate_habit_completion_trend(stats_service, user_id, days=30):
+def build_completion_matrix(habit_ids, entry_habit_ids, entry_dates, start_date, end_date):
+    """
+    构建 (天 × 习惯) 的uint8完成矩阵，第i行对应 start_date + i 天，第j列对应 habit_ids[j]
+    
+    直接用打卡记录的行列下标做NumPy散点赋值，同一天多次打卡也只记为1，
+    不在日期范围或不在habit_ids中的记录被忽略。
+    """
+    days = max((end_date - start_date).days + 1, 0)
+    matrix = np.zeros((days, len(habit_ids)), dtype=np.uint8)
+    if days == 0 or len(entry_dates) == 0:
+        return matrix
+    
+    rows = (pd.DatetimeIndex(entry_dates) - pd.Timestamp(start_date)).days.to_numpy()
+    cols = pd.Index(habit_ids).get_indexer(entry_habit_ids)
+    valid = (rows >= 0) & (rows < days) & (cols >= 0)
+    matrix[rows[valid], cols[valid]] = 1
+    return matrix
+
+
+class HabitReportContext:
+    """
+    单次报告的数据上下文
+
+    统计数据和打卡记录各只查询一次，所有图表函数共享同一个上下文。
+    属性和方法返回的都是副本，图表函数对其修改不会影响其他图表。
+    """
+
+    ENTRY_COLUMNS = ['habit_id', 'completed_at', 'status', 'entry_date']
+
+    def __init__(self, user_id, habits_stats, entries):
+        self.user_id = user_id
+        self._habits_stats = [dict(habit) for habit in habits_stats]
+        self._stats = pd.DataFrame(self._habits_stats)
+
+        entries_df = pd.DataFrame(entries, columns=self.ENTRY_COLUMNS)
+        entries_df['entry_date'] = pd.to_datetime(entries_df['entry_date'])
+        # 只保留有统计数据的习惯，与逐个习惯查询时的范围一致
+        habit_ids = [habit['habit_id'] for habit in self._habits_stats]
+        self._entries = entries_df[entries_df['habit_id'].isin(habit_ids)].reset_index(drop=True)
+        self._matrices = {}
+
+    @classmethod
+    def load(cls, stats_service, user_id):
+        """一次性加载用户的习惯统计数据和全部打卡记录"""
+        return cls(
+            user_id,
+            stats_service.get_all_user_stats(user_id),
+            stats_service.get_entries_by_user_id(user_id)
+        )
+
+    @property
+    def habits_stats(self):
+        """习惯统计数据列表（副本）"""
+        return [dict(habit) for habit in self._habits_stats]
+
+    @property
+    def stats(self):
+        """习惯统计数据DataFrame（副本）"""
+        return self._stats.copy()
+
+    def habit_names(self):
+        """习惯ID到名称的映射"""
+        return {habit['habit_id']: habit['name'] for habit in self._habits_stats}
+
+    def completion_matrix(self, start_date, end_date):
+        """
+        日期范围内的 (天 × 习惯) 完成矩阵，行索引为日期，列为habit_id
+        
+        同一范围只计算一次，趋势图、总完成率和JSON报告共用。
+        """
+        key = (start_date, end_date)
+        if key not in self._matrices:
+            entries = self._entries[self._entries['status'] != 'failed']
+            habit_ids = [habit['habit_id'] for habit in self._habits_stats]
+            self._matrices[key] = build_completion_matrix(
+                habit_ids, entries['habit_id'], entries['entry_date'], start_date, end_date
+            )
+        return pd.DataFrame(
+            self._matrices[key].copy(),
+            index=pd.date_range(start_date, end_date, freq='D'),
+            columns=[habit['habit_id'] for habit in self._habits_stats]
+        )
+
+    def completed_entries(self, start_date=None):
+        """非失败状态的打卡记录（副本），可按打卡日期过滤"""
+        df = self._entries[self._entries['status'] != 'failed']
+        if start_date is not None:
+            df = df[df['entry_date'] >= pd.Timestamp(start_date)]
+        return df.copy()
+
+
+def generate_habit_completion_trend(stats_service, user_id, days=30, context=None, output_dir=None):
     """生成习惯完成率趋势图"""
+    if context is None:
+        context = HabitReportContext.load(stats_service, user_id)
+    if output_dir is None:
+        output_dir = create_output_dir()
+    
     # 获取用户所有习惯的统计数据
-    habits_stats = stats_service.get_all_user_stats(user_id)
+    habits_stats = context.habits_stats
     
     if not habits_stats:
         print(f"没有找到用户 {user_id} 的习惯数据")
         return None
     
     # 获取日期范围
-    end_date = datetime.datetime.now().date()
-    start_date = end_date - timedelta(days=days-1)
-    
-    # 计算日期范围内每个习惯的打卡情况
-    habit_data = []
-    
-    for habit in habits_stats:
-        habit_id = habit['habit_id']
-        habit_name = habit['name']
-        
-        # 获取详细打卡记录
-        entries = stats_service.get_entries_by_habit_id(habit_id, user_id)
-        
-        # 按日期统计
-        daily_stats = {}
-        current_date = start_date
-        while current_date <= end_date:
-            date_str = current_date.strftime('%Y-%m-%d')
-            daily_stats[date_str] = {
-                'date': date_str,
-                'habit_name': habit_name,
-                'completed': 0  # 默认为未完成
-            }
-            current_date += timedelta(days=1)
-        
-        # 标记已完成的日期
-        for entry in entries:
-            if entry.get('status') != 'failed':
-                completed_date = entry['completed_at'].strftime('%Y-%m-%d') if isinstance(entry['completed_at'], datetime.datetime) else datetime.datetime.fromisoformat(entry['completed_at'].replace('Z', '+00:00')).strftime('%Y-%m-%d')
-                
-                if completed_date in daily_stats:
-                    daily_stats[completed_date]['completed'] = 1
-        
-        # 添加到数据集
-        habit_data.extend(daily_stats.values())
+    start_date, end_date = completion_window(days)
     
-    # 创建DataFrame
-    df = pd.DataFrame(habit_data)
+    # (天 × 习惯) 完成矩阵
+    matrix = context.completion_matrix(start_date, end_date)
     
-    if df.empty:
+    if matrix.empty:
         print("没有足够的数据来生成趋势图")
         return None
     
-    # 数据透视表
-    pivot_df = df.pivot_table(
-        index='date',
-        columns='habit_name',
-        values='completed', 
-        aggfunc='sum'
-    ).fillna(0)
+    # 每个习惯一列，同名习惯合并
+    pivot_df = matrix.rename(columns=context.habit_names())
+    pivot_df = pivot_df.T.groupby(level=0).sum().T
+    pivot_df.index = matrix.index.strftime('%Y-%m-%d')
     
     # 计算每日总完成率
-    pivot_df['总完成率'] = pivot_df.mean(axis=1) * 100
+    pivot_df['总完成率'] = matrix.to_numpy().mean(axis=1) * 100
+    
+    # 输入数据未变化时直接复用缓存的图片
+    output_file = os.path.join(output_dir, f'habit_completion_trend_{days}d.png')
+    cache = get_chart_cache()
+    cache_key = cache.make_key('habit_completion_trend', pivot_df, style=CHART_STYLE, dpi=300, days=days)
+    if cache.fetch(cache_key, output_file):
+        return output_file
     
     # 生成趋势图
     plt.figure(figsize=(15, 8))
@@ -138,18 +213,28 @@ def generate_habit_completion_trend(stats_service, user_id, days=30):
     plt.tight_layout()
     
     # 保存图表
-    output_dir = create_output_dir()
-    output_file = os.path.join(output_dir, f'habit_completion_trend_{days}d.png')
     plt.savefig(output_file, dpi=300, bbox_inches='tight')
     plt.close()
+    cache.store(cache_key, output_file)
     
     return output_file
 
 
-def generate_habit_heatmap(stats_service, user_id, weeks=10):
-    """生成习惯完成热力图（按周显示）"""
+def generate_habit_heatmap(stats_service, user_id, weeks=10, context=None, output_dir=None,
+                           layout='grid', per_page=12):
+    """
+    生成习惯完成热力图（按周显示）
+    
+    layout为'grid'时所有习惯画在同一张网格图中（每页per_page个，共用颜色条），
+    为'single'时每个习惯单独保存一张图。
+    """
+    if context is None:
+        context = HabitReportContext.load(stats_service, user_id)
+    if output_dir is None:
+        output_dir = create_output_dir()
+    
     # 获取用户所有习惯的统计数据
-    habits_stats = stats_service.get_all_user_stats(user_id)
+    habits_stats = context.habits_stats
     
     if not habits_stats:
         print(f"没有找到用户 {user_id} 的习惯数据")
@@ -159,85 +244,101 @@ def generate_habit_heatmap(stats_service, user_id, weeks=10):
     end_date = datetime.datetime.now().date()
     start_date = end_date - timedelta(days=weeks*7)
     
-    all_entries = []
-    habit_names = []
+    habit_names = [habit['name'] for habit in habits_stats]
     
     # 收集所有习惯的打卡数据
-    for habit in habits_stats:
-        habit_id = habit['habit_id']
-        habit_name = habit['name']
-        habit_names.append(habit_name)
-        
-        # 获取详细打卡记录
-        entries = stats_service.get_entries_by_habit_id(habit_id, user_id)
-        
-        for entry in entries:
-            if entry.get('status') != 'failed':
-                completed_date = entry['completed_at'] if isinstance(entry['completed_at'], datetime.datetime) else datetime.datetime.fromisoformat(entry['completed_at'].replace('Z', '+00:00'))
-                
-                if completed_date.date() >= start_date:
-                    all_entries.append({
-                        'date': completed_date.date(),
-                        'weekday': completed_date.weekday(),  # 0=周一，6=周日
-                        'week': (completed_date.date() - start_date).days // 7,
-                        'habit_name': habit_name,
-                        'completed': 1
-                    })
-    
-    if not all_entries:
+    entries = context.completed_entries(start_date)
+    
+    if entries.empty:
         print("没有足够的数据来生成热力图")
         return None
     
-    # 转换为DataFrame
-    df = pd.DataFrame(all_entries)
-    
-    # 每个习惯单独生成一个热力图
-    for habit_name in habit_names:
-        habit_df = df[df['habit_name'] == habit_name].copy()
+    # 转换为热力图所需的列
+    df = pd.DataFrame({
+        'date': entries['entry_date'].dt.date,
+        'weekday': entries['entry_date'].dt.weekday,  # 0=周一，6=周日
+        'week': (entries['entry_date'] - pd.Timestamp(start_date)).dt.days // 7,
+        'habit_name': entries['habit_id'].map(context.habit_names()),
+        'completed': 1
+    })
+    
+    all_weeks = range(weeks)
+    weekday_names = ['周一', '周二', '周三', '周四', '周五', '周六', '周日']
+    
+    if layout == 'grid':
+        # 预先计算 (习惯 × 周 × 星期) 的打卡次数，所有习惯画在同一张分页网格图中
+        habit_ids = [habit['habit_id'] for habit in habits_stats]
+        n_weeks = max(weeks, int(df['week'].max()) + 1)
+        counts = np.zeros((len(habit_ids), n_weeks, 7))
+        habit_index = pd.Index(habit_ids).get_indexer(entries['habit_id'])
+        np.add.at(counts, (habit_index, df['week'].to_numpy(), df['weekday'].to_numpy()), 1)
         
-        if habit_df.empty:
-            continue
+        panels = [(habit['name'], counts[i]) for i, habit in enumerate(habits_stats) if counts[i].any()]
+        week_labels = [f'{i+1}周前' if i > 0 else '本周' for i in range(n_weeks)]
+        render_heatmap_grid(
+            panels,
+            os.path.join(output_dir, 'habit_heatmap_grid'),
+            per_page=per_page,
+            cbar_label='打卡次数',
+            xticklabels=weekday_names,
+            yticklabels=week_labels[::-1],
+            suptitle='各习惯每周打卡情况',
+            dpi=300,
+            cache=get_chart_cache(),
+            cache_style=CHART_STYLE
+        )
+    else:
+        # 每个习惯单独生成一个热力图
+        for habit_name in habit_names:
+            habit_df = df[df['habit_name'] == habit_name].copy()
             
-        # 数据透视表
-        pivot_df = habit_df.pivot_table(
-            index='week', 
-            columns='weekday',
-            values='completed',
-            aggfunc='sum'
-        ).fillna(0)
-        
-        # 周数可能不连续，确保数据有序
-        all_weeks = range(weeks)
-        for week in all_weeks:
-            if week not in pivot_df.index:
-                pivot_df.loc[week] = 0
-        
-        pivot_df = pivot_df.sort_index()
-        
-        # 调整周几显示
-        pivot_df = pivot_df.reindex(columns=range(7))
-        pivot_df.columns = ['周一', '周二', '周三', '周四', '周五', '周六', '周日']
-        
-        # 生成热力图
-        plt.figure(figsize=(10, 6))
-        sns.heatmap(pivot_df, cmap='YlGnBu', linewidths=.5, 
-                   cbar_kws={'label': '打卡次数'})
-        
-        plt.title(f'{habit_name} 每周打卡情况')
-        plt.xlabel('')
-        plt.ylabel('过去几周')
-        
-        # Y轴标签（倒序显示周数）
-        week_labels = [f'{i+1}周前' if i > 0 else '本周' for i in range(len(pivot_df))]
-        plt.yticks(np.arange(0.5, len(pivot_df), 1), week_labels[::-1])
-        
-        plt.tight_layout()
-        
-        # 保存图表
-        output_dir = create_output_dir()
-        output_file = os.path.join(output_dir, f'habit_heatmap_{habit_name}.png')
-        plt.savefig(output_file, dpi=300, bbox_inches='tight')
-        plt.close()
+            if habit_df.empty:
+                continue
+            
+            # 数据透视表
+            pivot_df = habit_df.pivot_table(
+                index='week', 
+                columns='weekday',
+                values='completed',
+                aggfunc='sum'
+            ).fillna(0)
+            
+            # 周数可能不连续，确保数据有序
+            for week in all_weeks:
+                if week not in pivot_df.index:
+                    pivot_df.loc[week] = 0
+            
+            pivot_df = pivot_df.sort_index()
+            
+            # 调整周几显示
+            pivot_df = pivot_df.reindex(columns=range(7))
+            pivot_df.columns = weekday_names
+            
+            output_file = os.path.join(output_dir, f'habit_heatmap_{habit_name}.png')
+            cache = get_chart_cache()
+            cache_key = cache.make_key('habit_heatmap', pivot_df, style=CHART_STYLE, dpi=300, habit_name=habit_name)
+            if cache.fetch(cache_key, output_file):
+                continue
+            
+            # 生成热力图
+            plt.figure(figsize=(10, 6))
+            sns.heatmap(pivot_df, cmap='YlGnBu', linewidths=.5, 
+                       cbar_kws={'label': '打卡次数'})
+            
+            plt.title(f'{habit_name} 每周打卡情况')
+            plt.xlabel('')
+            plt.ylabel('过去几周')
+            
+            # Y轴标签（倒序显示周数）
+            week_labels = [f'{i+1}周前' if i > 0 else '本周' for i in range(len(pivot_df))]
+            plt.yticks(np.arange(0.5, len(pivot_df), 1), week_labels[::-1])
+            
+            plt.tight_layout()
+            
+            # 保存图表
+            plt.savefig(output_file, dpi=300, bbox_inches='tight')
+            plt.close()
+            cache.store(cache_key, output_file)
     
     # 合并所有习惯的热力图
     habit_counts = df.groupby(['week', 'weekday', 'date']).size().reset_index(name='count')
@@ -259,7 +360,13 @@ def generate_habit_heatmap(stats_service, user_id, weeks=10):
     
     # 调整周几显示
     date_pivot = date_pivot.reindex(columns=range(7))
-    date_pivot.columns = ['周一', '周二', '周三', '周四', '周五', '周六', '周日']
+    date_pivot.columns = weekday_names
+    
+    output_file = os.path.join(output_dir, f'habit_heatmap_all.png')
+    cache = get_chart_cache()
+    cache_key = cache.make_key('habit_heatmap_all', date_pivot, style=CHART_STYLE, dpi=300)
+    if cache.fetch(cache_key, output_file):
+        return output_file
     
     # 生成热力图
     plt.figure(figsize=(12, 7))
@@ -277,25 +384,22 @@ def generate_habit_heatmap(stats_service, user_id, weeks=10):
     plt.tight_layout()
     
     # 保存图表
-    output_dir = create_output_dir()
-    output_file = os.path.join(output_dir, f'habit_heatmap_all.png')
     plt.savefig(output_file, dpi=300, bbox_inches='tight')
     plt.close()
+    cache.store(cache_key, output_file)
     
     return output_file
 
 
-def generate_habit_streak_chart(stats_service, user_id):
+def generate_habit_streak_chart(stats_service, user_id, context=None, output_dir=None):
     """生成习惯连续打卡天数图表"""
-    # 获取用户所有习惯的统计数据
-    habits_stats = stats_service.get_all_user_stats(user_id)
-    
-    if not habits_stats:
-        print(f"没有找到用户 {user_id} 的习惯数据")
-        return None
+    if context is None:
+        context = HabitReportContext.load(stats_service, user_id)
+    if output_dir is None:
+        output_dir = create_output_dir()
     
-    # 创建DataFrame
-    df = pd.DataFrame(habits_stats)
+    # 获取用户所有习惯的统计数据
+    df = context.stats
     
     if df.empty:
         print(f"没有找到用户 {user_id} 的习惯数据")
@@ -316,6 +420,12 @@ def generate_habit_streak_chart(stats_service, user_id):
     current_streaks = plot_df['current_streak']
     longest_streaks = plot_df['longest_streak']
     
+    output_file = os.path.join(output_dir, 'habit_streaks.png')
+    cache = get_chart_cache()
+    cache_key = cache.make_key('habit_streaks', plot_df, style=CHART_STYLE, dpi=300)
+    if cache.fetch(cache_key, output_file):
+        return output_file
+    
     # 创建图表
     plt.figure(figsize=(12, 8))
     
@@ -344,25 +454,22 @@ def generate_habit_streak_chart(stats_service, user_id):
     plt.tight_layout()
     
     # 保存图表
-    output_dir = create_output_dir()
-    output_file = os.path.join(output_dir, 'habit_streaks.png')
     plt.savefig(output_file, dpi=300, bbox_inches='tight')
     plt.close()
+    cache.store(cache_key, output_file)
     
     return output_file
 
 
-def generate_completion_rate_chart(stats_service, user_id):
+def generate_completion_rate_chart(stats_service, user_id, context=None, output_dir=None):
     """生成习惯完成率饼图"""
-    # 获取用户所有习惯的统计数据
-    habits_stats = stats_service.get_all_user_stats(user_id)
-    
-    if not habits_stats:
-        print("没有找到习惯数据")
-        return None
+    if context is None:
+        context = HabitReportContext.load(stats_service, user_id)
+    if output_dir is None:
+        output_dir = create_output_dir()
     
-    # 创建DataFrame
-    df = pd.DataFrame(habits_stats)
+    # 获取用户所有习惯的统计数据
+    df = context.stats
     
     if df.empty:
         print("没有习惯数据")
@@ -381,6 +488,12 @@ def generate_completion_rate_chart(stats_service, user_id):
     # 颜色映射
     colors = ['#e74c3c', '#e67e22', '#f1c40f', '#2ecc71', '#27ae60']
     
+    output_file = os.path.join(output_dir, 'habit_completion_rate.png')
+    cache = get_chart_cache()
+    cache_key = cache.make_key('habit_completion_rate', completion_counts, style=CHART_STYLE, dpi=300)
+    if cache.fetch(cache_key, output_file):
+        return output_file
+    
     # 创建饼图
     plt.figure(figsize=(10, 8))
     patches, texts, autotexts = plt.pie(
@@ -402,71 +515,183 @@ def generate_completion_rate_chart(stats_service, user_id):
     plt.axis('equal')
     
     # 保存图表
-    output_dir = create_output_dir()
-    output_file = os.path.join(output_dir, 'habit_completion_rate.png')
     plt.savefig(output_file, dpi=300, bbox_inches='tight')
     plt.close()
+    cache.store(cache_key, output_file)
     
     return output_file
 
 
+def completion_window(days):
+    """截至今天的days天日期范围"""
+    end_date = datetime.datetime.now().date()
+    return end_date - timedelta(days=days-1), end_date
+
+
+def summarize_completion_matrix(context, days=30):
+    """根据完成矩阵计算整体完成率和每日完成率，用于JSON报告"""
+    start_date, end_date = completion_window(days)
+    matrix = context.completion_matrix(start_date, end_date)
+    values = matrix.to_numpy()
+    if values.size == 0:
+        return {"days": days, "overall_completion_rate": 0, "daily_rates": []}
+    
+    daily_rates = values.mean(axis=1) * 100
+    return {
+        "days": days,
+        "overall_completion_rate": round(float(values.mean() * 100), 2),
+        "daily_rates": [
+            {"date": day.strftime('%Y-%m-%d'), "completion_rate": round(float(rate), 2)}
+            for day, rate in zip(matrix.index, daily_rates)
+        ]
+    }
+
+
+def render_habit_report(context, report, days=30, output_format='json', output_dir=None):
+    """
+    根据已加载的数据上下文渲染图表并保存报告文件，不访问数据库
+
+    批量模式下在子进程中调用，单用户模式和批量模式共用。
+    """
+    user_id = context.user_id
+    if output_dir is None:
+        output_dir = create_output_dir()
+    
+    # 与趋势图共用同一个完成矩阵
+    report = dict(report)
+    report['daily_completion'] = summarize_completion_matrix(context, days)
+    
+    # 生成图表
+    chart_files = []
+    cache = get_chart_cache()
+    hits, misses = cache.hits, cache.misses
+    
+    try:
+        trend_chart = generate_habit_completion_trend(None, user_id, days, context=context, output_dir=output_dir)
+        if trend_chart:
+            chart_files.append(trend_chart)
+        
+        heatmap_chart = generate_habit_heatmap(None, user_id, context=context, output_dir=output_dir)
+        if heatmap_chart:
+            chart_files.append(heatmap_chart)
+            
+        streak_chart = generate_habit_streak_chart(None, user_id, context=context, output_dir=output_dir)
+        if streak_chart:
+            chart_files.append(streak_chart)
+            
+        rate_chart = generate_completion_rate_chart(None, user_id, context=context, output_dir=output_dir)
+        if rate_chart:
+            chart_files.append(rate_chart)
+    except Exception as e:
+        print(f"生成图表时出错: {str(e)}")
+    
+    # 保存报告数据
+    if output_format == 'json' or output_format == 'all':
+        report_file = os.path.join(output_dir, 'habit_report.json')
+        with open(report_file, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+    
+    # 生成CSV报告
+    if output_format == 'csv' or output_format == 'all':
+        # 获取详细数据
+        df = context.stats
+        if not df.empty:
+            csv_file = os.path.join(output_dir, 'habit_stats.csv')
+            df.to_csv(csv_file, index=False, encoding='utf-8')
+    
+    return {
+        'report': report,
+        'charts': chart_files,
+        'chart_cache': {'hits': cache.hits - hits, 'misses': cache.misses - misses}
+    }
+
+
 def generate_habit_report(user_id, days=30, output_format='json'):
     """生成习惯统计报告"""
-    output_dir = create_output_dir()
-    
     with HabitStatsService() as service:
-        # 更新所有习惯统计数据
-        service.update_all_user_stats(user_id)
+        # 只重新计算打卡记录有变化的习惯统计数据
+        service.update_stale_user_stats(user_id)
         
         # 生成报告数据
         report = service.generate_stats_report(user_id)
         
-        # 生成图表
-        chart_files = []
-        
-        try:
-            trend_chart = generate_habit_completion_trend(service, user_id, days)
-            if trend_chart:
-                chart_files.append(trend_chart)
-            
-            heatmap_chart = generate_habit_heatmap(service, user_id)
-            if heatmap_chart:
-                chart_files.append(heatmap_chart)
-                
-            streak_chart = generate_habit_streak_chart(service, user_id)
-            if streak_chart:
-                chart_files.append(streak_chart)
-                
-            rate_chart = generate_completion_rate_chart(service, user_id)
-            if rate_chart:
-                chart_files.append(rate_chart)
-        except Exception as e:
-            print(f"生成图表时出错: {str(e)}")
-        
-        # 保存报告数据
-        if output_format == 'json' or output_format == 'all':
-            report_file = os.path.join(output_dir, 'habit_report.json')
-            with open(report_file, 'w', encoding='utf-8') as f:
-                json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+        # 统计数据和打卡记录只加载一次，所有图表共用
+        context = HabitReportContext.load(service, user_id)
+    
+    result = render_habit_report(context, report, days, output_format)
+    get_chart_cache().log_stats()
+    return result
+
+
+def generate_all_user_reports(days=30, output_format='all', workers=None, update=True):
+    """
+    批量为所有用户生成习惯统计报告
+    
+    在同一个进程中用两次查询加载所有用户的统计数据和打卡记录，
+    按用户拆分为数据上下文后交给进程池渲染，结果写入 output/<user_id> 目录。
+    
+    参数:
+        workers: 渲染进程数，默认为CPU核数，为1时在当前进程中依次渲染
+        update: 是否先重新计算所有用户过期的统计数据
+    
+    返回:
+        {user_id: {'report': ..., 'charts': [...]}}，渲染失败的用户不包含在内
+    """
+    with HabitStatsService() as service:
+        if update:
+            service.update_stale_user_stats()
         
-        # 生成CSV报告
-        if output_format == 'csv' or output_format == 'all':
-            # 获取详细数据
-            habits_stats = service.get_all_user_stats(user_id)
-            if habits_stats:
-                csv_file = os.path.join(output_dir, 'habit_stats.csv')
-                df = pd.DataFrame(habits_stats)
-                df.to_csv(csv_file, index=False, encoding='utf-8')
+        stats_by_user = defaultdict(list)
+        for row in service.get_all_users_stats():
+            stats_by_user[row['user_id']].append(row)
         
-        return {
-            'report': report,
-            'charts': chart_files
-        }
+        entries_by_user = defaultdict(list)
+        for entry in service.get_all_users_entries():
+            entries_by_user[entry['user_id']].append(entry)
+    
+    jobs = []
+    for user_id, habits_stats in stats_by_user.items():
+        context = HabitReportContext(user_id, habits_stats, entries_by_user.get(user_id, []))
+        report = HabitStatsService.build_stats_report(context.habits_stats)
+        jobs.append((context, report, days, output_format, create_output_dir(user_id)))
+    
+    print(f"开始为 {len(jobs)} 个用户生成习惯报告")
+    results = {}
+    
+    if workers == 1:
+        for job in jobs:
+            results[job[0].user_id] = render_habit_report(*job)
+        _print_cache_summary(results)
+        return results
+    
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(render_habit_report, *job): job[0].user_id for job in jobs}
+        for future in as_completed(futures):
+            user_id = futures[future]
+            try:
+                results[user_id] = future.result()
+            except Exception as e:
+                print(f"生成用户 {user_id} 的习惯报告时出错: {str(e)}")
+    
+    _print_cache_summary(results)
+    return results
+
+
+def _print_cache_summary(results):
+    """汇总批量模式下各进程的图表缓存命中情况"""
+    hits = sum(result['chart_cache']['hits'] for result in results.values())
+    misses = sum(result['chart_cache']['misses'] for result in results.values())
+    if hits + misses:
+        print(f"图表缓存: 命中 {hits} 次, 未命中 {misses} 次, 命中率 {hits / (hits + misses):.1%}")
 
 
 def main():
     parser = argparse.ArgumentParser(description='习惯打卡统计报告生成工具')
-    parser.add_argument('user_id', help='用户ID')
+    parser.add_argument('user_id', nargs='?', help='用户ID，不指定时读取环境变量 USER_ID')
+    parser.add_argument('--all-users', action='store_true',
+                        help='为所有用户批量生成报告，输出到 output/<user_id> 目录')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='批量模式的渲染进程数 (默认: CPU核数)')
     parser.add_argument('--days', type=int, default=30, help='分析的天数 (默认: 30)')
     parser.add_argument('--format', choices=['json', 'csv', 'all'], default='all', 
                         help='输出格式 (默认: all)')
@@ -475,7 +700,17 @@ def main():
     
     args = parser.parse_args()
     
-    user_id = os.environ.get('USER_ID')
+    if args.all_users:
+        if args.update_only:
+            with HabitStatsService() as service:
+                updated = service.update_all_user_stats()
+            print(f"已更新 {updated} 个习惯的统计数据")
+        else:
+            results = generate_all_user_reports(args.days, args.format, args.workers)
+            print(f"已为 {len(results)} 个用户生成报告")
+        return 0
+    
+    user_id = args.user_id or os.environ.get('USER_ID')
     if not user_id:
         raise ValueError("未提供 user_id 且环境变量 USER_ID 未设置")
     
@@ -10,28 +10,116 @@
 
 import os
 import datetime
+import threading
+import time
+from collections import OrderedDict
 from datetime import timedelta
 from typing import Dict, List, Optional, Any, Tuple
 import logging
-from psycopg2.extras import RealDictCursor
+import psycopg2
+from psycopg2.extras import Json, RealDictCursor
+import numpy as np
 import pandas as pd
+from config import config
 from db import db
+from habit_bitmap import HabitBitmap
+from habit_calendar import (
+    checkin_days_key, completion_rates, expected_checkin_counts,
+    expected_checkin_mask, scheduled_daily_habit_counts
+)
 
 logger = logging.getLogger(__name__)
+
+# 支持的统计时间范围
+TIME_RANGES = ('week', 'month', 'quarter', 'year')
+
+
+class StatsCache:
+    """进程内的统计数据缓存，按LRU淘汰，条目超过ttl秒后失效"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple) -> Tuple[bool, Any]:
+        """读取缓存，返回(是否命中, 值)"""
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and time.monotonic() - item[0] <= self.ttl:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return True, item[1]
+            if item is not None:
+                del self._items[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key: Tuple, value: Any) -> None:
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        with self._lock:
+            self._items[key] = (time.monotonic(), value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def invalidate(self, user_id: str, habit_id: Optional[int] = None) -> None:
+        """使用户级缓存失效；指定habit_id时同时清除该习惯的缓存，否则清除该用户的全部缓存"""
+        with self._lock:
+            for key in list(self._items):
+                if key[1] != user_id:
+                    continue
+                if key[0] == 'user' or habit_id is None or key[2] == habit_id:
+                    del self._items[key]
+
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._lock:
+            self._items.clear()
+
+    def info(self) -> Dict[str, Any]:
+        """命中统计信息"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0,
+            "size": len(self._items),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl
+        }
+
+
 class HabitStatsService:
     """习惯打卡数据统计服务"""
 
-    def __init__(self):
-        """初始化数据库连接"""
+    def __init__(self, cache_size: int = 1024, cache_ttl: float = 300):
+        """
+        初始化数据库连接
+        
+        参数:
+            cache_size: 统计数据缓存的最大条目数，为0时不缓存
+            cache_ttl: 缓存条目的有效期（秒）
+        """
         # 使用全局数据库实例
         self.db = db
+        # get_habit_stats / get_all_user_stats 的读穿缓存，保存统计数据时失效
+        self.cache = StatsCache(cache_size, cache_ttl) if cache_size > 0 else None
+        # 建表和加列只需在每个服务实例中执行一次，避免每次读写都执行DDL并获取表锁
+        self._schema_ready = False
+        self._global_schema_ready = False
         
     def _get_connection(self):
         """获取数据库连接"""
         return self.db.get_connection()
 
     def _ensure_stats_table(self):
-        """确保habit_stats表存在，不存在则创建"""
+        """确保habit_stats表存在，不存在则创建；每个服务实例只执行一次"""
+        if self._schema_ready:
+            return
         with self._get_connection() as conn:
             with conn.cursor() as cursor:
                 cursor.execute("""
@@ -49,10 +137,23 @@ class HabitStatsService:
                     UNIQUE(habit_id, user_id)
                 )
                 """)
+                # 后来增加的列在一条语句中补齐：
+                # 打卡位图（自bitmap_start起每天一位），以及计算统计数据时的打卡记录条数（用于判断统计数据是否过期）
+                cursor.execute("""
+                ALTER TABLE habit_stats
+                    ADD COLUMN IF NOT EXISTS bitmap_start DATE,
+                    ADD COLUMN IF NOT EXISTS bitmap_length INTEGER,
+                    ADD COLUMN IF NOT EXISTS checkin_bitmap BYTEA,
+                    ADD COLUMN IF NOT EXISTS failed_bitmap BYTEA,
+                    ADD COLUMN IF NOT EXISTS entry_count INTEGER
+                """)
                 conn.commit()
+        self._schema_ready = True
 
     def _ensure_global_stats_table(self):
-        """确保global_habit_stats表存在，不存在则创建"""
+        """确保global_habit_stats表存在，不存在则创建；每个服务实例只执行一次"""
+        if self._global_schema_ready:
+            return
         with self._get_connection() as conn:
             with conn.cursor() as cursor:
                 cursor.execute("""
@@ -74,6 +175,7 @@ class HabitStatsService:
                 )
                 """)
                 conn.commit()
+        self._global_schema_ready = True
 
     def get_entries_by_habit_id(self, habit_id: int, user_id: str) -> List[Dict]:
         """获取习惯的所有打卡记录"""
@@ -89,91 +191,83 @@ class HabitStatsService:
                 )
                 return cursor.fetchall()
 
-    def calculate_check_in_stats(self, habit_id: int, user_id: str, time_range: str = 'week') -> Dict[str, Any]:
+    def get_entries_by_user_id(self, user_id: str, since: Optional[datetime.date] = None) -> List[Dict]:
         """
-        计算打卡统计数据
-        
-        参数:
-            habit_id: 习惯ID
-            user_id: 用户ID
-            time_range: 时间范围，可选值：'week', 'month', 'quarter', 'year'
-            
-        返回:
-            包含统计数据的字典
+        一次查询获取用户所有习惯的打卡记录（只包含报告需要的列）
+
+        entry_date为按配置时区计算的打卡日期，since指定时只返回该日期及之后的记录。
         """
-        # 获取所有打卡记录
-        entries = self.get_entries_by_habit_id(habit_id, user_id)
-        
-        # 按日期分组（去重）
-        check_ins_by_date = {}
-        failed_count = 0
+        with self._get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(
+                    """
+                    SELECT habit_id, completed_at, status,
+                           (completed_at AT TIME ZONE %(tz)s)::date AS entry_date
+                    FROM habit_entries
+                    WHERE user_id = %(user_id)s
+                    AND (%(since)s::date IS NULL OR (completed_at AT TIME ZONE %(tz)s)::date >= %(since)s::date)
+                    ORDER BY habit_id, completed_at
+                    """,
+                    {"tz": config.timezone, "user_id": user_id, "since": since}
+                )
+                return cursor.fetchall()
+
+    def get_habit_bitmap(self, habit_id: int, user_id: str) -> HabitBitmap:
+        """获取习惯的打卡位图，优先读取habit_stats中存储的位图并用新增的打卡记录扩展，没有则根据打卡记录构建"""
+        return self.load_check_in_bitmap(habit_id, user_id)[0]
+
+    def load_bitmap_from_db(self, habit_id: int, user_id: str) -> Optional[HabitBitmap]:
+        """从habit_stats读取已存储的打卡位图，不存在时返回None"""
+        self._ensure_stats_table()
         
-        for entry in entries:
-            if entry.get('status') == 'failed':
-                failed_count += 1
-                continue
-            
-            # 格式化日期为yyyy-MM-dd格式
-            completed_at = entry['completed_at']
-            if isinstance(completed_at, str):
-                completed_at = datetime.datetime.fromisoformat(completed_at.replace('Z', '+00:00'))
-            
-            date_str = completed_at.strftime('%Y-%m-%d')
-            
-            if date_str not in check_ins_by_date:
-                check_ins_by_date[date_str] = []
-            
-            check_ins_by_date[date_str].append(entry)
-        
-        # 按日期排序（降序）
-        unique_dates = sorted(check_ins_by_date.keys(), 
-                             key=lambda x: datetime.datetime.strptime(x, '%Y-%m-%d'), 
-                             reverse=True)
-        
-        # 总打卡次数
-        total_check_ins = len(unique_dates)
-        
-        # 计算当前连续打卡天数
-        current_streak = 0
-        # 从昨天开始统计，避免当天还没打卡时影响连续打卡记录
-        current_date = datetime.datetime.now().date() - timedelta(days=1)
-        
-        while True:
-            date_str = current_date.strftime('%Y-%m-%d')
-            if date_str in check_ins_by_date:
-                current_streak += 1
-                current_date -= timedelta(days=1)
-            else:
-                break
+        with self._get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(
+                    """
+                    SELECT bitmap_start, bitmap_length, checkin_bitmap, failed_bitmap
+                    FROM habit_stats
+                    WHERE habit_id = %s AND user_id = %s
+                    """,
+                    (habit_id, user_id)
+                )
+                row = cursor.fetchone()
         
-        # 计算最长连续打卡天数
-        longest_streak = 0
-        current_streak_count = 0
-        previous_date = None
-        
-        # 按日期升序排列计算连续天数
-        for date_str in sorted(unique_dates, 
-                             key=lambda x: datetime.datetime.strptime(x, '%Y-%m-%d')):
-            current_date = datetime.datetime.strptime(date_str, '%Y-%m-%d').date()
-            
-            if previous_date is None:
-                current_streak_count = 1
-            else:
-                diff_days = (current_date - previous_date).days
-                
-                if diff_days == 1:
-                    current_streak_count += 1
-                else:
-                    current_streak_count = 1
-            
-            if current_streak_count > longest_streak:
-                longest_streak = current_streak_count
-            
-            previous_date = current_date
+        if not row or row['bitmap_start'] is None:
+            return None
+        return HabitBitmap.from_bytes(
+            row['bitmap_start'],
+            row['bitmap_length'] or 0,
+            row['checkin_bitmap'],
+            row['failed_bitmap']
+        )
+
+    def save_bitmap_to_db(self, habit_id: int, user_id: str, bitmap: HabitBitmap) -> None:
+        """将打卡位图以bytea形式保存到habit_stats（需先保存统计数据）"""
+        self._ensure_stats_table()
+        data = bitmap.to_bytes()
         
-        # 计算完成率（根据指定的时间范围）
-        now = datetime.datetime.now()
-        period_start = datetime.datetime.now()
+        with self._get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                UPDATE habit_stats
+                SET bitmap_start = %s,
+                    bitmap_length = %s,
+                    checkin_bitmap = %s,
+                    failed_bitmap = %s
+                WHERE habit_id = %s AND user_id = %s
+                """, (
+                    data["bitmap_start"],
+                    data["bitmap_length"],
+                    psycopg2.Binary(data["checkin_bitmap"]),
+                    psycopg2.Binary(data["failed_bitmap"]),
+                    habit_id,
+                    user_id
+                ))
+                conn.commit()
+
+    def _get_completion_period(self, time_range: str, now: datetime.datetime) -> Tuple[datetime.datetime, int]:
+        """计算完成率统计周期的开始时间和天数，未知的time_range默认使用最近30天"""
+        period_start = now
         
         # 根据time_range设置时间范围
         if time_range == 'week':
@@ -201,6 +295,96 @@ class HabitStatsService:
         
         # 将时间设置为每天的开始（0:00:00）
         period_start = period_start.replace(hour=0, minute=0, second=0, microsecond=0)
+        return period_start, days_in_period
+
+    def get_entry_totals(self, habit_id: int, user_id: str,
+                         since: Optional[datetime.date] = None) -> Dict[str, int]:
+        """
+        一次聚合查询获取习惯的打卡记录条数和失败条数，
+        以及since之前的打卡天数和失败天数（用于校验已存储的位图是否仍与打卡记录一致）
+        """
+        with self._get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(
+                    """
+                    SELECT COUNT(*) AS entry_count,
+                           COUNT(*) FILTER (WHERE status = 'failed') AS failed_count,
+                           COUNT(DISTINCT entry_date) FILTER (
+                               WHERE entry_date < %(since)s::date AND status IS DISTINCT FROM 'failed'
+                           ) AS prior_checkin_days,
+                           COUNT(DISTINCT entry_date) FILTER (
+                               WHERE entry_date < %(since)s::date AND status = 'failed'
+                           ) AS prior_failed_days
+                    FROM (
+                        SELECT status, (completed_at AT TIME ZONE %(tz)s)::date AS entry_date
+                        FROM habit_entries
+                        WHERE habit_id = %(habit_id)s AND user_id = %(user_id)s
+                    ) e
+                    """,
+                    {"tz": config.timezone, "habit_id": habit_id, "user_id": user_id, "since": since}
+                )
+                return {key: int(value or 0) for key, value in cursor.fetchone().items()}
+
+    def load_check_in_bitmap(self, habit_id: int, user_id: str) -> Tuple[HabitBitmap, Dict[str, int]]:
+        """
+        获取习惯最新的打卡位图和打卡记录条数
+
+        优先读取habit_stats中存储的位图，只查询位图最后一天及之后的按天聚合记录来扩展位图；
+        没有存储的位图，或更早的打卡记录发生了变化（补录、删除或修改状态）时，按全部记录重新构建。
+        """
+        stored = self.load_bitmap_from_db(habit_id, user_id)
+        since = stored.end_date() if stored is not None and stored.length else None
+        totals = self.get_entry_totals(habit_id, user_id, since)
+        
+        if since is not None:
+            before = since - timedelta(days=1)
+            if (stored.count_in_range(end=before) != totals['prior_checkin_days']
+                    or stored.count_in_range(end=before, failed=True) != totals['prior_failed_days']):
+                logger.info(f"习惯 {habit_id} 的历史打卡记录已变化，重新构建打卡位图")
+                since = None
+        
+        rows = self.get_daily_check_in_counts(user_id, [habit_id], since)
+        checkin_dates = [row['entry_date'] for row in rows if row['completed_count'] > 0]
+        failed_dates = [row['entry_date'] for row in rows if row['failed_count'] > 0]
+        if since is None:
+            bitmap = HabitBitmap.from_dates(checkin_dates, failed_dates)
+        else:
+            bitmap = stored.extend(since, checkin_dates, failed_dates)
+        return bitmap, totals
+
+    def calculate_check_in_stats(self, habit_id: int, user_id: str, time_range: str = 'week',
+                                 include_bitmap: bool = True) -> Dict[str, Any]:
+        """
+        计算打卡统计数据
+        
+        参数:
+            habit_id: 习惯ID
+            user_id: 用户ID
+            time_range: 时间范围，可选值：'week', 'month', 'quarter', 'year'
+            include_bitmap: 是否在结果中附带打卡位图（键为bitmap），保存时会一并写入habit_stats，
+                下次计算时只需读取新增的打卡记录
+            
+        返回:
+            包含统计数据的字典
+        """
+        # 读取已存储的打卡位图并用新增的打卡记录扩展
+        bitmap, totals = self.load_check_in_bitmap(habit_id, user_id)
+        
+        # 失败次数按记录条数统计
+        failed_count = totals['failed_count']
+        
+        # 总打卡次数（按天去重）
+        total_check_ins = bitmap.total_check_ins()
+        
+        # 计算当前连续打卡天数（从昨天开始统计，避免当天还没打卡时影响连续打卡记录）
+        current_streak = bitmap.current_streak()
+        
+        # 计算最长连续打卡天数
+        longest_streak = bitmap.longest_streak()
+        
+        # 计算完成率（根据指定的时间范围）
+        now = datetime.datetime.now()
+        period_start, days_in_period = self._get_completion_period(time_range, now)
         
         # 获取习惯详细信息，用于更精确地计算完成率
         with self._get_connection() as conn:
@@ -215,69 +399,219 @@ class HabitStatsService:
                 )
                 habit = cursor.fetchone()
         
-        # 根据习惯频率和检查日期计算应该打卡的天数
-        expected_check_ins = 0
-        days_since_start = (now - period_start).days + 1
-        
+        # 根据习惯频率和检查日期计算应该打卡的天数（按打卡规则缓存的日历掩码）
         if habit:
-            if habit.get('frequency') == 'daily':
-                # 过滤出符合打卡日的天数
-                for i in range(days_since_start):
-                    day = period_start + timedelta(days=i)
-                    weekday = day.weekday() + 1  # Python的weekday()返回0-6，转换为1-7
-                    if weekday == 7:  # 如果是周日(6)，转换为7
-                        weekday = 7
-                    
-                    checkin_days = habit.get('checkin_days', [1, 2, 3, 4, 5, 6, 7])
-                    if isinstance(checkin_days, list) and weekday in checkin_days:
-                        expected_check_ins += 1
-            elif habit.get('frequency') == 'weekly':
-                expected_check_ins = (days_since_start + 6) // 7  # 向上取整
-            elif habit.get('frequency') == 'monthly':
-                # 简单处理，如果跨月则+1
-                if period_start.month != now.month:
-                    expected_check_ins = 2
-                else:
-                    expected_check_ins = 1
+            expected_check_ins, _ = expected_checkin_mask(
+                period_start.date(), now.date(), habit.get('frequency'), checkin_days_key(habit)
+            )
         else:
             # 如果找不到习惯信息，按照每天都需要打卡计算
             expected_check_ins = days_in_period
         
         # 计算指定时间范围内的实际打卡次数
-        check_ins_in_period = 0
-        for date_str in unique_dates:
-            date = datetime.datetime.strptime(date_str, '%Y-%m-%d').date()
-            if date >= period_start.date():
-                check_ins_in_period += 1
+        check_ins_in_period = bitmap.count_in_range(period_start.date())
         
         # 计算完成率
         completion_rate = (check_ins_in_period / expected_check_ins) * 100 if expected_check_ins > 0 else 0
         
         # 最后打卡日期
-        last_check_in_date = None
-        if unique_dates:
-            last_check_in_date = datetime.datetime.strptime(unique_dates[0], '%Y-%m-%d').date()
+        last_check_in_date = bitmap.last_check_in_date()
         
-        return {
+        stats = {
             "total_check_ins": total_check_ins,
             "current_streak": current_streak,
             "longest_streak": longest_streak,
             "completion_rate": completion_rate,
             "last_check_in_date": last_check_in_date,
-            "failed_count": failed_count
+            "failed_count": failed_count,
+            "entry_count": totals['entry_count']
         }
+        if include_bitmap:
+            stats["bitmap"] = bitmap
+        return stats
+    
+    def get_daily_check_in_counts(self, user_id: str, habit_ids: Optional[List[int]] = None,
+                                  since: Optional[datetime.date] = None) -> List[Dict[str, Any]]:
+        """
+        在数据库中按习惯和日期聚合打卡记录
+        
+        每个习惯每天只返回一行（habit_id, entry_date, completed_count, failed_count），
+        日期按配置的时区计算，不再传输完整的打卡记录。since指定时只返回该日期及之后的数据。
+        """
+        with self._get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(
+                    """
+                    SELECT habit_id,
+                           (completed_at AT TIME ZONE %(tz)s)::date AS entry_date,
+                           COUNT(*) FILTER (WHERE status IS DISTINCT FROM 'failed') AS completed_count,
+                           COUNT(*) FILTER (WHERE status = 'failed') AS failed_count
+                    FROM habit_entries
+                    WHERE user_id = %(user_id)s
+                    AND (%(habit_ids)s::int[] IS NULL OR habit_id = ANY(%(habit_ids)s::int[]))
+                    AND (%(since)s::date IS NULL OR (completed_at AT TIME ZONE %(tz)s)::date >= %(since)s::date)
+                    GROUP BY habit_id, entry_date
+                    ORDER BY habit_id, entry_date
+                    """,
+                    {"tz": config.timezone, "user_id": user_id, "habit_ids": habit_ids, "since": since}
+                )
+                return cursor.fetchall()
+
+    def get_streak_summary_sql(self, user_id: str, period_start: datetime.date,
+                               as_of: Optional[datetime.date] = None) -> List[Dict[str, Any]]:
+        """
+        使用窗口函数（gaps-and-islands）在数据库中计算每个习惯的连续打卡统计
+        
+        每个习惯只返回一行：总打卡天数、最长/当前连续天数、最后打卡日期、
+        失败次数以及period_start之后的打卡天数。当前连续天数截至as_of（默认昨天）。
+        """
+        if as_of is None:
+            as_of = datetime.date.today() - timedelta(days=1)
+        
+        with self._get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(
+                    """
+                    WITH entry_days AS (
+                        SELECT habit_id,
+                               (completed_at AT TIME ZONE %(tz)s)::date AS entry_date,
+                               BOOL_OR(status IS DISTINCT FROM 'failed') AS checked_in,
+                               COUNT(*) FILTER (WHERE status = 'failed') AS failed_count
+                        FROM habit_entries
+                        WHERE user_id = %(user_id)s
+                        GROUP BY habit_id, entry_date
+                    ),
+                    islands AS (
+                        -- 连续日期减去行号后相同，即属于同一段连续打卡
+                        SELECT habit_id, entry_date,
+                               entry_date - (ROW_NUMBER() OVER (PARTITION BY habit_id ORDER BY entry_date))::int AS island
+                        FROM entry_days
+                        WHERE checked_in
+                    ),
+                    runs AS (
+                        SELECT habit_id, MIN(entry_date) AS run_start, MAX(entry_date) AS run_end,
+                               COUNT(*) AS run_length
+                        FROM islands
+                        GROUP BY habit_id, island
+                    ),
+                    streaks AS (
+                        SELECT habit_id,
+                               SUM(run_length) AS total_check_ins,
+                               MAX(run_length) AS longest_streak,
+                               MAX(%(as_of)s::date - run_start + 1)
+                                   FILTER (WHERE run_start <= %(as_of)s::date AND run_end >= %(as_of)s::date) AS current_streak,
+                               MAX(run_end) AS last_check_in_date
+                        FROM runs
+                        GROUP BY habit_id
+                    )
+                    SELECT d.habit_id,
+                           COALESCE(s.total_check_ins, 0) AS total_check_ins,
+                           COALESCE(s.longest_streak, 0) AS longest_streak,
+                           COALESCE(s.current_streak, 0) AS current_streak,
+                           s.last_check_in_date,
+                           SUM(d.failed_count) AS failed_count,
+                           COUNT(*) FILTER (WHERE d.checked_in AND d.entry_date >= %(period_start)s::date) AS check_ins_in_period
+                    FROM entry_days d
+                    LEFT JOIN streaks s ON s.habit_id = d.habit_id
+                    GROUP BY d.habit_id, s.total_check_ins, s.longest_streak, s.current_streak, s.last_check_in_date
+                    """,
+                    {"tz": config.timezone, "user_id": user_id, "as_of": as_of, "period_start": period_start}
+                )
+                return cursor.fetchall()
+
+    def calculate_user_check_in_stats_sql(self, user_id: str, time_range: str = 'week',
+                                          use_window_streaks: bool = False,
+                                          include_bitmap: bool = False) -> Dict[int, Dict[str, Any]]:
+        """
+        基于数据库聚合计算用户所有习惯的打卡统计，结果与calculate_check_in_stats一致
+        
+        参数:
+            user_id: 用户ID
+            time_range: 完成率的时间范围，可选值：'week', 'month', 'quarter', 'year'
+            use_window_streaks: 是否连续天数也在数据库中用窗口函数计算（每个习惯只返回一行）
+            include_bitmap: 是否附带打卡位图（仅按天聚合模式下可用）
+            
+        返回:
+            以习惯ID为键的统计数据字典
+        """
+        now = datetime.datetime.now()
+        period_start, days_in_period = self._get_completion_period(time_range, now)
+        
+        with self._get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(
+                    """
+                    SELECT id, frequency, checkin_days FROM habits
+                    WHERE user_id = %s
+                    """,
+                    (user_id,)
+                )
+                habits = cursor.fetchall()
+        
+        if use_window_streaks:
+            summary = {row['habit_id']: row for row in self.get_streak_summary_sql(user_id, period_start.date())}
+        else:
+            # 按天聚合后在本地构建位图计算连续天数
+            daily_rows = {}
+            for row in self.get_daily_check_in_counts(user_id):
+                daily_rows.setdefault(row['habit_id'], []).append(row)
+            
+            summary = {}
+            for habit_id, rows in daily_rows.items():
+                bitmap = HabitBitmap.from_dates(
+                    [row['entry_date'] for row in rows if row['completed_count'] > 0],
+                    [row['entry_date'] for row in rows if row['failed_count'] > 0]
+                )
+                summary[habit_id] = {
+                    "total_check_ins": bitmap.total_check_ins(),
+                    "current_streak": bitmap.current_streak(),
+                    "longest_streak": bitmap.longest_streak(),
+                    "last_check_in_date": bitmap.last_check_in_date(),
+                    "failed_count": sum(row['failed_count'] for row in rows),
+                    "check_ins_in_period": bitmap.count_in_range(period_start.date()),
+                    "entry_count": sum(row['completed_count'] + row['failed_count'] for row in rows),
+                    "bitmap": bitmap
+                }
+        
+        results = {}
+        for habit in habits:
+            row = summary.get(habit['id'], {})
+            expected_check_ins, _ = expected_checkin_mask(
+                period_start.date(), now.date(), habit.get('frequency'), checkin_days_key(habit)
+            )
+            check_ins_in_period = int(row.get('check_ins_in_period', 0))
+            
+            stats = {
+                "total_check_ins": int(row.get('total_check_ins', 0)),
+                "current_streak": int(row.get('current_streak', 0)),
+                "longest_streak": int(row.get('longest_streak', 0)),
+                "completion_rate": (check_ins_in_period / expected_check_ins) * 100 if expected_check_ins > 0 else 0,
+                "last_check_in_date": row.get('last_check_in_date'),
+                "failed_count": int(row.get('failed_count', 0))
+            }
+            if not use_window_streaks:
+                stats["entry_count"] = int(row.get('entry_count', 0))
+            if include_bitmap and row.get('bitmap') is not None:
+                stats["bitmap"] = row['bitmap']
+            results[habit['id']] = stats
+        
+        return results
     
     def save_stats_to_db(self, habit_id: int, user_id: str, stats: Dict[str, Any]) -> None:
         """保存统计数据到数据库"""
         self._ensure_stats_table()
+        if self.cache:
+            self.cache.invalidate(user_id, habit_id)
         
         with self._get_connection() as conn:
             with conn.cursor() as cursor:
                 cursor.execute("""
                 INSERT INTO habit_stats 
                     (habit_id, user_id, total_check_ins, current_streak, longest_streak, 
-                     completion_rate, last_check_in_date, failed_count, updated_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+                     completion_rate, last_check_in_date, failed_count, entry_count, updated_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s,
+                        COALESCE(%s, (SELECT COUNT(*) FROM habit_entries WHERE habit_id = %s AND user_id = %s)),
+                        CURRENT_TIMESTAMP)
                 ON CONFLICT (habit_id, user_id) 
                 DO UPDATE SET 
                     total_check_ins = EXCLUDED.total_check_ins,
@@ -286,6 +620,7 @@ class HabitStatsService:
                     completion_rate = EXCLUDED.completion_rate,
                     last_check_in_date = EXCLUDED.last_check_in_date,
                     failed_count = EXCLUDED.failed_count,
+                    entry_count = EXCLUDED.entry_count,
                     updated_at = CURRENT_TIMESTAMP
                 """, (
                     habit_id,
@@ -295,30 +630,104 @@ class HabitStatsService:
                     stats["longest_streak"],
                     stats["completion_rate"],
                     stats["last_check_in_date"],
-                    stats["failed_count"]
+                    stats["failed_count"],
+                    stats.get("entry_count"),
+                    habit_id,
+                    user_id
                 ))
                 conn.commit()
+        
+        if stats.get("bitmap") is not None:
+            self.save_bitmap_to_db(habit_id, user_id, stats["bitmap"])
+    
+    def get_stale_habits(self, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        找出统计数据需要重新计算的习惯，返回 [{user_id, habit_id}]
+        
+        满足以下任一条件即视为过期：
+        - 还没有统计数据，或统计数据缺少entry_count（旧数据）
+        - 有打卡记录的时间晚于统计数据的updated_at
+        - 打卡记录条数与计算时不同（删除记录或补录历史打卡）
+        - 统计数据不是今天（按配置时区）计算的，连续天数和完成率依赖当前日期
+        
+        参数:
+            user_id: 用户ID，为None时检查所有用户
+        """
+        self._ensure_stats_table()
+        
+        with self._get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(
+                    """
+                    SELECT h.user_id, h.id AS habit_id
+                    FROM habits h
+                    LEFT JOIN habit_stats hs ON hs.habit_id = h.id AND hs.user_id = h.user_id
+                    LEFT JOIN (
+                        SELECT habit_id, user_id, COUNT(*) AS entry_count, MAX(completed_at) AS last_entry_at
+                        FROM habit_entries
+                        WHERE (%(user_id)s::text IS NULL OR user_id = %(user_id)s::text)
+                        GROUP BY habit_id, user_id
+                    ) e ON e.habit_id = h.id AND e.user_id = h.user_id
+                    WHERE (%(user_id)s::text IS NULL OR h.user_id = %(user_id)s::text)
+                    AND (
+                        hs.id IS NULL
+                        OR hs.entry_count IS NULL
+                        OR hs.entry_count <> COALESCE(e.entry_count, 0)
+                        OR e.last_entry_at > hs.updated_at
+                        OR (hs.updated_at AT TIME ZONE %(tz)s)::date < (now() AT TIME ZONE %(tz)s)::date
+                    )
+                    ORDER BY h.user_id, h.id
+                    """,
+                    {"user_id": user_id, "tz": config.timezone}
+                )
+                return cursor.fetchall()
     
-    def update_all_user_stats(self, user_id: Optional[str] = None) -> int:
+    def update_stale_user_stats(self, user_id: Optional[str] = None, store_bitmaps: bool = False,
+                                pushdown: bool = False) -> int:
+        """
+        只重新计算过期的习惯统计数据（见get_stale_habits），参数同update_all_user_stats
+        
+        返回:
+            更新的习惯数量
+        """
+        stale_by_user = {}
+        for row in self.get_stale_habits(user_id):
+            stale_by_user.setdefault(row['user_id'], []).append(row['habit_id'])
+        
+        total_updated = 0
+        for current_user_id, habit_ids in stale_by_user.items():
+            pushdown_stats = self.calculate_user_check_in_stats_sql(current_user_id, include_bitmap=store_bitmaps) if pushdown else {}
+            for habit_id in habit_ids:
+                stats = pushdown_stats.get(habit_id) or self.calculate_check_in_stats(habit_id, current_user_id)
+                self.save_stats_to_db(habit_id, current_user_id, stats)
+                total_updated += 1
+        
+        logger.info(f"{len(stale_by_user)} 个用户的 {total_updated} 个习惯统计数据已过期并重新计算")
+        return total_updated
+    
+    def update_all_user_stats(self, user_id: Optional[str] = None, store_bitmaps: bool = False,
+                              pushdown: bool = False) -> int:
         """
         更新用户所有习惯的统计数据
     
         参数:
             user_id: 用户ID，如果为None则处理所有用户
+            store_bitmaps: 按天聚合模式下是否同时把打卡位图写入habit_stats（逐个习惯计算时总是保存位图）
+            pushdown: 是否在数据库中按天聚合打卡记录（每个用户一次查询），而不是逐个习惯拉取全部记录
     
         返回:
             更新的习惯数量
         """
-        print("DEBUG: 开始执行update_all_user_stats函数")  # 调试点1
+        logger.debug("开始执行update_all_user_stats函数")
         try:
             total_updated = 0
         
             # 如果指定了用户ID，则只处理该用户
             if user_id:
-                print(f"DEBUG: 使用指定的user_id={user_id}")  # 调试点2.1
+                logger.debug(f"使用指定的user_id={user_id}")
                 with self._get_connection() as conn:
                     with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                        print("DEBUG: 准备执行SQL查询")  # 调试点4
+                        logger.debug("准备执行SQL查询")
                         cursor.execute(
                             """
                             SELECT id FROM habits
@@ -327,35 +736,36 @@ class HabitStatsService:
                             (user_id,)
                         )
                         habits = cursor.fetchall()
-                        print(f"DEBUG: SQL执行完成，获取到用户 {user_id} 的 {len(habits)} 条记录")  # 调试点5
+                        logger.debug(f"SQL执行完成，获取到用户 {user_id} 的 {len(habits)} 条记录")
                 
                 # 计算每个习惯的统计数据并保存
+                pushdown_stats = self.calculate_user_check_in_stats_sql(user_id, include_bitmap=store_bitmaps) if pushdown else {}
                 for habit in habits:
                     habit_id = habit['id']
-                    stats = self.calculate_check_in_stats(habit_id, user_id)
+                    stats = pushdown_stats.get(habit_id) or self.calculate_check_in_stats(habit_id, user_id)
                     self.save_stats_to_db(habit_id, user_id, stats)
                     total_updated += 1
                 
-                print(f"用户 {user_id} 的习惯数量: {len(habits)}，已更新 {total_updated} 个")
+                logger.info(f"用户 {user_id} 的习惯数量: {len(habits)}，已更新 {total_updated} 个")
                 return total_updated
             else:
                 # 获取所有用户列表
-                print("DEBUG: 未指定用户ID，处理所有用户")  # 调试点2.2
+                logger.debug("未指定用户ID，处理所有用户")
                 with self._get_connection() as conn:
                     with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                        print("DEBUG: 准备查询所有用户")  # 调试点3
+                        logger.debug("准备查询所有用户")
                         cursor.execute(
                             """
                             SELECT DISTINCT user_id FROM habits
                             """
                         )
                         users = cursor.fetchall()
-                        print(f"DEBUG: 总共找到 {len(users)} 个用户")  # 调试点4
+                        logger.debug(f"总共找到 {len(users)} 个用户")
             
                 # 为每个用户更新习惯统计
                 for user in users:
                     current_user_id = user['user_id']
-                    print(f"DEBUG: 处理用户 {current_user_id}")
+                    logger.debug(f"处理用户 {current_user_id}")
                     with self._get_connection() as conn:
                         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
                             cursor.execute(
@@ -366,32 +776,41 @@ class HabitStatsService:
                                 (current_user_id,)
                             )
                             habits = cursor.fetchall()
-                            print(f"DEBUG: 用户 {current_user_id} 有 {len(habits)} 个习惯")
-                
-                # 计算每个习惯的统计数据并保存
-                for habit in habits:
-                    habit_id = habit['id']
-                    stats = self.calculate_check_in_stats(habit_id, current_user_id)
-                    print(f"DEBUG: 用户 {current_user_id} 的习惯 {habit_id} 统计数据: {stats}")
-                    self.save_stats_to_db(habit_id, current_user_id, stats)
-                    total_updated += 1
+                            logger.debug(f"用户 {current_user_id} 有 {len(habits)} 个习惯")
+                    
+                    # 计算每个习惯的统计数据并保存
+                    pushdown_stats = self.calculate_user_check_in_stats_sql(current_user_id, include_bitmap=store_bitmaps) if pushdown else {}
+                    for habit in habits:
+                        habit_id = habit['id']
+                        stats = pushdown_stats.get(habit_id) or self.calculate_check_in_stats(habit_id, current_user_id)
+                        logger.debug(f"用户 {current_user_id} 的习惯 {habit_id} 统计数据: {stats}")
+                        self.save_stats_to_db(habit_id, current_user_id, stats)
+                        total_updated += 1
                 
-            print(f"总共更新了 {total_updated} 个习惯的统计数据，涉及 {len(users)} 个用户")
+            logger.info(f"总共更新了 {total_updated} 个习惯的统计数据，涉及 {len(users)} 个用户")
             return total_updated
             
         except Exception as e:
-            print(f"ERROR: update_all_user_stats 执行出错: {e}")  # 调试点6
+            logger.error(f"update_all_user_stats 执行出错: {e}")
             raise
             
     def get_habit_stats(self, habit_id: int, user_id: str) -> Dict[str, Any]:
         """获取习惯统计数据，如果不存在则计算并保存"""
+        cache_key = ('habit', user_id, habit_id)
+        if self.cache:
+            found, cached = self.cache.get(cache_key)
+            if found:
+                return dict(cached)
+        
         self._ensure_stats_table()
         
         with self._get_connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cursor:
                 cursor.execute(
                     """
-                    SELECT * FROM habit_stats
+                    SELECT id, habit_id, user_id, total_check_ins, current_streak, longest_streak,
+                           completion_rate, last_check_in_date, failed_count, updated_at
+                    FROM habit_stats
                     WHERE habit_id = %s AND user_id = %s
                     """,
                     (habit_id, user_id)
@@ -406,24 +825,38 @@ class HabitStatsService:
                     # 重新获取
                     cursor.execute(
                         """
-                        SELECT * FROM habit_stats
+                        SELECT id, habit_id, user_id, total_check_ins, current_streak, longest_streak,
+                               completion_rate, last_check_in_date, failed_count, updated_at
+                        FROM habit_stats
                         WHERE habit_id = %s AND user_id = %s
                         """,
                         (habit_id, user_id)
                     )
                     result = cursor.fetchone()
-                
-        return dict(result) if result else {}
+        
+        stats = dict(result) if result else {}
+        if self.cache and stats:
+            self.cache.set(cache_key, stats)
+        return dict(stats)
     
     def get_all_user_stats(self, user_id: str) -> List[Dict[str, Any]]:
         """获取用户所有习惯的统计数据"""
+        cache_key = ('user', user_id)
+        if self.cache:
+            found, cached = self.cache.get(cache_key)
+            if found:
+                return [dict(row) for row in cached]
+        
         self._ensure_stats_table()
         
         with self._get_connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cursor:
                 cursor.execute(
                     """
-                    SELECT h.name, h.description, hs.* 
+                    SELECT h.name, h.description,
+                           hs.id, hs.habit_id, hs.user_id, hs.total_check_ins, hs.current_streak,
+                           hs.longest_streak, hs.completion_rate, hs.last_check_in_date,
+                           hs.failed_count, hs.updated_at
                     FROM habit_stats hs
                     JOIN habits h ON hs.habit_id = h.id
                     WHERE hs.user_id = %s
@@ -432,17 +865,60 @@ class HabitStatsService:
                     (user_id,)
                 )
                 results = cursor.fetchall()
-                
-        return [dict(row) for row in results]
+        
+        stats = [dict(row) for row in results]
+        if self.cache:
+            self.cache.set(cache_key, stats)
+        return [dict(row) for row in stats]
+    
+    def get_all_users_stats(self) -> List[Dict[str, Any]]:
+        """一次查询获取所有用户所有习惯的统计数据，用于批量生成报告"""
+        self._ensure_stats_table()
+        
+        with self._get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(
+                    """
+                    SELECT h.name, h.description,
+                           hs.id, hs.habit_id, hs.user_id, hs.total_check_ins, hs.current_streak,
+                           hs.longest_streak, hs.completion_rate, hs.last_check_in_date,
+                           hs.failed_count, hs.updated_at
+                    FROM habit_stats hs
+                    JOIN habits h ON hs.habit_id = h.id
+                    ORDER BY hs.user_id, hs.current_streak DESC, hs.completion_rate DESC
+                    """
+                )
+                return [dict(row) for row in cursor.fetchall()]
+    
+    def get_all_users_entries(self, since: Optional[datetime.date] = None) -> List[Dict]:
+        """一次查询获取所有用户的打卡记录（列与get_entries_by_user_id一致，另含user_id）"""
+        with self._get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(
+                    """
+                    SELECT user_id, habit_id, completed_at, status,
+                           (completed_at AT TIME ZONE %(tz)s)::date AS entry_date
+                    FROM habit_entries
+                    WHERE (%(since)s::date IS NULL OR (completed_at AT TIME ZONE %(tz)s)::date >= %(since)s::date)
+                    ORDER BY user_id, habit_id, completed_at
+                    """,
+                    {"tz": config.timezone, "since": since}
+                )
+                return cursor.fetchall()
     
     def generate_stats_report(self, user_id: str) -> Dict[str, Any]:
         """生成用户习惯统计报告"""
         stats = self.get_all_user_stats(user_id)
         
         if not stats:
-            self.update_all_user_stats(user_id)
-            stats = self.get_all_user_stats(user_id)
+            if self.update_stale_user_stats(user_id):
+                stats = self.get_all_user_stats(user_id)
         
+        return self.build_stats_report(stats)
+    
+    @staticmethod
+    def build_stats_report(stats: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """根据已加载的习惯统计数据生成报告"""
         # 转换为DataFrame以便计算
         df = pd.DataFrame(stats)
         
@@ -470,10 +946,16 @@ class HabitStatsService:
             
         return report
         
+    def cache_info(self) -> Dict[str, Any]:
+        """统计数据缓存的命中信息"""
+        return self.cache.info() if self.cache else {}
+
     def close(self):
         """关闭数据库连接"""
         # 不需要明确关闭连接，因为我们现在使用上下文管理器
-        pass
+        info = self.cache_info()
+        if info and info["hits"] + info["misses"] > 0:
+            logger.info(f"统计数据缓存: 命中 {info['hits']} 次, 未命中 {info['misses']} 次, 命中率 {info['hit_rate']:.1%}")
             
     def __enter__(self):
         return self
@@ -481,26 +963,11 @@ class HabitStatsService:
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.close()
 
-    def get_habit_stats_by_time_range(self, user_id: str, time_range: str = 'week') -> Dict[str, Any]:
-        """
-        按时间范围获取习惯统计数据
-        
-        参数:
-            user_id: 用户ID
-            time_range: 时间范围，可选值：'week', 'month', 'quarter', 'year'
-            
-        返回:
-            统计数据结果
-        """
-        self._ensure_stats_table()
-        self._ensure_global_stats_table()
-        
-        # 计算时间范围的开始和结束日期
-        now = datetime.datetime.now()
-        period_start = datetime.datetime.now()
+    def _get_period(self, time_range: str, now: datetime.datetime) -> Tuple[datetime.datetime, str]:
+        """根据time_range计算统计周期的开始时间和显示标签"""
+        period_start = now
         period_label = ''
         
-        # 根据time_range设置时间范围
         if time_range == 'week':
             # 设置为本周的第一天（星期一）
             days_to_monday = period_start.weekday()
@@ -522,8 +989,11 @@ class HabitStatsService:
         
         # 将时间设置为每天的开始（0:00:00）
         period_start = period_start.replace(hour=0, minute=0, second=0, microsecond=0)
-        
-        # 尝试从全局统计表获取已缓存的数据
+        return period_start, period_label
+
+    def _get_cached_global_stats(self, user_id: str, time_range: str,
+                                 period_start: datetime.datetime) -> Optional[Dict[str, Any]]:
+        """从global_habit_stats读取指定周期的缓存统计"""
         with self._get_connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cursor:
                 cursor.execute(
@@ -536,110 +1006,76 @@ class HabitStatsService:
                     """,
                     (user_id, time_range, period_start)
                 )
-                cached_stats = cursor.fetchone()
-                
-                # 如果有缓存数据且是今天更新的，直接返回
-                if cached_stats and datetime.datetime.fromisoformat(str(cached_stats['updated_at']).replace('Z', '+00:00')).date() == now.date():
-                    return self._format_stats_response(cached_stats, period_label, user_id)
-        
-        # 没有缓存或缓存已过期，重新计算统计数据
-        
-        # 1. 获取用户所有习惯
-        with self._get_connection() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute(
-                    """
-                    SELECT * FROM habits
-                    WHERE user_id = %s
-                    AND status = 'active'
-                    """,
-                    (user_id,)
-                )
-                user_habits = cursor.fetchall()
+                return cursor.fetchone()
+
+    @staticmethod
+    def _is_fresh(cached_stats: Optional[Dict[str, Any]], now: datetime.datetime) -> bool:
+        """缓存数据是否是今天更新的"""
+        if not cached_stats:
+            return False
+        updated_at = datetime.datetime.fromisoformat(str(cached_stats['updated_at']).replace('Z', '+00:00'))
+        return updated_at.date() == now.date()
+
+    @staticmethod
+    def _entry_date(entry: Dict[str, Any]) -> datetime.date:
+        """打卡记录的日期"""
+        return datetime.datetime.fromisoformat(str(entry['completed_at']).replace('Z', '+00:00')).date()
+
+    def _compute_time_range_stats(self, user_id: str, time_range: str, period_start: datetime.datetime,
+                                  period_label: str, now: datetime.datetime,
+                                  user_habits: List[Dict[str, Any]], entries: List[Dict[str, Any]],
+                                  habit_stats_by_id: Dict[int, Dict[str, Any]]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        基于已加载的习惯和打卡记录计算一个时间范围的统计数据
         
-        if not user_habits:
-            return {
-                "overallCompletionRate": 0,
-                "periodLabel": period_label,
-                "bestHabit": None,
-                "worstHabit": None,
-                "habitStats": [],
-                "dailyTrend": []
-            }
+        参数:
+            entries: 打卡记录，需包含_date字段，可以覆盖比period_start更长的范围
+            habit_stats_by_id: 习惯ID到habit_stats记录的映射，用于获取当前连续天数
+            
+        返回:
+            (接口返回结果, 待写入global_habit_stats的数据)
+        """
+        start_date = period_start.date()
+        entries = [e for e in entries if e['_date'] >= start_date]
         
-        # 2. 获取每个习惯在指定时间范围内的打卡记录
-        habit_ids = [habit['id'] for habit in user_habits]
+        entries_by_habit = {}
+        for entry in entries:
+            entries_by_habit.setdefault(entry['habit_id'], []).append(entry)
         
-        with self._get_connection() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute(
-                    """
-                    SELECT id, habit_id, completed_at, status
-                    FROM habit_entries
-                    WHERE habit_id = ANY(%s)
-                    AND user_id = %s
-                    AND completed_at >= %s
-                    """,
-                    (habit_ids, user_id, period_start)
-                )
-                entries = cursor.fetchall()
+        # 1. 计算每个习惯的统计数据
+        # 应打卡次数由按打卡规则缓存的日历掩码得出，完成率为一次数组运算
+        end_date = now.date()
+        expected_counts = expected_checkin_counts(user_habits, start_date, end_date)
+        success_counts = np.array([
+            sum(1 for e in entries_by_habit.get(habit['id'], []) if e.get('status') != 'failed')
+            for habit in user_habits
+        ], dtype=np.int64)
+        failed_counts = np.array([
+            sum(1 for e in entries_by_habit.get(habit['id'], []) if e.get('status') == 'failed')
+            for habit in user_habits
+        ], dtype=np.int64)
+        rates = completion_rates(success_counts, expected_counts)
         
-        # 3. 计算每个习惯的统计数据
         habit_stats = []
-        total_completions = 0
-        total_failed = 0
         best_habit = None
         worst_habit = None
         
-        for habit in user_habits:
+        for index, habit in enumerate(user_habits):
             # 获取习惯的详细统计数据
-            habit_stat = self.get_habit_stats(habit['id'], user_id)
-            
-            # 筛选该习惯在时间范围内的打卡记录
-            habit_entries = [e for e in entries if e['habit_id'] == habit['id']]
-            successful_entries = [e for e in habit_entries if e.get('status') != 'failed']
-            failed_entries = [e for e in habit_entries if e.get('status') == 'failed']
-            
-            # 计算指定时期内的完成率
-            days_since_start = (now - period_start).days + 1
-            
-            # 根据习惯频率和检查日期计算应该打卡的天数
-            expected_check_ins = 0
-            
-            if habit['frequency'] == 'daily':
-                # 过滤出符合打卡日的天数
-                for i in range(days_since_start):
-                    day = period_start + timedelta(days=i)
-                    weekday = day.weekday() + 1  # Python的weekday()返回0-6，转换为1-7
-                    if weekday == 7:  # 如果是周日(6)，转换为7
-                        weekday = 7
-                    
-                    checkin_days = habit.get('checkin_days', [1, 2, 3, 4, 5, 6, 7])
-                    if isinstance(checkin_days, list) and weekday in checkin_days:
-                        expected_check_ins += 1
-            elif habit['frequency'] == 'weekly':
-                expected_check_ins = (days_since_start + 6) // 7  # 向上取整
-            elif habit['frequency'] == 'monthly':
-                # 简单处理，如果跨月则+1
-                if period_start.month != now.month:
-                    expected_check_ins = 2
-                else:
-                    expected_check_ins = 1
-            
-            completion_rate = len(successful_entries) / expected_check_ins if expected_check_ins > 0 else 0
+            habit_stat = habit_stats_by_id.get(habit['id'], {})
+            expected_check_ins = int(expected_counts[index])
+            completions = int(success_counts[index])
             
             stat = {
                 "id": str(habit['id']),
                 "name": habit['name'],
-                "completionRate": completion_rate,
+                "completionRate": float(rates[index]),
                 "streak": habit_stat.get('current_streak', 0),
-                "totalCompletions": len(successful_entries),
-                "missedDays": expected_check_ins - len(successful_entries) if expected_check_ins > len(successful_entries) else 0
+                "totalCompletions": completions,
+                "missedDays": expected_check_ins - completions if expected_check_ins > completions else 0
             }
             
             habit_stats.append(stat)
-            total_completions += len(successful_entries)
-            total_failed += len(failed_entries)
             
             # 更新最佳和最差习惯
             if best_habit is None or stat["completionRate"] > best_habit["completionRate"]:
@@ -649,45 +1085,38 @@ class HabitStatsService:
                 (stat["completionRate"] < worst_habit["completionRate"] and expected_check_ins > 0)):
                 worst_habit = stat
         
-        # 4. 计算每日趋势数据
+        total_completions = int(success_counts.sum())
+        total_failed = int(failed_counts.sum())
+        
+        # 2. 计算每日趋势数据
         daily_trend = []
-        all_days = set()
+        entries_by_date = {}
         
         # 收集所有有记录的日期
         for entry in entries:
-            date_str = datetime.datetime.fromisoformat(str(entry['completed_at']).replace('Z', '+00:00')).date().isoformat()
-            all_days.add(date_str)
+            entries_by_date.setdefault(entry['_date'], []).append(entry)
+        
+        # 每天应打卡的每日习惯数量
+        trend_end = max([end_date] + list(entries_by_date))
+        scheduled_counts = scheduled_daily_habit_counts(user_habits, start_date, trend_end)
         
         # 对每个日期计算完成率
-        for date_str in sorted(all_days):
-            date = datetime.date.fromisoformat(date_str)
-            day_entries = [e for e in entries 
-                          if datetime.datetime.fromisoformat(str(e['completed_at']).replace('Z', '+00:00')).date().isoformat() == date_str]
-            
-            # 根据当天应打卡的习惯计算完成率
-            day_habits = []
-            for habit in user_habits:
-                if habit['frequency'] == 'daily':
-                    weekday = date.weekday() + 1  # Python的weekday()返回0-6，转换为1-7
-                    if weekday == 7:  # 如果是周日(6)，转换为7
-                        weekday = 7
-                    
-                    checkin_days = habit.get('checkin_days', [1, 2, 3, 4, 5, 6, 7])
-                    if isinstance(checkin_days, list) and weekday in checkin_days:
-                        day_habits.append(habit)
+        for date in sorted(entries_by_date):
+            day_entries = entries_by_date[date]
+            day_habits = int(scheduled_counts[(date - start_date).days])
             
             successful_entries = [e for e in day_entries if e.get('status') != 'failed']
-            completion_rate = len(successful_entries) / len(day_habits) if day_habits else 0
+            completion_rate = len(successful_entries) / day_habits if day_habits else 0
             
             daily_trend.append({
                 "date": date.strftime('%Y-%m-%d'),
                 "completionRate": completion_rate
             })
         
-        # 5. 计算总体完成率
+        # 3. 计算总体完成率
         overall_completion_rate = sum(stat["completionRate"] for stat in habit_stats) / len(habit_stats) if habit_stats else 0
         
-        # 6. 构建并保存全局统计数据
+        # 4. 构建全局统计数据
         global_stat = {
             "user_id": user_id,
             "time_range": time_range,
@@ -702,7 +1131,18 @@ class HabitStatsService:
             "updated_at": now
         }
         
-        # 如果有缓存数据则更新，否则创建新记录
+        result = {
+            "overallCompletionRate": overall_completion_rate,
+            "periodLabel": period_label,
+            "bestHabit": best_habit,
+            "worstHabit": worst_habit,
+            "habitStats": habit_stats,
+            "dailyTrend": daily_trend
+        }
+        return result, global_stat
+
+    def _save_global_stats(self, global_stat: Dict[str, Any], cached_stats: Optional[Dict[str, Any]] = None) -> None:
+        """保存全局统计数据，如果有缓存数据则更新，否则创建新记录（同一周期的记录已存在时覆盖）"""
         with self._get_connection() as conn:
             with conn.cursor() as cursor:
                 if cached_stats:
@@ -724,7 +1164,7 @@ class HabitStatsService:
                             global_stat["total_failed"],
                             global_stat["best_habit_id"],
                             global_stat["worst_habit_id"],
-                            global_stat["daily_trend"],
+                            Json(global_stat["daily_trend"]),
                             global_stat["updated_at"],
                             cached_stats["id"]
                         )
@@ -737,6 +1177,15 @@ class HabitStatsService:
                          overall_completion_rate, total_check_ins, total_failed, 
                          best_habit_id, worst_habit_id, daily_trend, updated_at)
                         VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                        ON CONFLICT (user_id, time_range, period_start) DO UPDATE
+                        SET period_end = EXCLUDED.period_end,
+                            overall_completion_rate = EXCLUDED.overall_completion_rate,
+                            total_check_ins = EXCLUDED.total_check_ins,
+                            total_failed = EXCLUDED.total_failed,
+                            best_habit_id = EXCLUDED.best_habit_id,
+                            worst_habit_id = EXCLUDED.worst_habit_id,
+                            daily_trend = EXCLUDED.daily_trend,
+                            updated_at = EXCLUDED.updated_at
                         """,
                         (
                             global_stat["user_id"],
@@ -748,21 +1197,304 @@ class HabitStatsService:
                             global_stat["total_failed"],
                             global_stat["best_habit_id"],
                             global_stat["worst_habit_id"],
-                            global_stat["daily_trend"],
+                            Json(global_stat["daily_trend"]),
                             global_stat["updated_at"]
                         )
                     )
                 conn.commit()
-        
-        # 7. 返回统计结果
+
+    def _empty_range_response(self, period_label: str) -> Dict[str, Any]:
+        """用户没有活跃习惯时的返回结果"""
         return {
-            "overallCompletionRate": overall_completion_rate,
+            "overallCompletionRate": 0,
             "periodLabel": period_label,
-            "bestHabit": best_habit,
-            "worstHabit": worst_habit,
-            "habitStats": habit_stats,
-            "dailyTrend": daily_trend
+            "bestHabit": None,
+            "worstHabit": None,
+            "habitStats": [],
+            "dailyTrend": []
         }
+
+    def get_habit_stats_by_time_range(self, user_id: str, time_range: str = 'week') -> Dict[str, Any]:
+        """
+        按时间范围获取习惯统计数据
+        
+        参数:
+            user_id: 用户ID
+            time_range: 时间范围，可选值：'week', 'month', 'quarter', 'year'
+            
+        返回:
+            统计数据结果
+        """
+        self._ensure_stats_table()
+        self._ensure_global_stats_table()
+        
+        # 计算时间范围的开始和结束日期
+        now = datetime.datetime.now()
+        period_start, period_label = self._get_period(time_range, now)
+        
+        # 尝试从全局统计表获取已缓存的数据，如果有缓存数据且是今天更新的，直接返回
+        cached_stats = self._get_cached_global_stats(user_id, time_range, period_start)
+        if self._is_fresh(cached_stats, now):
+            return self._format_stats_response(cached_stats, period_label, user_id)
+        
+        # 没有缓存或缓存已过期，重新计算统计数据
+        
+        # 1. 获取用户所有习惯
+        with self._get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(
+                    """
+                    SELECT * FROM habits
+                    WHERE user_id = %s
+                    AND status = 'active'
+                    """,
+                    (user_id,)
+                )
+                user_habits = cursor.fetchall()
+        
+        if not user_habits:
+            return self._empty_range_response(period_label)
+        
+        # 2. 获取每个习惯在指定时间范围内的打卡记录
+        habit_ids = [habit['id'] for habit in user_habits]
+        
+        with self._get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(
+                    """
+                    SELECT id, habit_id, completed_at, status
+                    FROM habit_entries
+                    WHERE habit_id = ANY(%s)
+                    AND user_id = %s
+                    AND completed_at >= %s
+                    """,
+                    (habit_ids, user_id, period_start)
+                )
+                entries = cursor.fetchall()
+        
+        for entry in entries:
+            entry['_date'] = self._entry_date(entry)
+        
+        # 3. 计算统计数据
+        habit_stats_by_id = {habit['id']: self.get_habit_stats(habit['id'], user_id) for habit in user_habits}
+        result, global_stat = self._compute_time_range_stats(
+            user_id, time_range, period_start, period_label, now,
+            user_habits, entries, habit_stats_by_id
+        )
+        
+        # 4. 保存全局统计数据
+        self._save_global_stats(global_stat, cached_stats)
+        
+        # 5. 返回统计结果
+        return result
+
+    def get_habit_stats_by_time_ranges(self, user_id: str, time_ranges: Tuple[str, ...] = TIME_RANGES,
+                                       force: bool = False) -> Dict[str, Dict[str, Any]]:
+        """
+        一次计算多个时间范围的习惯统计数据
+        
+        习惯、habit_stats和打卡记录只加载一次（打卡记录从最早的周期开始），
+        然后在内存中依次计算每个时间范围并写入global_habit_stats。
+        
+        参数:
+            user_id: 用户ID
+            time_ranges: 需要计算的时间范围，默认 week/month/quarter/year
+            force: 是否忽略当天的缓存强制重新计算
+            
+        返回:
+            以time_range为键的统计结果
+        """
+        self._ensure_stats_table()
+        self._ensure_global_stats_table()
+        
+        now = datetime.datetime.now()
+        results = {}
+        pending = []
+        
+        # 今天已经计算过的时间范围直接使用缓存
+        for time_range in time_ranges:
+            period_start, period_label = self._get_period(time_range, now)
+            cached_stats = self._get_cached_global_stats(user_id, time_range, period_start)
+            if not force and self._is_fresh(cached_stats, now):
+                results[time_range] = self._format_stats_response(cached_stats, period_label, user_id)
+            else:
+                pending.append((time_range, period_start, period_label, cached_stats))
+        
+        if not pending:
+            return results
+        
+        with self._get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(
+                    """
+                    SELECT * FROM habits
+                    WHERE user_id = %s
+                    AND status = 'active'
+                    """,
+                    (user_id,)
+                )
+                user_habits = cursor.fetchall()
+        
+        if not user_habits:
+            for time_range, _, period_label, _ in pending:
+                results[time_range] = self._empty_range_response(period_label)
+            return results
+        
+        # 从最早的周期开始一次性加载打卡记录
+        habit_ids = [habit['id'] for habit in user_habits]
+        earliest_start = min(period_start for _, period_start, _, _ in pending)
+        
+        with self._get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(
+                    """
+                    SELECT id, habit_id, completed_at, status
+                    FROM habit_entries
+                    WHERE habit_id = ANY(%s)
+                    AND user_id = %s
+                    AND completed_at >= %s
+                    """,
+                    (habit_ids, user_id, earliest_start)
+                )
+                entries = cursor.fetchall()
+        
+        for entry in entries:
+            entry['_date'] = self._entry_date(entry)
+        
+        # 当前连续天数只需要查询一次，缺少统计数据的习惯再单独计算
+        habit_stats_by_id = {row['habit_id']: row for row in self.get_all_user_stats(user_id)}
+        for habit in user_habits:
+            if habit['id'] not in habit_stats_by_id:
+                habit_stats_by_id[habit['id']] = self.get_habit_stats(habit['id'], user_id)
+        
+        for time_range, period_start, period_label, cached_stats in pending:
+            result, global_stat = self._compute_time_range_stats(
+                user_id, time_range, period_start, period_label, now,
+                user_habits, entries, habit_stats_by_id
+            )
+            self._save_global_stats(global_stat, cached_stats)
+            results[time_range] = result
+        
+        return results
+
+    def _compute_missing_stats(self, user_id: str, habit_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """
+        计算并保存还没有统计数据的习惯，返回 {habit_id: 统计数据}
+
+        用户的打卡记录在数据库中一次聚合，保存后再用一次查询读回这些习惯的统计数据。
+        """
+        computed = self.calculate_user_check_in_stats_sql(user_id, include_bitmap=True)
+        for habit_id in habit_ids:
+            stats = computed.get(habit_id) or self.calculate_check_in_stats(habit_id, user_id)
+            self.save_stats_to_db(habit_id, user_id, stats)
+        
+        with self._get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(
+                    """
+                    SELECT habit_id, user_id, current_streak, total_check_ins
+                    FROM habit_stats
+                    WHERE user_id = %s AND habit_id IN %s
+                    """,
+                    (user_id, tuple(habit_ids))
+                )
+                return {row['habit_id']: row for row in cursor.fetchall()}
+    
+    def precompute_all_time_range_stats(self, time_ranges: Tuple[str, ...] = TIME_RANGES) -> int:
+        """
+        为所有用户预先计算各时间范围的统计数据（适合在夜间批量执行）
+        
+        所有用户的活跃习惯、连续天数和打卡记录各用一次查询加载，
+        再按用户分组在内存中计算，最后写入global_habit_stats。
+        
+        返回:
+            处理的用户数量
+        """
+        self._ensure_stats_table()
+        self._ensure_global_stats_table()
+        
+        now = datetime.datetime.now()
+        periods = [(time_range,) + self._get_period(time_range, now) for time_range in time_ranges]
+        earliest_start = min(period_start for _, period_start, _ in periods)
+        
+        with self._get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(
+                    """
+                    SELECT * FROM habits
+                    WHERE status = 'active'
+                    ORDER BY user_id, id
+                    """
+                )
+                all_habits = cursor.fetchall()
+                
+                cursor.execute(
+                    """
+                    SELECT he.id, he.habit_id, he.user_id, he.completed_at, he.status
+                    FROM habit_entries he
+                    JOIN habits h ON he.habit_id = h.id AND h.status = 'active'
+                    WHERE he.completed_at >= %s
+                    """,
+                    (earliest_start,)
+                )
+                all_entries = cursor.fetchall()
+                
+                cursor.execute(
+                    """
+                    SELECT habit_id, user_id, current_streak, total_check_ins
+                    FROM habit_stats
+                    """
+                )
+                all_stats = cursor.fetchall()
+                
+                cursor.execute(
+                    """
+                    SELECT * FROM global_habit_stats
+                    WHERE time_range = ANY(%s)
+                    AND period_start >= %s
+                    """,
+                    (list(time_ranges), earliest_start)
+                )
+                all_cached = cursor.fetchall()
+        
+        habits_by_user = {}
+        for habit in all_habits:
+            habits_by_user.setdefault(habit['user_id'], []).append(habit)
+        
+        entries_by_user = {}
+        for entry in all_entries:
+            entry['_date'] = self._entry_date(entry)
+            entries_by_user.setdefault(entry['user_id'], []).append(entry)
+        
+        stats_by_user = {}
+        for row in all_stats:
+            stats_by_user.setdefault(row['user_id'], {})[row['habit_id']] = row
+        
+        # period_start 按不带时区的本地零点写入，读出时为会话时区下的同一时刻，两边都按日期匹配
+        cached_by_key = {}
+        for row in all_cached:
+            period_start = row['period_start']
+            period_date = period_start.date() if isinstance(period_start, datetime.datetime) else period_start
+            cached_by_key[(row['user_id'], row['time_range'], period_date)] = row
+        
+        for current_user_id, user_habits in habits_by_user.items():
+            habit_stats_by_id = stats_by_user.get(current_user_id, {})
+            missing = [habit['id'] for habit in user_habits if habit['id'] not in habit_stats_by_id]
+            if missing:
+                habit_stats_by_id.update(self._compute_missing_stats(current_user_id, missing))
+            
+            user_entries = entries_by_user.get(current_user_id, [])
+            for time_range, period_start, period_label in periods:
+                _, global_stat = self._compute_time_range_stats(
+                    current_user_id, time_range, period_start, period_label, now,
+                    user_habits, user_entries, habit_stats_by_id
+                )
+                cached_stats = cached_by_key.get((current_user_id, time_range, period_start.date()))
+                self._save_global_stats(global_stat, cached_stats)
+            
+            logger.info(f"已预计算用户 {current_user_id} 的 {len(periods)} 个时间范围统计")
+        
+        return len(habits_by_user)
     
     def _format_stats_response(self, cached_stat: Dict, period_label: str, user_id: str) -> Dict[str, Any]:
         """格式化缓存的统计数据返回结果"""
@@ -871,11 +1603,14 @@ if __name__ == "__main__":
     if len(sys.argv) < 2:
         print("用法: python habit_stats.py <命令> [参数...]")
         print("支持的命令:")
-        print("  update <用户ID>               - 更新指定用户的所有习惯统计")
+        print("  update <用户ID> [--bitmaps] [--sql] - 更新指定用户的所有习惯统计，--bitmaps 同时保存打卡位图，--sql 在数据库中聚合打卡记录")
         print("  stats <用户ID> <习惯ID>       - 获取指定习惯的统计数据")
         print("  all <用户ID>                  - 获取所有习惯的统计数据")
         print("  report <用户ID>               - 生成习惯统计报告")
         print("  stats_by_range <用户ID> <time_range> - 按时间范围获取统计数据 (time_range: week/month/quarter/year)")
+        print("  bitmap <用户ID> <习惯ID>      - 基于打卡位图输出连续天数和星期分布")
+        print("  stats_all_ranges <用户ID>     - 一次计算 week/month/quarter/year 全部时间范围的统计数据")
+        print("  precompute_ranges             - 为所有用户预计算全部时间范围的统计数据")
         sys.exit(1)
     
     command = sys.argv[1]
@@ -883,12 +1618,15 @@ if __name__ == "__main__":
     
     try:
         if command == "update":
-            if len(sys.argv) > 2:
-                user_id = sys.argv[2]
-                count = service.update_all_user_stats(user_id)
+            store_bitmaps = "--bitmaps" in sys.argv
+            pushdown = "--sql" in sys.argv
+            args = [arg for arg in sys.argv[2:] if arg not in ("--bitmaps", "--sql")]
+            if args:
+                user_id = args[0]
+                count = service.update_all_user_stats(user_id, store_bitmaps=store_bitmaps, pushdown=pushdown)
                 print(f"已更新 {count} 个习惯的统计数据")
             else:
-                count = service.update_all_user_stats()
+                count = service.update_all_user_stats(store_bitmaps=store_bitmaps, pushdown=pushdown)
                 print(f"已更新 {count} 个习惯的统计数据")
                 
         elif command == "stats":
@@ -936,6 +1674,38 @@ if __name__ == "__main__":
             stats = service.get_habit_stats_by_time_range(user_id, time_range)
             print(json.dumps(stats, indent=2, ensure_ascii=False, default=str))
             
+        elif command == "stats_all_ranges":
+            if len(sys.argv) < 3:
+                print("错误: 需要提供用户ID")
+                sys.exit(1)
+                
+            user_id = sys.argv[2]
+            stats = service.get_habit_stats_by_time_ranges(user_id)
+            print(json.dumps(stats, indent=2, ensure_ascii=False, default=str))
+            
+        elif command == "precompute_ranges":
+            count = service.precompute_all_time_range_stats()
+            print(f"已为 {count} 个用户预计算时间范围统计数据")
+            
+        elif command == "bitmap":
+            if len(sys.argv) < 4:
+                print("错误: 需要提供用户ID和习惯ID")
+                sys.exit(1)
+                
+            user_id = sys.argv[2]
+            habit_id = int(sys.argv[3])
+            bitmap = service.get_habit_bitmap(habit_id, user_id)
+            print(json.dumps({
+                "start_date": bitmap.start_date,
+                "days": bitmap.length,
+                "total_check_ins": bitmap.total_check_ins(),
+                "failed_days": bitmap.failed_days(),
+                "current_streak": bitmap.current_streak(),
+                "longest_streak": bitmap.longest_streak(),
+                "last_check_in_date": bitmap.last_check_in_date(),
+                "weekday_histogram": bitmap.weekday_histogram()
+            }, indent=2, ensure_ascii=False, default=str))
+            
         else:
             print(f"错误: 未知命令 '{command}'")
             sys.exit(1)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+多子图热力图渲染
+
+把多个习惯的热力图画在同一张图的网格中（small multiples），
+按每页N个分页保存，所有子图共用一个颜色条。
+相比每个习惯单独生成一张图，图片数量和渲染开销都大幅减少。
+"""
+
+import os
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+
+def render_heatmap_grid(panels: Sequence[Tuple[str, np.ndarray]], output_prefix: str,
+                        per_page: int = 12, ncols: int = 3,
+                        vmin: float = 0, vmax: Optional[float] = None,
+                        cmap: str = 'YlGnBu', cbar_label: str = '',
+                        xticklabels: Optional[Sequence[str]] = None,
+                        yticklabels: Optional[Sequence[str]] = None,
+                        suptitle: Optional[str] = None,
+                        dpi: Optional[int] = None,
+                        cache=None, cache_style: str = '') -> List[str]:
+    """
+    将预先计算好的矩阵画成分页的网格热力图
+
+    参数:
+        panels: [(子图标题, 二维矩阵)]，所有矩阵形状相同
+        output_prefix: 输出文件路径前缀，第n页保存为 {output_prefix}_{n}.png
+        per_page: 每页子图数量
+        vmax: 颜色上限，默认取所有矩阵的最大值，保证各子图颜色可比
+        xticklabels/yticklabels: 坐标轴标签，长度与矩阵的列/行数一致
+        dpi: 保存图片的DPI，默认使用matplotlib配置
+        cache: 可选的ChartCache，某一页的输入数据和参数未变化时直接复用缓存的图片
+        cache_style: 计入缓存键的样式版本
+
+    返回:
+        保存的文件路径列表
+    """
+    if not panels:
+        return []
+
+    if vmax is None:
+        vmax = max((float(np.nanmax(matrix)) for _, matrix in panels if np.size(matrix)), default=0)
+        vmax = max(vmax, vmin + 1)
+
+    output_dir = os.path.dirname(output_prefix)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    files = []
+    for page, offset in enumerate(range(0, len(panels), per_page), start=1):
+        page_panels = panels[offset:offset + per_page]
+        output_file = f"{output_prefix}_{page}.png"
+        files.append(output_file)
+
+        if cache is not None:
+            cache_key = cache.make_key(
+                'heatmap_grid', [list(titles) for titles in zip(*page_panels)],
+                style=cache_style, dpi=dpi, ncols=ncols, vmin=vmin, vmax=vmax, cmap=cmap,
+                cbar_label=cbar_label, xticklabels=xticklabels, yticklabels=yticklabels, suptitle=suptitle
+            )
+            if cache.fetch(cache_key, output_file):
+                continue
+
+        cols = min(ncols, len(page_panels))
+        rows = (len(page_panels) + cols - 1) // cols
+
+        fig, axes = plt.subplots(rows, cols, figsize=(cols * 4.5, rows * 3.2),
+                                 squeeze=False, constrained_layout=True)
+        mesh = None
+        for ax, (title, matrix) in zip(axes.flat, page_panels):
+            mesh = ax.pcolormesh(matrix, cmap=cmap, vmin=vmin, vmax=vmax,
+                                 edgecolors='white', linewidth=0.5)
+            ax.invert_yaxis()
+            ax.set_title(title, fontsize=10)
+
+            n_rows, n_cols = np.shape(matrix)
+            if xticklabels is not None:
+                ax.set_xticks(np.arange(n_cols) + 0.5)
+                ax.set_xticklabels(xticklabels, fontsize=7, rotation=45)
+            if yticklabels is not None:
+                ax.set_yticks(np.arange(n_rows) + 0.5)
+                ax.set_yticklabels(yticklabels, fontsize=7)
+
+        # 隐藏多余的子图
+        for ax in axes.flat[len(page_panels):]:
+            ax.axis('off')
+
+        fig.colorbar(mesh, ax=axes, label=cbar_label, shrink=0.8)
+        if suptitle:
+            fig.suptitle(suptitle)
+
+        fig.savefig(output_file, dpi=dpi)
+        plt.close(fig)
+        if cache is not None:
+            cache.store(cache_key, output_file)
+
+    return files
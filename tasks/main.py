@@ -22,10 +22,20 @@ def main():
     
     # 摘要子命令
     summary_parser = subparsers.add_parser('summary', help='生成数据摘要')
-    summary_parser.add_argument('type', choices=['daily', 'weekly', 'monthly'], 
-                      help='摘要类型: daily (每日摘要), weekly (周报摘要), monthly (月度摘要)')
+    summary_parser.add_argument('type', choices=['daily', 'weekly', 'monthly', 'quarterly'], 
+                      help='摘要类型: daily (每日摘要), weekly (周报摘要), monthly (月度摘要), quarterly (季度摘要)')
     summary_parser.add_argument('--days', type=int, default=7,
                       help='天数范围 (仅对weekly和monthly有效)')
+    summary_parser.add_argument('--rolling', action='store_true',
+                      help='周报基于已存储的按天聚合生成，只重新计算最新一天')
+    summary_parser.add_argument('--per-user', action='store_true',
+                      help='按用户分组生成摘要，每个用户单独输出 (仅对daily和weekly有效)')
+    summary_parser.add_argument('--sql', action='store_true',
+                      help='周报在数据库中完成聚合，只传输聚合结果')
+    summary_parser.add_argument('--no-charts', action='store_true',
+                      help='只生成摘要数据，不渲染图表')
+    summary_parser.add_argument('--chart-workers', type=int, default=None,
+                      help='图表渲染进程数 (默认在当前进程中渲染)')
     
     # 图表子命令
     charts_parser = subparsers.add_parser('charts', help='生成数据图表')
@@ -37,6 +47,8 @@ def main():
                     help='开始日期 (YYYY-MM-DD)')
     charts_parser.add_argument('--end-date',
                     help='结束日期 (YYYY-MM-DD)')
+    charts_parser.add_argument('--heatmap-layout', choices=['grid', 'single'], default='grid',
+                    help='习惯热力图布局: grid (所有习惯画在一张网格图中), single (每个习惯一张图)')
     
     # 习惯统计子命令
     habits_parser = subparsers.add_parser('habits', help='习惯打卡统计')
@@ -47,6 +59,14 @@ def main():
                     help='分析的天数 (默认: 30)')
     habits_parser.add_argument('--format', choices=['json', 'csv', 'all'], default='all', 
                     help='输出格式 (默认: all)')
+    habits_parser.add_argument('--stale-only', action='store_true',
+                    help='更新统计时只重新计算打卡记录有变化的习惯')
+    habits_parser.add_argument('--sql', action='store_true',
+                    help='更新统计时在数据库中聚合打卡记录，减少数据传输')
+    habits_parser.add_argument('--ranges', action='store_true',
+                    help='预计算 week/month/quarter/year 时间范围统计 (指定 --user-id 时只处理该用户)')
+    habits_parser.add_argument('--workers', type=int, default=None,
+                    help='不指定 --user-id 批量生成报告时的渲染进程数 (默认: CPU核数)')
     
     # 数据库探索子命令
     db_parser = subparsers.add_parser('explore-db', help='数据库探索工具')
@@ -64,7 +84,32 @@ def main():
     insight_parser.add_argument('--user-id', dest='user_id', help='用户ID，不指定则处理所有用户')
     insight_parser.add_argument('--date', help='指定日期(YYYY-MM-DD)，默认为昨天')
     insight_parser.add_argument('--force', action='store_true', help='强制重新生成已存在的洞察')
-    insight_parser.add_argument('--chain', action='store_true', help='使用链式分析模式，分步骤处理不同数据类型')
+    insight_parser.add_argument('--chain', action='store_true', help='使用链式分析模式，各类数据并发分析后整合，复用没有变化的部分')
+    insight_parser.add_argument('--batch', action='store_true', help='使用Batch API离线生成并批量写入洞察')
+    insight_parser.add_argument('--batch-id', help='只等待并写入已提交的批处理任务的结果')
+    insight_parser.add_argument('--poll-interval', type=float, default=60, help='批处理模式下轮询任务状态的间隔(秒)')
+    
+    # 回填子命令
+    backfill_parser = subparsers.add_parser('backfill', help='按日期范围回填摘要和洞察')
+    backfill_parser.add_argument('--start', required=True, help='开始日期 (YYYY-MM-DD)')
+    backfill_parser.add_argument('--end', required=True, help='结束日期 (YYYY-MM-DD)，包含当天')
+    backfill_parser.add_argument('--tasks', default='summary',
+                    help='逗号分隔的任务列表: summary (每日摘要), aggregates (按天聚合), insight (每日AI洞察)')
+    backfill_parser.add_argument('--workers', type=int, default=4, help='并行处理的天数 (默认: 4)')
+    backfill_parser.add_argument('--checkpoint', help='检查点文件路径 (默认: output/backfill_checkpoint.json)')
+    backfill_parser.add_argument('--force', action='store_true', help='忽略检查点，重新处理所有日期')
+    
+    # 综合报告子命令
+    composite_parser = subparsers.add_parser('composite', help='基于(用户, 日期)活动立方体生成综合报告')
+    composite_parser.add_argument('--days', type=int, default=30, help='天数范围 (默认: 30)')
+    composite_parser.add_argument('--start', help='开始日期 (YYYY-MM-DD)，与 --end 一起使用时忽略 --days')
+    composite_parser.add_argument('--end', help='结束日期 (YYYY-MM-DD)，包含当天')
+    composite_parser.add_argument('--per-user', action='store_true', help='为每个用户单独输出按天指标')
+    composite_parser.add_argument('--no-charts', action='store_true', help='不渲染图表')
+    composite_parser.add_argument('--weekly', action='store_true',
+                    help='同时生成周报 (数据库聚合模式)，按天数据从同一个立方体切片')
+    composite_parser.add_argument('--detail-charts', action='store_true',
+                    help='同时运行图表生成器，按天趋势和生产力日历从同一个立方体切片')
     
     # 导出到存储子命令
     export_parser = subparsers.add_parser('export', help='导出分析结果到对象存储')
@@ -97,21 +142,37 @@ def main():
             
         # 根据子命令执行相应的功能
         if args.command == 'summary':
-            if args.type == 'daily':
+            if args.per_user and args.type in ('daily', 'weekly'):
+                from user_summary import generate_user_summaries
+                summaries = generate_user_summaries(args.type, args.days)
+                logger.info(f"已为 {len(summaries)} 名用户生成{args.type}摘要")
+            
+            elif args.type == 'daily':
                 from daily_summary import generate_daily_summary
                 summary = generate_daily_summary()
                 logger.info(f"生产力得分: {summary['overall']['productivity_score']:.2f}/100")
             
             elif args.type == 'weekly':
-                from weekly_summary import generate_weekly_summary
-                summary = generate_weekly_summary(days=args.days)
+                if args.rolling:
+                    from summary_aggregates import generate_rolling_summary
+                    summary = generate_rolling_summary(days=args.days, label='rolling_weekly')
+                else:
+                    from weekly_summary import generate_weekly_summary
+                    summary = generate_weekly_summary(days=args.days, pushdown=args.sql,
+                                                      charts=not args.no_charts,
+                                                      chart_workers=args.chart_workers)
                 logger.info(f"周度生产力得分: {summary['overall']['productivity_score']:.2f}/100")
             
             elif args.type == 'monthly':
-                # 这里可以添加月度摘要逻辑，现在仅用周报模块实现
-                from weekly_summary import generate_weekly_summary
-                summary = generate_weekly_summary(days=30)
+                # 月度和季度摘要由按天聚合合并得到，只有最新一天需要重新计算
+                from summary_aggregates import generate_rolling_summary
+                summary = generate_rolling_summary(days=30, label='monthly')
                 logger.info(f"月度生产力得分: {summary['overall']['productivity_score']:.2f}/100")
+            
+            elif args.type == 'quarterly':
+                from summary_aggregates import generate_rolling_summary
+                summary = generate_rolling_summary(days=90, label='quarterly')
+                logger.info(f"季度生产力得分: {summary['overall']['productivity_score']:.2f}/100")
         
         elif args.command == 'charts':
             from generate_charts import generate_charts
@@ -127,7 +188,7 @@ def main():
             else:
                 days = args.days
             
-            generate_charts(days, args.output)
+            generate_charts(days, args.output, args.heatmap_layout)
         
         elif args.command == 'explore-db':
             from explore_db import main as explore_main
@@ -140,32 +201,52 @@ def main():
             return export_main()
         
         elif args.command == 'habits':
-            if args.update:
+            if args.ranges:
                 from habit_stats import HabitStatsService
                 with HabitStatsService() as service:
-                    updated = service.update_all_user_stats(args.user_id)
+                    if args.user_id:
+                        service.get_habit_stats_by_time_ranges(args.user_id, force=True)
+                        logger.info(f"已计算用户 {args.user_id} 的全部时间范围统计数据")
+                    else:
+                        count = service.precompute_all_time_range_stats()
+                        logger.info(f"已为 {count} 个用户预计算全部时间范围统计数据")
+            elif args.update:
+                from habit_stats import HabitStatsService
+                with HabitStatsService() as service:
+                    if args.stale_only:
+                        updated = service.update_stale_user_stats(args.user_id, pushdown=args.sql)
+                    else:
+                        updated = service.update_all_user_stats(args.user_id, pushdown=args.sql)
                     if args.user_id:
                         logger.info(f"已更新用户 {args.user_id} 的 {updated} 个习惯统计数据")
                     else:
                         logger.info(f"已更新所有用户的 {updated} 个习惯统计数据")
+            elif not args.user_id:
+                # 未指定用户时在同一进程中批量生成所有用户的报告
+                from habit_report import generate_all_user_reports
+                results = generate_all_user_reports(args.days, args.format, workers=args.workers)
+                logger.info(f"已为 {len(results)} 个用户生成习惯统计报告")
             else:
-                # 生成报告必须指定用户
-                if not args.user_id:
-                    logger.error("生成报告时必须指定 --user-id 参数")
-                    return 1
-                    
                 from habit_report import main as habit_report_main
                 sys.argv = ["habit_report.py", args.user_id, "--days", str(args.days), "--format", args.format]
                 habit_report_main()
                 logger.info(f"用户 {args.user_id} 的习惯统计报告生成完成")
         
+        elif args.command == 'daily-insight' and args.batch_id:
+            from daily_insight import ingest_insight_batch
+            user_results = ingest_insight_batch(args.batch_id, args.poll_interval)
+            success_count = sum(1 for result in user_results.values() if result.get('success'))
+            logger.info(f"批处理任务 {args.batch_id} 的洞察写入完成: 成功 {success_count}/{len(user_results)}")
+        
         elif args.command == 'daily-insight':
             from daily_insight import generate_daily_insights
             results = generate_daily_insights(
                 user_id=args.user_id, 
                 target_date=args.date, 
                 force=args.force,
-                use_chain=args.chain
+                use_chain=args.chain,
+                use_batch=args.batch,
+                batch_poll_interval=args.poll_interval
             )
             if args.user_id:
                 if args.user_id in results['user_results']:
@@ -179,6 +260,29 @@ def main():
             else:
                 logger.info(f"所有用户的每日洞察生成完成: 成功 {results['success_count']}/{results['total_users']}")
         
+        elif args.command == 'backfill':
+            from backfill import parse_date, run_backfill
+            tasks = [task.strip() for task in args.tasks.split(',') if task.strip()]
+            results = run_backfill(parse_date(args.start), parse_date(args.end), tasks,
+                                   workers=args.workers, checkpoint_path=args.checkpoint, force=args.force)
+            failed = sum(result.get('failed', 0) for result in results.values())
+            for task, result in results.items():
+                logger.info(f"回填 {task}: 完成 {result['done']} 天, 失败 {result['failed']} 天, 跳过 {result['skipped']} 天")
+            if failed:
+                logger.error(f"有 {failed} 天回填失败，重新运行相同命令会从检查点继续")
+                return 1
+        
+        elif args.command == 'composite':
+            from activity_cube import generate_composite_report
+            from backfill import parse_date
+            start_date = parse_date(args.start) if args.start else None
+            end_date = parse_date(args.end) if args.end else None
+            report = generate_composite_report(args.days, start_date, end_date,
+                                               charts=not args.no_charts, per_user=args.per_user,
+                                               weekly=args.weekly, detail_charts=args.detail_charts)
+            logger.info(f"综合报告覆盖 {report['total_users']} 名用户, "
+                        f"整体生产力得分: {report['overall']['productivity_score']:.2f}/100")
+        
         logger.info(f"成功完成 {args.command} 任务")
         return 0
     
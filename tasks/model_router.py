@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按延迟选择模型
+
+为 OPENAI_MODELS 中的每个模型记录延迟、每千token延迟和错误率的指数加权移动平均(EWMA)，
+每次请求根据提示大小选择预计最快的健康模型：小提示主要看固定延迟，大提示主要看每千token延迟。
+以一定概率随机试探其他模型，让统计数据跟上模型的变化。统计数据保存在JSON文件中，下次运行继续使用，
+每次运行结束时同时写入本次的路由决策。
+"""
+import json
+import logging
+import os
+import random
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# EWMA的平滑系数，越大越看重最近的请求
+EWMA_ALPHA = 0.3
+
+# 错误率超过该值且请求数足够时视为不健康，不再主动选择（仍可能被试探）
+UNHEALTHY_ERROR_RATE = 0.5
+MIN_REQUESTS_FOR_HEALTH = 3
+
+# 提示达到该token数时完全按每千token延迟估算
+LARGE_PAYLOAD_TOKENS = 2000
+
+
+def _ewma(previous: Optional[float], value: float) -> float:
+    return value if previous is None else EWMA_ALPHA * value + (1 - EWMA_ALPHA) * previous
+
+
+class ModelRouter:
+    """记录每个模型的延迟和错误率并据此选择模型，多线程调用安全"""
+
+    def __init__(self, models: List[str], stats_path: Optional[str] = None, probe_rate: Optional[float] = None):
+        self.models = list(dict.fromkeys(models))
+        self.stats_path = stats_path if stats_path is not None else config.model_router_stats_path
+        self.probe_rate = config.model_probe_rate if probe_rate is None else probe_rate
+        self._lock = threading.Lock()
+        self.stats: Dict[str, Dict[str, Any]] = {model: self._empty_stats() for model in self.models}
+        self.decisions: List[Dict[str, Any]] = []
+        self._load()
+
+    @staticmethod
+    def _empty_stats() -> Dict[str, Any]:
+        return {"requests": 0, "errors": 0, "latency": None, "latency_per_1k": None, "error_rate": 0.0}
+
+    def _load(self) -> None:
+        """读取上次保存的统计数据，忽略已不在 OPENAI_MODELS 中的模型"""
+        if not self.stats_path or not os.path.exists(self.stats_path):
+            return
+        try:
+            with open(self.stats_path, "r", encoding="utf-8") as f:
+                saved = json.load(f).get("models", {})
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取模型统计 {self.stats_path} 失败，重新开始统计: {str(e)}")
+            return
+        for model in self.models:
+            if model in saved:
+                self.stats[model].update(saved[model])
+
+    def reset_run(self) -> None:
+        """开始新的一次运行，清空本次的路由决策"""
+        with self._lock:
+            self.decisions = []
+
+    @staticmethod
+    def _is_healthy(stats: Dict[str, Any]) -> bool:
+        return stats["requests"] < MIN_REQUESTS_FOR_HEALTH or stats["error_rate"] <= UNHEALTHY_ERROR_RATE
+
+    @staticmethod
+    def _expected_latency(stats: Dict[str, Any], payload_tokens: int) -> Optional[float]:
+        if stats["latency"] is None:
+            return None
+        weight = min(1.0, payload_tokens / LARGE_PAYLOAD_TOKENS)
+        scaled = (stats["latency_per_1k"] or 0) * payload_tokens / 1000
+        estimate = (1 - weight) * stats["latency"] + weight * scaled
+        return estimate / max(1 - stats["error_rate"], 0.05)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """当前统计数据的副本"""
+        with self._lock:
+            return {model: dict(stats) for model, stats in self.stats.items()}
+
+    def is_healthy(self, model: str) -> bool:
+        """请求数不足或错误率不高的模型视为健康"""
+        with self._lock:
+            return self._is_healthy(self.stats[model])
+
+    def expected_latency(self, model: str, payload_tokens: int) -> Optional[float]:
+        """
+        估算模型处理该大小提示的延迟(秒)，没有数据时返回None
+
+        小提示接近平均延迟，大提示接近每千token延迟乘以提示大小，
+        再除以成功率，相当于计入失败重试的代价。
+        """
+        with self._lock:
+            return self._expected_latency(self.stats[model], payload_tokens)
+
+    def choose(self, payload_tokens: int = 0, probe: bool = True) -> str:
+        """
+        选择模型
+
+        参数:
+            payload_tokens: 提示的估算token数
+            probe: 是否允许随机试探其他模型，批处理请求不需要试探
+        """
+        with self._lock:
+            if len(self.models) == 1:
+                model, reason = self.models[0], "only"
+            else:
+                unmeasured = [model for model in self.models if not self.stats[model]["requests"]]
+                healthy = [model for model in self.models if self._is_healthy(self.stats[model])] or self.models
+                if probe and unmeasured:
+                    model, reason = random.choice(unmeasured), "unmeasured"
+                else:
+                    def estimate(candidate: str) -> float:
+                        latency = self._expected_latency(self.stats[candidate], payload_tokens)
+                        return float("inf") if latency is None else latency
+                    model = min(healthy, key=estimate)
+                    reason = "fastest"
+                    others = [m for m in self.models if m != model]
+                    if probe and others and random.random() < self.probe_rate:
+                        model, reason = random.choice(others), "probe"
+            self.decisions.append({
+                "time": datetime.now().isoformat(timespec="seconds"),
+                "model": model,
+                "payload_tokens": payload_tokens,
+                "reason": reason
+            })
+        return model
+
+    def record(self, model: str, latency: float, payload_tokens: int, success: bool) -> None:
+        """
+        记录一次请求的结果
+
+        payload_tokens 为选择模型时使用的提示token估算值，每千token延迟按它计算，
+        与 expected_latency 的估算基准一致。
+        """
+        with self._lock:
+            stats = self.stats.setdefault(model, self._empty_stats())
+            stats["requests"] += 1
+            stats["error_rate"] = _ewma(stats["error_rate"] if stats["requests"] > 1 else None, 0.0 if success else 1.0)
+            if not success:
+                stats["errors"] += 1
+                return
+            stats["latency"] = _ewma(stats["latency"], latency)
+            if payload_tokens > 0:
+                stats["latency_per_1k"] = _ewma(stats["latency_per_1k"], latency / payload_tokens * 1000)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """本次运行每个模型被选择的次数（按原因分类）"""
+        result: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            for decision in self.decisions:
+                counts = result.setdefault(decision["model"], {})
+                counts[decision["reason"]] = counts.get(decision["reason"], 0) + 1
+        return result
+
+    def save(self) -> None:
+        """写入每个模型的统计数据和本次运行的路由决策，并记录日志"""
+        snapshot = self.snapshot()
+        for model, counts in self.summary().items():
+            stats = snapshot.get(model, {})
+            latency = f"{stats['latency']:.2f}秒" if stats.get("latency") is not None else "未知"
+            logger.info(f"模型 {model}: 本次选择 {sum(counts.values())} 次 {counts}, "
+                        f"平均延迟 {latency}, 错误率 {stats.get('error_rate', 0):.0%}")
+        if not self.stats_path:
+            return
+        with self._lock:
+            data = {
+                "updated_at": datetime.now().isoformat(timespec="seconds"),
+                "models": self.stats,
+                "decisions": self.decisions
+            }
+            directory = os.path.dirname(self.stats_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.stats_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+        logger.info(f"模型路由统计已保存到 {self.stats_path}")
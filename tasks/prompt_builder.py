@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+洞察提示的紧凑序列化
+
+把整合后的分析数据转换为发送给模型的紧凑JSON：
+去掉空值、空集合和 {"message": ...} 占位段落，浮点数保留一位小数，
+常用键名替换为缩写并附上缩写说明，发送前估算token数，
+超出预算时按价值从低到高依次删除细节。每次运行累计节省的token数并写入日志。
+"""
+import json
+import logging
+import math
+import re
+import threading
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# 浮点数保留的小数位数
+FLOAT_DIGITS = 1
+
+# 提示文本里已经包含的字段，不再重复放进数据
+REDUNDANT_KEYS = {"user_id", "date", "id"}
+
+# 键名缩写，值必须唯一，提示中附带用到的缩写说明
+KEY_ABBREVIATIONS = {
+    "completion_rate": "cr",
+    "completed": "done",
+    "total": "n",
+    "total_habits": "h_n",
+    "completed_habits": "h_done",
+    "failed_habits": "h_fail",
+    "category_stats": "by_cat",
+    "difficulty_stats": "by_diff",
+    "total_todos": "t_n",
+    "completed_todos": "t_done",
+    "new_todos": "t_new",
+    "overdue_todos": "t_overdue",
+    "priority_stats": "by_pri",
+    "total_notes": "n_n",
+    "new_notes": "n_new",
+    "updated_notes": "n_upd",
+    "content_length_stats": "n_len",
+    "total_pomodoros": "p_n",
+    "status_counts": "by_status",
+    "total_duration": "p_min",
+    "completed_duration": "p_done_min",
+    "hourly_distribution": "by_hour",
+    "tag_stats": "by_tag",
+    "task_relation_stats": "p_links",
+    "total_completed_tasks": "tasks_done",
+    "total_focus_minutes": "focus_min",
+    "completed_focus_minutes": "done_focus_min",
+    "ai_feedback_actions": "ai_actions",
+}
+
+# 值为 {类别/标签等用户数据: 统计} 的字段，这些键是用户数据，原样保留，只缩写每项统计中的字段名
+DATA_KEYED_FIELDS = {
+    "category_stats", "difficulty_stats", "priority_stats",
+    "status_counts", "hourly_distribution", "tag_stats",
+}
+
+# 超出预算时依次删除的细节，排在前面的价值最低
+DETAIL_DROP_ORDER = [
+    ("pomodoros", "hourly_distribution"),
+    ("habits", "difficulty_stats"),
+    ("notes", "content_length_stats"),
+    ("pomodoros", "task_relation_stats"),
+    ("notes", "category_stats"),
+    ("pomodoros", "tag_stats"),
+    ("todos", "priority_stats"),
+    ("habits", "category_stats"),
+    ("daily_summary", "ai_feedback_actions"),
+    ("daily_summary", "ai_summary"),
+]
+
+# 超出预算时计数字典（如标签统计）先只保留前几项
+COUNT_LIMIT = 5
+
+# 删除细节后仍超出预算时，长文本字段截断到的字符数
+TEXT_LIMIT = 200
+
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+
+def _is_missing(value: Any) -> bool:
+    """None、NaN和pandas的缺失值"""
+    if value is None:
+        return True
+    if isinstance(value, float) and math.isnan(value):
+        return True
+    return type(value).__name__ in ("NAType", "NaTType")
+
+
+def compact_value(value: Any) -> Any:
+    """
+    递归精简数据：去掉缺失值、空集合和只有message的占位段落，
+    浮点数四舍五入，NumPy标量转换为Python类型
+    """
+    if hasattr(value, "item") and not isinstance(value, (dict, list, tuple, str)):
+        try:
+            value = value.item()
+        except (TypeError, ValueError):
+            pass
+    if isinstance(value, dict):
+        if set(value) == {"message"}:
+            return None
+        result = {}
+        for key, item in value.items():
+            item = compact_value(item)
+            if item is not None:
+                result[str(key)] = item
+        return result or None
+    if isinstance(value, (list, tuple)):
+        result = [item for item in (compact_value(item) for item in value) if item is not None]
+        return result or None
+    if _is_missing(value):
+        return None
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, float):
+        rounded = round(value, FLOAT_DIGITS)
+        return int(rounded) if rounded.is_integer() else rounded
+    if isinstance(value, str):
+        value = value.strip()
+        return value or None
+    return value
+
+
+def _abbreviate_fields(fields: Dict[str, Any], used: set) -> Dict[str, Any]:
+    """替换一层字段名的缩写，不处理字段的值"""
+    result = {}
+    for key, item in fields.items():
+        if key in KEY_ABBREVIATIONS:
+            used.add(key)
+        result[KEY_ABBREVIATIONS.get(key, key)] = item
+    return result
+
+
+def abbreviate_keys(payload: Dict[str, Any], used: Optional[set] = None) -> Tuple[Dict[str, Any], set]:
+    """
+    按分析数据的结构替换键名缩写，返回替换后的数据和用到的原键名
+
+    只缩写各部分（habits、todos等）的字段名，以及 DATA_KEYED_FIELDS 中每项统计的字段名；
+    类别、标签等用户数据作为键时原样保留，每日总结等结构不固定的内容也不做替换。
+    """
+    used = set() if used is None else used
+    result = {}
+    for section, fields in payload.items():
+        if not isinstance(fields, dict):
+            result[section] = fields
+            continue
+        fields = dict(fields)
+        for key in DATA_KEYED_FIELDS & set(fields):
+            if isinstance(fields[key], dict):
+                fields[key] = {name: _abbreviate_fields(item, used) if isinstance(item, dict) else item
+                               for name, item in fields[key].items()}
+        result[section] = _abbreviate_fields(fields, used)
+    return result, used
+
+
+def key_legend(used: set) -> str:
+    """用到的缩写说明"""
+    return ", ".join(f"{KEY_ABBREVIATIONS[key]}={key}" for key in sorted(used, key=KEY_ABBREVIATIONS.get))
+
+
+@lru_cache(maxsize=1)
+def _token_encoder():
+    """tiktoken是可选依赖，没有安装时使用字符数估算"""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def estimate_tokens(text: str) -> int:
+    """估算文本的token数：有tiktoken时精确计算，否则中日韩字符按1个token、其他字符按4个字符1个token估算"""
+    encoder = _token_encoder()
+    if encoder is not None:
+        return len(encoder.encode(text))
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def _serialize(data: Any) -> str:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def _trim_counts(value: Any, limit: int) -> Any:
+    """计数字典（如标签统计）只保留数量最多的前几项，列表只保留前几项"""
+    if isinstance(value, dict):
+        if len(value) > limit and all(isinstance(item, (int, float)) and not isinstance(item, bool)
+                                      for item in value.values()):
+            return dict(sorted(value.items(), key=lambda pair: pair[1], reverse=True)[:limit])
+        return {key: _trim_counts(item, limit) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_trim_counts(item, limit) for item in value[:limit]]
+    return value
+
+
+def _truncate_texts(value: Any, limit: int) -> Any:
+    """截断所有长文本字段"""
+    if isinstance(value, dict):
+        return {key: _truncate_texts(item, limit) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_truncate_texts(item, limit) for item in value]
+    if isinstance(value, str) and len(value) > limit:
+        return value[:limit] + "…"
+    return value
+
+
+class PromptStats:
+    """累计一次运行中提示压缩前后的token数，多线程调用安全"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.requests = 0
+            self.original_tokens = 0
+            self.compact_tokens = 0
+            self.over_budget = 0
+
+    def record(self, original_tokens: int, compact_tokens: int, over_budget: bool) -> None:
+        with self._lock:
+            self.requests += 1
+            self.original_tokens += original_tokens
+            self.compact_tokens += compact_tokens
+            self.over_budget += int(over_budget)
+
+    def log_summary(self) -> None:
+        """把本次运行的压缩效果写入日志"""
+        if not self.requests:
+            return
+        saved = self.original_tokens - self.compact_tokens
+        ratio = saved / self.original_tokens * 100 if self.original_tokens else 0
+        logger.info(f"提示压缩: {self.requests} 个请求, 原始约 {self.original_tokens} tokens, "
+                    f"压缩后约 {self.compact_tokens} tokens, 节省 {saved} ({ratio:.1f}%)")
+        if self.over_budget:
+            logger.warning(f"有 {self.over_budget} 个请求删除细节后仍超出token预算")
+
+
+prompt_stats = PromptStats()
+
+
+def build_compact_payload(analysis_data: Dict[str, Any], budget: Optional[int] = None) -> Tuple[str, Dict[str, Any]]:
+    """
+    把分析数据序列化为紧凑的提示数据
+
+    参数:
+        analysis_data: 整合后的分析数据
+        budget: 数据部分的token预算，默认为 config.prompt_token_budget
+    返回:
+        (数据文本, 统计信息)，数据文本包含紧凑JSON，用到缩写时在后面附上缩写说明
+    """
+    budget = budget or config.prompt_token_budget
+    original_tokens = estimate_tokens(json.dumps(analysis_data, ensure_ascii=False, indent=2, default=str))
+
+    data = {key: value for key, value in analysis_data.items() if key not in REDUNDANT_KEYS}
+    data = compact_value(data) or {}
+    for section in data.values():
+        if isinstance(section, dict):
+            for key in REDUNDANT_KEYS & set(section):
+                del section[key]
+
+    def render(payload: Dict[str, Any]) -> Tuple[str, int]:
+        abbreviated, used = abbreviate_keys(payload)
+        text = _serialize(abbreviated)
+        if used:
+            text += f"\n键名缩写: {key_legend(used)}"
+        return text, estimate_tokens(text)
+
+    text, tokens = render(data)
+    dropped: List[str] = []
+    if tokens > budget:
+        data = _trim_counts(data, COUNT_LIMIT)
+        dropped.append(f"top{COUNT_LIMIT}")
+        text, tokens = render(data)
+    for section, key in DETAIL_DROP_ORDER:
+        if tokens <= budget:
+            break
+        if isinstance(data.get(section), dict) and key in data[section]:
+            del data[section][key]
+            if not data[section]:
+                del data[section]
+            dropped.append(f"{section}.{key}")
+            text, tokens = render(data)
+    if tokens > budget:
+        data = _truncate_texts(data, TEXT_LIMIT)
+        dropped.append(f"text>{TEXT_LIMIT}")
+        text, tokens = render(data)
+
+    over_budget = tokens > budget
+    prompt_stats.record(original_tokens, tokens, over_budget)
+    if dropped:
+        logger.debug(f"提示超出预算 {budget} tokens，已删除: {', '.join(dropped)}")
+    return text, {
+        "original_tokens": original_tokens,
+        "compact_tokens": tokens,
+        "dropped": dropped,
+        "over_budget": over_budget
+    }
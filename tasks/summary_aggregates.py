@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按天存储的摘要聚合数据
+
+每天的习惯、待办事项和笔记摘要聚合（数量、完成情况、标签计数）保存在
+summary_daily_aggregates表中。周、月、季度等滚动窗口的摘要由已存储的按天聚合
+合并得到，只有缺失的日期和最新的一天需要查询原始数据重新计算，
+因此长窗口的开销与每日摘要基本相同。只有已经结束的日期（按配置时区，早于今天）才会被存储，
+存储时间早于当天结束的聚合视为不完整，会重新计算。
+
+按天聚合基于当天发生的事件：习惯按完成日期，待办事项分别按创建日期和完成日期，
+笔记分别按创建日期和更新日期。跨天的待办事项（例如周一创建、周三完成）
+会在创建日和完成日分别计数。
+"""
+import logging
+from datetime import date, timedelta
+from typing import Any, Dict, List, Tuple
+
+import pandas as pd
+from psycopg2.extras import Json, RealDictCursor, execute_values
+
+from config import config
+from db import COLUMN_TYPES, db
+from tag_analysis import tag_counts_by
+from utils import get_date_range, get_today, save_summary_to_json
+from weekly_summary import calculate_weekly_productivity_score
+
+logger = logging.getLogger(__name__)
+
+
+def ensure_aggregates_table() -> None:
+    """确保summary_daily_aggregates表存在"""
+    with db.get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS summary_daily_aggregates (
+                summary_date DATE PRIMARY KEY,
+                habits JSONB NOT NULL DEFAULT '{}',
+                todos JSONB NOT NULL DEFAULT '{}',
+                notes JSONB NOT NULL DEFAULT '{}',
+                updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+            )
+            """)
+            conn.commit()
+
+
+def load_window_data(start_date: date, end_date: date) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """一次性查询日期范围内的习惯、待办事项和笔记原始数据"""
+    params = {"start_date": start_date, "end_date": end_date, "tz": config.timezone}
+    habits_df = db.query_to_dataframe("""
+    SELECT
+        h.id, h.name, h.category,
+        hc.completion_date, hc.is_completed
+    FROM habits h
+    JOIN habit_completions hc ON h.id = hc.habit_id
+    WHERE hc.completion_date BETWEEN %(start_date)s AND %(end_date)s
+    """, params, **COLUMN_TYPES['habits'])
+    todos_df = db.query_to_dataframe("""
+    SELECT
+        id, status, completed_at, priority, created_at, tags
+    FROM todos
+    WHERE ((created_at AT TIME ZONE %(tz)s)::date BETWEEN %(start_date)s AND %(end_date)s)
+       OR ((completed_at AT TIME ZONE %(tz)s)::date BETWEEN %(start_date)s AND %(end_date)s)
+    """, params, **COLUMN_TYPES['todos'])
+    notes_df = db.query_to_dataframe("""
+    SELECT
+        id, tags, created_at, updated_at
+    FROM notes
+    WHERE ((created_at AT TIME ZONE %(tz)s)::date BETWEEN %(start_date)s AND %(end_date)s)
+       OR ((updated_at AT TIME ZONE %(tz)s)::date BETWEEN %(start_date)s AND %(end_date)s)
+    """, params, **COLUMN_TYPES['notes'])
+    return habits_df, todos_df, notes_df
+
+
+def _pair_counts(df: pd.DataFrame, key: str, flag: str) -> Dict[str, List[int]]:
+    """按key分组统计 [总数, flag为真的数量]"""
+    if df.empty:
+        return {}
+    grouped = df.groupby(key, observed=True)[flag].agg(['count', 'sum'])
+    return {str(index): [int(row['count']), int(row['sum'])] for index, row in grouped.iterrows()}
+
+
+def compute_daily_aggregates(habits_df: pd.DataFrame, todos_df: pd.DataFrame, notes_df: pd.DataFrame,
+                             days: List[date]) -> Dict[date, Dict[str, Any]]:
+    """根据原始数据计算指定日期的按天聚合，没有数据的日期也返回空聚合"""
+    habits_df = habits_df.copy()
+    todos_df = todos_df.copy()
+    notes_df = notes_df.copy()
+
+    habits_df['day'] = habits_df['completion_date'].dt.date
+    habits_df['is_completed'] = habits_df['is_completed'].fillna(False).astype(bool)
+
+    todos_df['created_day'] = todos_df['created_at'].dt.date
+    todos_df['completed_day'] = todos_df['completed_at'].dt.date
+    todos_df['is_completed'] = todos_df['status'] == 'completed'
+
+    notes_df['created_day'] = notes_df['created_at'].dt.date
+    notes_df['updated_day'] = notes_df['updated_at'].dt.date
+
+    habits_by_day = dict(tuple(habits_df.groupby('day')))
+    todos_created_by_day = dict(tuple(todos_df.groupby('created_day')))
+    todos_completed_by_day = dict(tuple(todos_df[todos_df['is_completed']].groupby('completed_day')))
+    notes_created_by_day = dict(tuple(notes_df.groupby('created_day')))
+    notes_updated = notes_df[notes_df['created_day'] != notes_df['updated_day']]
+    notes_updated_by_day = dict(tuple(notes_updated.groupby('updated_day')))
+    todo_tags_by_day = tag_counts_by(todos_df, 'created_day')
+    note_tags_by_day = tag_counts_by(pd.concat([
+        notes_df[['created_day', 'tags']].rename(columns={'created_day': 'day'}),
+        notes_updated[['updated_day', 'tags']].rename(columns={'updated_day': 'day'})
+    ], ignore_index=True), 'day')
+
+    empty = pd.DataFrame()
+    aggregates = {}
+    for day in days:
+        habits = habits_by_day.get(day, empty)
+        created = todos_created_by_day.get(day, empty)
+        completed = todos_completed_by_day.get(day, empty)
+        notes_created = notes_created_by_day.get(day, empty)
+        notes_updated_day = notes_updated_by_day.get(day, empty)
+
+        priorities = {}
+        if not created.empty:
+            for priority, count in created.groupby('priority', observed=True).size().items():
+                priorities.setdefault(str(priority), [0, 0])[0] = int(count)
+        if not completed.empty:
+            for priority, count in completed.groupby('priority', observed=True).size().items():
+                priorities.setdefault(str(priority), [0, 0])[1] = int(count)
+
+        aggregates[day] = {
+            "habits": {
+                "total": len(habits),
+                "completed": int(habits['is_completed'].sum()) if not habits.empty else 0,
+                "categories": _pair_counts(habits, 'category', 'is_completed'),
+                "habits": _pair_counts(habits, 'name', 'is_completed')
+            },
+            "todos": {
+                "created": len(created),
+                "completed": len(completed),
+                "priorities": priorities,
+                "tags": todo_tags_by_day.get(day, {})
+            },
+            "notes": {
+                "created": len(notes_created),
+                "updated": len(notes_updated_day),
+                "tags": note_tags_by_day.get(day, {})
+            }
+        }
+    return aggregates
+
+
+def load_daily_aggregates(start_date: date, end_date: date) -> Dict[date, Dict[str, Any]]:
+    """
+    读取已存储的按天聚合
+
+    只返回在当天结束（配置时区的次日零点）之后计算的聚合，更早计算的聚合可能缺少当天后来的数据，
+    视为不存在，由调用方重新计算。
+    """
+    ensure_aggregates_table()
+    with db.get_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute("""
+            SELECT summary_date, habits, todos, notes
+            FROM summary_daily_aggregates
+            WHERE summary_date BETWEEN %(start_date)s AND %(end_date)s
+            AND updated_at >= (summary_date + 1)::timestamp AT TIME ZONE %(tz)s
+            """, {"start_date": start_date, "end_date": end_date, "tz": config.timezone})
+            return {
+                row['summary_date']: {"habits": row['habits'], "todos": row['todos'], "notes": row['notes']}
+                for row in cursor.fetchall()
+            }
+
+
+def save_daily_aggregates(aggregates: Dict[date, Dict[str, Any]]) -> None:
+    """批量写入按天聚合，已存在的日期会被覆盖；还没有结束的日期（今天及以后）不写入"""
+    today = get_today().date()
+    aggregates = {day: aggregate for day, aggregate in aggregates.items() if day < today}
+    if not aggregates:
+        return
+    ensure_aggregates_table()
+    rows = [
+        (day, Json(aggregate["habits"]), Json(aggregate["todos"]), Json(aggregate["notes"]))
+        for day, aggregate in aggregates.items()
+    ]
+    with db.get_connection() as conn:
+        with conn.cursor() as cursor:
+            execute_values(cursor, """
+            INSERT INTO summary_daily_aggregates (summary_date, habits, todos, notes)
+            VALUES %s
+            ON CONFLICT (summary_date) DO UPDATE SET
+                habits = EXCLUDED.habits,
+                todos = EXCLUDED.todos,
+                notes = EXCLUDED.notes,
+                updated_at = CURRENT_TIMESTAMP
+            """, rows)
+            conn.commit()
+
+
+def get_daily_aggregates(start_date: date, end_date: date) -> Dict[date, Dict[str, Any]]:
+    """
+    获取日期范围内每天的聚合
+
+    已存储且完整的日期直接读取，缺失或不完整的日期以及还没有结束的日期（今天及以后）
+    用一次范围查询重新计算。只有已经结束的日期会写回，今天的部分数据不会被存储和复用。
+    """
+    all_days = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+    today = get_today().date()
+    stored = load_daily_aggregates(start_date, end_date)
+    stale_days = [day for day in all_days if day not in stored or day >= today]
+
+    if stale_days:
+        habits_df, todos_df, notes_df = load_window_data(min(stale_days), max(stale_days))
+        fresh = compute_daily_aggregates(habits_df, todos_df, notes_df, stale_days)
+        save_daily_aggregates(fresh)
+        stored.update(fresh)
+        logger.info(f"重新计算了 {len(stale_days)} 天的摘要聚合，复用已存储的 {len(all_days) - len(stale_days)} 天")
+
+    return {day: stored[day] for day in all_days}
+
+
+def _merge_pairs(target: Dict[str, List[int]], source: Dict[str, List[int]]) -> None:
+    for key, (total, flagged) in source.items():
+        pair = target.setdefault(key, [0, 0])
+        pair[0] += total
+        pair[1] += flagged
+
+
+def _merge_counts(target: Dict[str, int], source: Dict[str, int]) -> None:
+    for key, count in source.items():
+        target[key] = target.get(key, 0) + count
+
+
+def _sorted_counts(counts: Dict[str, int]) -> Dict[str, int]:
+    return dict(sorted(counts.items(), key=lambda item: item[1], reverse=True))
+
+
+def _rate_table(pairs: Dict[str, List[int]]) -> Dict[str, Dict[str, Any]]:
+    return {
+        key: {"total": total, "completed": completed,
+              "completion_rate": completed / total * 100 if total else 0}
+        for key, (total, completed) in sorted(pairs.items())
+    }
+
+
+def merge_daily_aggregates(aggregates: Dict[date, Dict[str, Any]]) -> Dict[str, Any]:
+    """把按天聚合合并为与周报摘要结构一致的习惯、待办事项和笔记分析"""
+    habit_total = habit_completed = 0
+    categories, habits = {}, {}
+    daily_completion = {}
+    todos_created = todos_completed = 0
+    priorities, todo_tags = {}, {}
+    daily_created, daily_completed = {}, {}
+    notes_created = notes_updated = 0
+    note_tags = {}
+    notes_daily_created, notes_daily_updated = {}, {}
+
+    for day in sorted(aggregates):
+        aggregate = aggregates[day]
+        day_key = day.isoformat()
+        day_habits, day_todos, day_notes = aggregate["habits"], aggregate["todos"], aggregate["notes"]
+
+        habit_total += day_habits["total"]
+        habit_completed += day_habits["completed"]
+        _merge_pairs(categories, day_habits["categories"])
+        _merge_pairs(habits, day_habits["habits"])
+        if day_habits["total"]:
+            daily_completion[day_key] = {
+                "total": day_habits["total"],
+                "completed": day_habits["completed"],
+                "completion_rate": day_habits["completed"] / day_habits["total"] * 100
+            }
+
+        todos_created += day_todos["created"]
+        todos_completed += day_todos["completed"]
+        _merge_pairs(priorities, day_todos["priorities"])
+        _merge_counts(todo_tags, day_todos["tags"])
+        if day_todos["created"]:
+            daily_created[day_key] = day_todos["created"]
+        if day_todos["completed"]:
+            daily_completed[day_key] = day_todos["completed"]
+
+        notes_created += day_notes["created"]
+        notes_updated += day_notes["updated"]
+        _merge_counts(note_tags, day_notes["tags"])
+        if day_notes["created"]:
+            notes_daily_created[day_key] = day_notes["created"]
+        if day_notes["updated"]:
+            notes_daily_updated[day_key] = day_notes["updated"]
+
+    if habit_total:
+        habits_analysis = {
+            "total_habits": len(habits),
+            "total_completions": habit_total,
+            "average_completion_rate": habit_completed / habit_total * 100,
+            "daily_completion": daily_completion,
+            "category_stats": _rate_table(categories),
+            "habit_stats": _rate_table(habits)
+        }
+    else:
+        habits_analysis = {"message": "本周期没有习惯数据记录"}
+
+    if todos_created or todos_completed:
+        todos_analysis = {
+            "total_todos": todos_created,
+            "new_todos": todos_created,
+            "completed_todos": todos_completed,
+            "completion_rate": min(todos_completed / todos_created * 100, 100) if todos_created else 100,
+            "daily_created": daily_created,
+            "daily_completed": daily_completed,
+            "priority_stats": _rate_table(priorities),
+            "common_tags": _sorted_counts(todo_tags)
+        }
+    else:
+        todos_analysis = {"message": "本周期没有待办事项数据记录"}
+
+    if notes_created or notes_updated:
+        notes_analysis = {
+            "total_notes": notes_created + notes_updated,
+            "new_notes": notes_created,
+            "updated_notes": notes_updated,
+            "daily_created": notes_daily_created,
+            "daily_updated": notes_daily_updated,
+            "common_tags": _sorted_counts(note_tags)
+        }
+    else:
+        notes_analysis = {"message": "本周期没有笔记数据记录"}
+
+    return {"habits": habits_analysis, "todos": todos_analysis, "notes": notes_analysis}
+
+
+def generate_rolling_summary(days: int = 7, label: str = 'weekly') -> Dict[str, Any]:
+    """
+    基于按天聚合生成滚动窗口摘要
+
+    参数:
+        days: 窗口天数，日期范围与generate_weekly_summary一致
+        label: 摘要名称，用于日志和输出文件名，如 weekly / monthly / quarterly
+    """
+    date_range = get_date_range(days)
+    start_date = date_range["start_date"].date()
+    end_date = date_range["end_date"].date()
+    start_date_str = start_date.strftime('%Y-%m-%d')
+    end_date_str = end_date.strftime('%Y-%m-%d')
+
+    logger.info(f"开始基于按天聚合生成 {start_date_str} 至 {end_date_str} 的{label}摘要...")
+
+    analysis = merge_daily_aggregates(get_daily_aggregates(start_date, end_date))
+    summary = {
+        "period": {
+            "start_date": start_date_str,
+            "end_date": end_date_str,
+            "days": days
+        },
+        **analysis,
+        "overall": {
+            "productivity_score": calculate_weekly_productivity_score(analysis["habits"], analysis["todos"])
+        }
+    }
+
+    save_summary_to_json(summary, f"{label}_summary_{start_date_str}_{end_date_str}.json")
+
+    logger.info(f"完成 {start_date_str} 至 {end_date_str} 的{label}摘要生成")
+    return summary
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+标签频次分析
+
+待办事项和笔记的tags列每行是一个标签列表。这里统一用 explode + value_counts
+和分类编码完成标签计数、标签共现矩阵和每天的热门标签统计，
+全程使用pandas/NumPy向量化操作，不在Python中逐行拼接列表。
+"""
+from typing import Dict, Hashable, Optional
+
+import numpy as np
+import pandas as pd
+
+
+def explode_tags(df: pd.DataFrame, tags_column: str = 'tags') -> pd.DataFrame:
+    """
+    把标签列表展开为每个标签一行，保留原DataFrame的索引和其他列
+
+    只展开值为列表、元组或数组的行，空值、空列表和其他类型的值会被忽略。
+    """
+    if df.empty or tags_column not in df.columns:
+        return df.iloc[0:0]
+    # 展开前按原值的类型筛选：空值和字符串等标量不展开，空列表展开后为空值再去掉
+    tagged = df[df[tags_column].map(pd.api.types.is_list_like).astype(bool)]
+    exploded = tagged.explode(tags_column)
+    return exploded[exploded[tags_column].notna()]
+
+
+def tag_counts(tags: pd.Series) -> Dict[str, int]:
+    """统计标签出现次数，按次数降序返回 {标签: 次数}"""
+    exploded = explode_tags(tags.to_frame('tags'))['tags']
+    return {str(tag): int(count) for tag, count in exploded.value_counts().items()}
+
+
+def tag_counts_by(df: pd.DataFrame, key: str, tags_column: str = 'tags') -> Dict[Hashable, Dict[str, int]]:
+    """按key分组统计标签出现次数，返回 {key: {标签: 次数}}，每组内按次数降序"""
+    exploded = explode_tags(df[[key, tags_column]], tags_column)
+    if exploded.empty:
+        return {}
+    counts = exploded.groupby([key, tags_column], observed=True).size().sort_values(ascending=False, kind='stable')
+    result = {}
+    for group, sub in counts.groupby(level=0, sort=False, observed=True):
+        result[group] = {str(tag): int(count) for tag, count in sub.droplevel(0).items()}
+    return result
+
+
+def tag_cooccurrence(tags: pd.Series, top_n: Optional[int] = 50) -> pd.DataFrame:
+    """
+    计算标签共现矩阵，矩阵[a][b]为同时带有标签a和b的行数，对角线为标签自身出现的行数
+
+    参数:
+        tags: 每行为标签列表的Series
+        top_n: 只统计出现次数最多的前N个标签，None表示全部标签
+    """
+    exploded = explode_tags(tags.to_frame('tags'))['tags'].astype(str)
+    if exploded.empty:
+        return pd.DataFrame(dtype=int)
+
+    labels = exploded.value_counts().index
+    if top_n is not None:
+        labels = labels[:top_n]
+
+    # 用 (行号, 标签编码) 表示每个标签，同一行中重复的标签只计一次
+    pairs = pd.DataFrame({
+        'row': pd.factorize(exploded.index)[0],
+        'code': pd.Categorical(exploded, categories=labels).codes
+    })
+    pairs = pairs[pairs['code'] >= 0].drop_duplicates()
+
+    # 同一行内的标签两两配对，按编码对计数得到共现矩阵
+    joined = pairs.merge(pairs, on='row')
+    n = len(labels)
+    flat = joined['code_x'].to_numpy(dtype=np.int64) * n + joined['code_y'].to_numpy(dtype=np.int64)
+    matrix = np.bincount(flat, minlength=n * n).reshape(n, n)
+    return pd.DataFrame(matrix, index=labels, columns=labels)
+
+
+def top_tags_per_day(df: pd.DataFrame, date_column: str, k: int = 5,
+                     tags_column: str = 'tags') -> Dict[str, Dict[str, int]]:
+    """
+    统计每天出现次数最多的前k个标签，date_column 需为datetime类型的列
+
+    返回:
+        {YYYY-MM-DD: {标签: 次数}}，日期升序，每天内按次数降序
+    """
+    exploded = explode_tags(df[[date_column, tags_column]], tags_column)
+    if exploded.empty:
+        return {}
+    days = exploded[date_column].dt.strftime('%Y-%m-%d')
+    counts = (
+        pd.DataFrame({'day': days, 'tag': exploded[tags_column].astype(str)})
+        .groupby(['day', 'tag']).size()
+        .rename('count').reset_index()
+        .sort_values(['day', 'count', 'tag'], ascending=[True, False, True])
+    )
+    top = counts.groupby('day', sort=False).head(k)
+    result: Dict[str, Dict[str, int]] = {}
+    for day, tag, count in top.itertuples(index=False):
+        result.setdefault(day, {})[tag] = int(count)
+    return result
@@ -0,0 +1,114 @@
+from datetime import date
+
+import pandas as pd
+
+from activity_cube import METRICS, ActivityCube, daily_from_details
+from db import COLUMN_TYPES, apply_column_types
+
+START = date(2024, 1, 1)
+END = date(2024, 1, 3)
+
+
+def source_frames():
+    """与各聚合查询返回的结果一致：每个数据源一张 (user_id, day, 指标...) 表"""
+    habits = pd.DataFrame({
+        'user_id': ['u1', 'u1', 'u2'],
+        'day': [date(2024, 1, 1), date(2024, 1, 2), date(2024, 1, 1)],
+        'habits_total': [2, 1, 3],
+        'habits_completed': [1, 1, 3]
+    })
+    todos = pd.DataFrame({
+        'user_id': ['u1', 'u2'],
+        'day': [date(2024, 1, 1), date(2024, 1, 3)],
+        'todos_created': [2, 1],
+        'todos_completed': [1, 0]
+    })
+    # 笔记只在一天有更新，番茄钟没有数据
+    notes = pd.DataFrame({
+        'user_id': ['u2'],
+        'day': [date(2024, 1, 2)],
+        'notes_created': [0],
+        'notes_updated': [1]
+    })
+    pomodoros = pd.DataFrame(columns=['user_id', 'day'] + METRICS[-4:])
+    return [habits, todos, notes, pomodoros]
+
+
+def test_from_frames_merges_sources():
+    cube = ActivityCube.from_frames(source_frames(), START, END)
+
+    assert list(cube.frame.columns) == METRICS
+    assert cube.frame.index.names == ['user_id', 'day']
+    assert (cube.frame.dtypes == 'int64').all()
+    assert sorted(cube.users()) == ['u1', 'u2']
+    # 只有一个数据源有记录的单元，其他指标为0
+    assert cube.frame.loc[('u2', date(2024, 1, 3))].to_dict() == dict.fromkeys(METRICS, 0) | {'todos_created': 1}
+    assert cube.totals()['habits_total'] == 6
+    assert cube.totals()['focus_minutes'] == 0
+
+
+def test_from_frames_without_data():
+    cube = ActivityCube.from_frames([pd.DataFrame(), pd.DataFrame()], START, END)
+
+    assert cube.frame.empty
+    assert cube.users() == []
+    assert cube.by_day()['habits_total'].tolist() == [0, 0, 0]
+
+
+def test_slice_by_user_and_days():
+    cube = ActivityCube.from_frames(source_frames(), START, END)
+
+    sliced = cube.slice(users=['u1'], start_date=date(2024, 1, 2))
+    assert sliced.start_date == date(2024, 1, 2)
+    assert sliced.end_date == END
+    assert sliced.users() == ['u1']
+    assert sliced.totals()['habits_total'] == 1
+    assert sliced.totals()['todos_created'] == 0
+    # 切片后按天汇总只覆盖切片的日期
+    assert sliced.by_day().index.tolist() == [date(2024, 1, 2), date(2024, 1, 3)]
+    assert cube.covers(date(2024, 1, 2), END)
+    assert not sliced.covers(START, END)
+
+
+def test_user_days_fills_missing_days():
+    cube = ActivityCube.from_frames(source_frames(), START, END)
+
+    assert cube.user_days('u1')['habits_total'].tolist() == [2, 1, 0]
+    assert cube.user_days('unknown')['habits_total'].tolist() == [0, 0, 0]
+
+
+def test_daily_breakdown_only_includes_days_with_records():
+    breakdown = ActivityCube.from_frames(source_frames(), START, END).daily_breakdown()
+
+    assert breakdown['habits']['daily_completion'] == {
+        '2024-01-01': {'total': 5, 'completed': 4, 'completion_rate': 80.0},
+        '2024-01-02': {'total': 1, 'completed': 1, 'completion_rate': 100.0}
+    }
+    assert breakdown['todos'] == {
+        'daily_created': {'2024-01-01': 2, '2024-01-03': 1},
+        'daily_completed': {'2024-01-01': 1}
+    }
+    assert breakdown['notes'] == {'daily_created': {}, 'daily_updated': {'2024-01-02': 1}}
+
+
+def test_daily_from_details_matches_by_day():
+    habits = apply_column_types(pd.DataFrame({
+        'completion_date': [date(2024, 1, 1), date(2024, 1, 1), date(2024, 1, 2)],
+        'is_completed': [True, None, True]
+    }), **COLUMN_TYPES['habits'])
+    todos = apply_column_types(pd.DataFrame({
+        'status': ['completed', 'pending'],
+        'created_at': [pd.Timestamp('2024-01-01 23:30', tz='Asia/Shanghai'),
+                       pd.Timestamp('2024-01-03 08:00', tz='Asia/Shanghai')],
+        'completed_at': [pd.Timestamp('2024-01-02 00:30', tz='Asia/Shanghai'), None]
+    }), **COLUMN_TYPES['todos'])
+
+    daily = daily_from_details(habits, todos, START, END)
+
+    assert list(daily.columns) == METRICS
+    assert daily.index.tolist() == [date(2024, 1, 1), date(2024, 1, 2), date(2024, 1, 3)]
+    assert daily['habits_total'].tolist() == [2, 1, 0]
+    assert daily['habits_completed'].tolist() == [1, 1, 0]
+    assert daily['todos_created'].tolist() == [1, 0, 1]
+    assert daily['todos_completed'].tolist() == [0, 1, 0]
+    assert daily['notes_created'].sum() == 0
@@ -0,0 +1,86 @@
+from datetime import date
+
+import pandas as pd
+
+from backfill import _take, backfill_summary_day, index_by_day
+from db import COLUMN_TYPES, apply_column_types
+
+
+def typed_habits() -> pd.DataFrame:
+    """与 query_to_dataframe 返回的习惯数据一致：completion_date 按 COLUMN_TYPES 解析为带时区的时间戳"""
+    df = pd.DataFrame({
+        'id': [1, 2, 1],
+        'name': ['阅读', '跑步', '阅读'],
+        'description': ['', '', ''],
+        'category': ['学习', '运动', '学习'],
+        'completion_date': [date(2024, 1, 1), date(2024, 1, 1), date(2024, 1, 2)],
+        'is_completed': [True, False, True]
+    })
+    return apply_column_types(df, **COLUMN_TYPES['habits'])
+
+
+def typed_todos() -> pd.DataFrame:
+    df = pd.DataFrame({
+        'id': [10, 11],
+        'title': ['写报告', '买菜'],
+        'description': ['', ''],
+        'status': ['completed', 'pending'],
+        'due_date': [None, None],
+        'completed_at': [pd.Timestamp('2024-01-02 09:00', tz='Asia/Shanghai'), None],
+        'priority': ['high', 'low'],
+        'created_at': [pd.Timestamp('2024-01-01 08:00', tz='Asia/Shanghai'),
+                       pd.Timestamp('2024-01-02 10:00', tz='Asia/Shanghai')],
+        'updated_at': [pd.Timestamp('2024-01-02 09:00', tz='Asia/Shanghai'),
+                       pd.Timestamp('2024-01-02 10:00', tz='Asia/Shanghai')],
+        'tags': [['工作'], None],
+        'created_date': [date(2024, 1, 1), date(2024, 1, 2)],
+        'completed_date': [date(2024, 1, 2), None]
+    })
+    return apply_column_types(df, **COLUMN_TYPES['todos'])
+
+
+def test_typed_completion_date_is_parsed():
+    assert isinstance(typed_habits()['completion_date'].dtype, pd.DatetimeTZDtype)
+
+
+def test_index_by_day_keys_are_dates():
+    index = index_by_day(typed_habits(), ['completion_date'])
+    assert set(index) == {date(2024, 1, 1), date(2024, 1, 2)}
+    assert all(type(day) is date for day in index)
+
+
+def test_take_splits_typed_frame_by_date():
+    habits = typed_habits()
+    index = index_by_day(habits, ['completion_date'])
+
+    first = _take(habits, index, date(2024, 1, 1))
+    second = _take(habits, index, date(2024, 1, 2))
+    assert first['name'].tolist() == ['阅读', '跑步']
+    assert second['name'].tolist() == ['阅读']
+    assert _take(habits, index, date(2024, 1, 3)).empty
+
+
+def test_index_by_day_matches_any_date_column():
+    todos = typed_todos()
+    index = index_by_day(todos, ['created_date', 'completed_date'])
+    assert _take(todos, index, date(2024, 1, 1))['id'].tolist() == [10]
+    assert sorted(_take(todos, index, date(2024, 1, 2))['id'].tolist()) == [10, 11]
+
+
+def test_backfill_summary_day_uses_split_rows(tmp_path, monkeypatch):
+    # 每日摘要会写入当前目录下的output
+    monkeypatch.chdir(tmp_path)
+    habits = typed_habits()
+    todos = typed_todos()
+    notes = pd.DataFrame(columns=['id', 'title', 'tags', 'created_at', 'updated_at',
+                                  'created_date', 'updated_date'])
+    data = {
+        "habits": habits,
+        "todos": todos,
+        "notes": notes,
+        "habits_index": index_by_day(habits, ['completion_date']),
+        "todos_index": index_by_day(todos, ['created_date', 'completed_date']),
+        "notes_index": index_by_day(notes, ['created_date', 'updated_date'])
+    }
+    # 有习惯数据时得分不再是没有数据时的默认值50
+    assert backfill_summary_day(data, date(2024, 1, 2))["productivity_score"] != 50.0
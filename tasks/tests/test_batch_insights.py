@@ -0,0 +1,151 @@
+import json
+from contextlib import contextmanager
+from datetime import datetime
+from types import SimpleNamespace
+
+import daily_insight
+from ai_service import ai_service
+from daily_insight import apply_ai_content, batch_custom_id, build_insight_data, save_ai_insights
+
+
+def jsonl(*items) -> str:
+    return "\n".join(json.dumps(item, ensure_ascii=False) for item in items) + "\n"
+
+
+def response_line(custom_id: str, status_code: int, body: dict) -> dict:
+    return {"custom_id": custom_id, "response": {"status_code": status_code, "body": body}, "error": None}
+
+
+def fake_files(monkeypatch, contents: dict) -> None:
+    """用内存中的结果文件代替 client.files.content"""
+    files = SimpleNamespace(content=lambda file_id: SimpleNamespace(text=contents[file_id]))
+    monkeypatch.setattr(ai_service, "client", SimpleNamespace(files=files))
+
+
+def test_fetch_batch_results_parses_success_and_errors(monkeypatch):
+    fake_files(monkeypatch, {
+        "out": jsonl(
+            response_line("ok", 200, {"model": "model-a", "choices": [{"message": {"content": "  报告  "}}]}),
+            response_line("empty", 200, {"model": "model-b", "choices": [{"message": {"content": None}}]}),
+            response_line("rejected", 400, {"error": {"message": "bad request"}})
+        ) + "\n",
+        "err": jsonl(
+            {"custom_id": "expired", "response": None, "error": {"code": "batch_expired"}},
+            response_line("server", 500, {})
+        )
+    })
+
+    results = ai_service.fetch_batch_results(SimpleNamespace(output_file_id="out", error_file_id="err"))
+
+    assert results["ok"] == {"success": True, "content": "报告", "model": "model-a"}
+    assert results["empty"] == {"success": True, "content": "AI未能生成有效内容", "model": "model-b"}
+    assert results["rejected"] == {"success": False, "error": str({"message": "bad request"})}
+    assert results["expired"] == {"success": False, "error": str({"code": "batch_expired"})}
+    assert results["server"] == {"success": False, "error": "HTTP 500"}
+
+
+def test_fetch_batch_results_without_files(monkeypatch):
+    fake_files(monkeypatch, {})
+
+    assert ai_service.fetch_batch_results(SimpleNamespace(output_file_id=None, error_file_id=None)) == {}
+
+
+class FakeCursor:
+    def __init__(self, existing):
+        self.existing = existing
+        self.executed = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params):
+        self.executed.append(params)
+
+    def fetchall(self):
+        return self.existing
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.commits = 0
+
+    def cursor(self):
+        return self._cursor
+
+    def commit(self):
+        self.commits += 1
+
+
+def fake_db(monkeypatch, existing):
+    """代替数据库连接，记录 execute_values 写入的行"""
+    cursor = FakeCursor(existing)
+    conn = FakeConnection(cursor)
+    writes = []
+
+    @contextmanager
+    def get_connection():
+        yield conn
+
+    monkeypatch.setattr(daily_insight.db, "get_connection", get_connection)
+    monkeypatch.setattr(daily_insight, "execute_values",
+                        lambda cur, query, rows, **kwargs: writes.append((query.split()[0], rows)))
+    return cursor, conn, writes
+
+
+def insight(user_id: str) -> dict:
+    return apply_ai_content(build_insight_data(user_id, datetime(2024, 1, 1)), f"{user_id} 的报告")
+
+
+def test_save_ai_insights_splits_updates_and_inserts(monkeypatch):
+    cursor, conn, writes = fake_db(monkeypatch, [(7, "u1", "2024-01-01")])
+
+    counts = save_ai_insights([insight("u1"), insight("u2")])
+
+    assert counts == {"created": 1, "updated": 1}
+    # 一次查询已有记录，更新和插入各一次批量写入，在同一个事务中提交
+    assert cursor.executed == [{"keys": (("u1", "2024-01-01"), ("u2", "2024-01-01"))}]
+    assert [kind for kind, _ in writes] == ["UPDATE", "INSERT"]
+    update_rows, insert_rows = writes[0][1], writes[1][1]
+    assert [row[0] for row in update_rows] == [7]
+    assert update_rows[0][2] == "u1 的报告"
+    assert [row[0] for row in insert_rows] == ["u2"]
+    assert insert_rows[0][1] == "daily_summary"
+    assert conn.commits == 1
+
+
+def test_save_ai_insights_only_inserts_new(monkeypatch):
+    _, _, writes = fake_db(monkeypatch, [])
+
+    assert save_ai_insights([insight("u1")]) == {"created": 1, "updated": 0}
+    assert [kind for kind, _ in writes] == ["INSERT"]
+
+
+def test_save_ai_insights_without_insights(monkeypatch):
+    cursor, _, writes = fake_db(monkeypatch, [])
+
+    assert save_ai_insights([]) == {"created": 0, "updated": 0}
+    assert cursor.executed == []
+    assert writes == []
+
+
+def test_ingest_insight_batch_saves_only_successes(monkeypatch):
+    batch = SimpleNamespace(status="completed")
+    monkeypatch.setattr(ai_service, "wait_for_batch", lambda batch_id, poll_interval, timeout: batch)
+    monkeypatch.setattr(ai_service, "fetch_batch_results", lambda result_batch: {
+        batch_custom_id("u1", "2024-01-01"): {"success": True, "content": "报告", "model": "model-a"},
+        batch_custom_id("u2", "2024-01-01"): {"success": False, "error": "HTTP 500"}
+    })
+    saved = []
+    monkeypatch.setattr(daily_insight, "save_ai_insights", saved.extend)
+
+    results = daily_insight.ingest_insight_batch("batch-1")
+
+    assert results == {"u1": {"success": True, "operation": "batch"},
+                       "u2": {"success": False, "error": "HTTP 500"}}
+    assert [item["user_id"] for item in saved] == ["u1"]
+    assert saved[0]["content"] == "报告"
+    assert saved[0]["metadata"]["date"] == "2024-01-01"
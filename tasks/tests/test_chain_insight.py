@@ -0,0 +1,130 @@
+from datetime import datetime
+
+import pytest
+
+import daily_insight
+from ai_service import MERGE_SYSTEM_PROMPT, SECTION_SYSTEM_PROMPTS, ai_service
+from daily_insight import create_chain_insight_for_user, section_hash
+
+DATE = datetime(2024, 1, 1)
+
+
+def analysis_data(completed_todos: int = 2) -> dict:
+    # 番茄钟和笔记当天没有记录，不生成这两部分
+    return {
+        "overall": {"date": "2024-01-01"},
+        "habits": {"total_habits": 3, "completed_habits": 2},
+        "todos": {"total_todos": 4, "completed_todos": completed_todos},
+        "pomodoros": {"message": "当天没有番茄钟记录"},
+        "notes": {}
+    }
+
+
+@pytest.fixture
+def chain(monkeypatch):
+    """记录每次模型调用的部分名称和保存的洞察，previous 为上次运行保存的链式结果"""
+    state = {"calls": [], "saved": [], "previous": {}, "reply": "分析"}
+
+    def complete(messages, max_tokens=None):
+        system = messages[0]["content"]
+        if system == MERGE_SYSTEM_PROMPT:
+            state["calls"].append("merge")
+            return "整合报告"
+        section = next(name for name, prompt in SECTION_SYSTEM_PROMPTS.items() if system.startswith(prompt))
+        state["calls"].append(section)
+        return f"{section} {state['reply']}"
+
+    def save(insight_data, date):
+        state["saved"].append(insight_data)
+        return {"success": True, "operation": "created"}
+
+    monkeypatch.setattr(ai_service, "complete", complete)
+    monkeypatch.setattr(daily_insight, "get_previous_chain_result", lambda user_id, date: state["previous"])
+    monkeypatch.setattr(daily_insight, "save_ai_insight", save)
+    return state
+
+
+def saved_chain(state: dict) -> dict:
+    """把上次保存的洞察转换为 get_previous_chain_result 的返回值"""
+    insight = state["saved"][-1]
+    return {**insight["metadata"]["chain"], "report": insight["content"]}
+
+
+def test_first_run_generates_sections_and_merge(chain):
+    result = create_chain_insight_for_user("u1", analysis_data(), DATE)
+
+    assert result["success"]
+    assert sorted(chain["calls"]) == ["habits", "merge", "todos"]
+    insight = chain["saved"][0]
+    assert insight["content"] == "整合报告"
+    sections = insight["metadata"]["chain"]["sections"]
+    assert sections == {
+        "habits": {"hash": section_hash(analysis_data()["habits"]), "content": "habits 分析"},
+        "todos": {"hash": section_hash(analysis_data()["todos"]), "content": "todos 分析"}
+    }
+
+
+def test_unchanged_data_reuses_sections_and_report(chain):
+    create_chain_insight_for_user("u1", analysis_data(), DATE)
+    chain["previous"] = saved_chain(chain)
+    chain["calls"].clear()
+
+    result = create_chain_insight_for_user("u1", analysis_data(), DATE)
+
+    assert result["success"]
+    assert chain["calls"] == []
+    assert chain["saved"][-1]["content"] == "整合报告"
+    assert chain["saved"][-1]["metadata"]["chain"] == chain["saved"][0]["metadata"]["chain"]
+
+
+def test_changed_section_is_regenerated(chain):
+    create_chain_insight_for_user("u1", analysis_data(), DATE)
+    previous = saved_chain(chain)
+    chain["previous"] = previous
+    chain["calls"].clear()
+    # 待办数据变化后生成的分析内容不同，整合提示随之变化
+    chain["reply"] = "新的分析"
+
+    create_chain_insight_for_user("u1", analysis_data(completed_todos=3), DATE)
+
+    assert chain["calls"] == ["todos", "merge"]
+    sections = chain["saved"][-1]["metadata"]["chain"]["sections"]
+    assert sections["habits"] == previous["sections"]["habits"]
+    assert sections["todos"] == {"hash": section_hash(analysis_data(completed_todos=3)["todos"]),
+                                 "content": "todos 新的分析"}
+
+
+def test_same_reports_skip_merge(chain):
+    create_chain_insight_for_user("u1", analysis_data(), DATE)
+    previous = saved_chain(chain)
+    # 待办部分的摘要与上次不一致需要重新生成，但生成的分析内容相同，整合提示不变，复用上次的报告
+    previous["sections"]["todos"]["hash"] = "stale"
+    chain["previous"] = previous
+    chain["calls"].clear()
+
+    create_chain_insight_for_user("u1", analysis_data(), DATE)
+
+    assert chain["calls"] == ["todos"]
+    assert chain["saved"][-1]["content"] == "整合报告"
+
+
+def test_force_regenerates_everything(chain):
+    create_chain_insight_for_user("u1", analysis_data(), DATE)
+    chain["previous"] = saved_chain(chain)
+    chain["calls"].clear()
+
+    create_chain_insight_for_user("u1", analysis_data(), DATE, force=True)
+
+    assert sorted(chain["calls"]) == ["habits", "merge", "todos"]
+
+
+def test_failed_call_is_not_saved(chain, monkeypatch):
+    def fail(messages, max_tokens=None):
+        raise RuntimeError("timeout")
+
+    monkeypatch.setattr(ai_service, "complete", fail)
+
+    result = create_chain_insight_for_user("u1", analysis_data(), DATE)
+
+    assert result == {"success": False, "error": "链式分析调用失败: timeout"}
+    assert chain["saved"] == []
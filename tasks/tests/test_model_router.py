@@ -0,0 +1,40 @@
+import threading
+
+from model_router import ModelRouter
+
+
+def test_latency_per_1k_uses_prompt_tokens():
+    router = ModelRouter(["a", "b"], stats_path="", probe_rate=0)
+    router.record("a", 4.0, 4000, success=True)
+    # 完全按每千token延迟估算时，相同大小的提示应得到记录时的延迟
+    assert router.expected_latency("a", 4000) == 4.0
+    assert router.expected_latency("b", 4000) is None
+
+
+def test_choose_prefers_fastest_healthy_model():
+    router = ModelRouter(["a", "b"], stats_path="", probe_rate=0)
+    router.record("a", 3.0, 1000, success=True)
+    router.record("b", 1.0, 1000, success=True)
+    assert router.choose(1000) == "b"
+    for _ in range(3):
+        router.record("b", 1.0, 1000, success=False)
+    assert not router.is_healthy("b")
+    assert router.choose(1000) == "a"
+
+
+def test_concurrent_record_and_read():
+    router = ModelRouter(["a", "b"], stats_path="", probe_rate=0.5)
+
+    def worker():
+        for i in range(200):
+            model = router.choose(500 + i)
+            router.record(model, 0.5, 500 + i, success=i % 7 != 0)
+            router.is_healthy(model)
+            router.expected_latency(model, 500)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(stats["requests"] for stats in router.snapshot().values()) == 800
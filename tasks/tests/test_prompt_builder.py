@@ -0,0 +1,33 @@
+import json
+
+from prompt_builder import abbreviate_keys, build_compact_payload
+
+
+def test_abbreviates_schema_fields():
+    abbreviated, used = abbreviate_keys({"habits": {"total_habits": 3, "completion_rate": 50.0}})
+    assert abbreviated == {"habits": {"h_n": 3, "cr": 50.0}}
+    assert used == {"total_habits", "completion_rate"}
+
+
+def test_keeps_user_defined_keys_in_count_dicts():
+    data = {
+        "habits": {"category_stats": {"total": {"total": 2, "completed": 1, "completion_rate": 50.0}}},
+        "pomodoros": {"tag_stats": {"completed": 3, "total": 1}, "status_counts": {"completed": 2}},
+        "daily_summary": {"ai_feedback_actions": {"completed": ["阅读"]}}
+    }
+    abbreviated, _ = abbreviate_keys(data)
+    assert abbreviated["habits"]["by_cat"] == {"total": {"n": 2, "done": 1, "cr": 50.0}}
+    assert abbreviated["pomodoros"]["by_tag"] == {"completed": 3, "total": 1}
+    assert abbreviated["pomodoros"]["by_status"] == {"completed": 2}
+    assert abbreviated["daily_summary"]["ai_actions"] == {"completed": ["阅读"]}
+
+
+def test_compact_payload_legend_matches_used_keys():
+    text, stats = build_compact_payload({
+        "user_id": "u1",
+        "pomodoros": {"total_pomodoros": 2, "tag_stats": {"total": 2}}
+    }, budget=1000)
+    data, legend = text.split("\n")
+    assert json.loads(data) == {"pomodoros": {"p_n": 2, "by_tag": {"total": 2}}}
+    assert legend == "键名缩写: by_tag=tag_stats, p_n=total_pomodoros"
+    assert not stats["over_budget"]
@@ -0,0 +1,108 @@
+from datetime import date
+
+import pandas as pd
+
+from db import COLUMN_TYPES, apply_column_types
+from summary_aggregates import compute_daily_aggregates, merge_daily_aggregates
+
+DAY1 = date(2024, 1, 1)
+DAY2 = date(2024, 1, 2)
+DAY3 = date(2024, 1, 3)
+
+
+def ts(value: str) -> pd.Timestamp:
+    return pd.Timestamp(value, tz='Asia/Shanghai')
+
+
+def window_frames():
+    """与 load_window_data 返回的数据一致，按 COLUMN_TYPES 转换类型"""
+    habits = apply_column_types(pd.DataFrame({
+        'id': [1, 2, 1],
+        'name': ['阅读', '跑步', '阅读'],
+        'category': ['学习', '运动', '学习'],
+        'completion_date': [DAY1, DAY1, DAY2],
+        'is_completed': [True, None, True]
+    }), **COLUMN_TYPES['habits'])
+    todos = apply_column_types(pd.DataFrame({
+        'id': [10, 11, 12],
+        'status': ['completed', 'pending', 'completed'],
+        'completed_at': [ts('2024-01-02 09:00'), None, ts('2024-01-01 20:00')],
+        'priority': ['high', 'low', 'high'],
+        'created_at': [ts('2024-01-01 08:00'), ts('2024-01-02 10:00'), ts('2024-01-01 12:00')],
+        'tags': [['工作'], None, ['工作', '紧急']]
+    }), **COLUMN_TYPES['todos'])
+    notes = apply_column_types(pd.DataFrame({
+        'id': [20, 21],
+        'tags': [['日记'], []],
+        'created_at': [ts('2024-01-01 22:00'), ts('2024-01-02 07:00')],
+        'updated_at': [ts('2024-01-02 23:30'), ts('2024-01-02 08:00')]
+    }), **COLUMN_TYPES['notes'])
+    return habits, todos, notes
+
+
+def test_compute_daily_aggregates_counts_per_day():
+    aggregates = compute_daily_aggregates(*window_frames(), [DAY1, DAY2])
+
+    day1 = aggregates[DAY1]
+    assert day1['habits']['total'] == 2
+    # 空的完成状态按未完成计算
+    assert day1['habits']['completed'] == 1
+    assert day1['habits']['categories'] == {'学习': [1, 1], '运动': [1, 0]}
+    assert day1['todos']['created'] == 2
+    assert day1['todos']['completed'] == 1
+    assert day1['todos']['priorities'] == {'high': [2, 1]}
+    assert day1['todos']['tags'] == {'工作': 2, '紧急': 1}
+    assert day1['notes'] == {'created': 1, 'updated': 0, 'tags': {'日记': 1}}
+
+    day2 = aggregates[DAY2]
+    assert day2['habits']['habits'] == {'阅读': [1, 1]}
+    assert day2['todos']['created'] == 1
+    assert day2['todos']['completed'] == 1
+    assert day2['todos']['priorities'] == {'high': [0, 1], 'low': [1, 0]}
+    # 同一天创建并修改的笔记只算新建，前一天创建的笔记算作修改
+    assert day2['notes']['created'] == 1
+    assert day2['notes']['updated'] == 1
+    assert day2['notes']['tags'] == {'日记': 1}
+
+
+def test_compute_daily_aggregates_returns_empty_days():
+    aggregates = compute_daily_aggregates(*window_frames(), [DAY3])
+
+    assert aggregates[DAY3] == {
+        'habits': {'total': 0, 'completed': 0, 'categories': {}, 'habits': {}},
+        'todos': {'created': 0, 'completed': 0, 'priorities': {}, 'tags': {}},
+        'notes': {'created': 0, 'updated': 0, 'tags': {}}
+    }
+
+
+def test_merge_daily_aggregates_sums_days():
+    summary = merge_daily_aggregates(compute_daily_aggregates(*window_frames(), [DAY1, DAY2, DAY3]))
+
+    habits = summary['habits']
+    assert habits['total_habits'] == 2
+    assert habits['total_completions'] == 3
+    assert habits['average_completion_rate'] == 2 / 3 * 100
+    # 没有习惯记录的日期不出现在每日完成情况中
+    assert list(habits['daily_completion']) == ['2024-01-01', '2024-01-02']
+    assert habits['habit_stats']['阅读'] == {'total': 2, 'completed': 2, 'completion_rate': 100}
+
+    todos = summary['todos']
+    assert todos['new_todos'] == 3
+    assert todos['completed_todos'] == 2
+    assert todos['daily_created'] == {'2024-01-01': 2, '2024-01-02': 1}
+    assert todos['daily_completed'] == {'2024-01-01': 1, '2024-01-02': 1}
+    assert todos['priority_stats']['high'] == {'total': 2, 'completed': 2, 'completion_rate': 100}
+    assert list(todos['common_tags']) == ['工作', '紧急']
+
+    notes = summary['notes']
+    assert notes['new_notes'] == 2
+    assert notes['updated_notes'] == 1
+    assert notes['common_tags'] == {'日记': 2}
+
+
+def test_merge_daily_aggregates_without_data():
+    summary = merge_daily_aggregates(compute_daily_aggregates(*window_frames(), [DAY3]))
+
+    assert summary['habits'] == {"message": "本周期没有习惯数据记录"}
+    assert summary['todos'] == {"message": "本周期没有待办事项数据记录"}
+    assert summary['notes'] == {"message": "本周期没有笔记数据记录"}
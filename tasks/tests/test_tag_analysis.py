@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+
+from tag_analysis import explode_tags, tag_cooccurrence, tag_counts, top_tags_per_day
+
+
+def test_explode_tags_skips_missing_and_scalar_cells():
+    df = pd.DataFrame({
+        'id': [1, 2, 3, 4, 5, 6],
+        'tags': [['a', 'b'], None, [], 'abc', np.array(['c', 'a'], dtype=object), ('d',)]
+    })
+    exploded = explode_tags(df)
+    assert exploded['id'].tolist() == [1, 1, 5, 5, 6]
+    assert exploded['tags'].tolist() == ['a', 'b', 'c', 'a', 'd']
+
+
+def test_explode_tags_empty_frame():
+    assert explode_tags(pd.DataFrame({'tags': []})).empty
+    assert explode_tags(pd.DataFrame({'tags': [None, 'x']})).empty
+
+
+def test_tag_counts():
+    assert tag_counts(pd.Series([['a', 'b'], ['a'], None])) == {'a': 2, 'b': 1}
+
+
+def test_tag_cooccurrence():
+    tags = pd.Series([['a', 'b'], ['a', 'b', 'a'], ['a', 'c'], None, np.array(['b'], dtype=object)])
+    matrix = tag_cooccurrence(tags)
+    assert list(matrix.index) == ['a', 'b', 'c']
+    # 同一行中重复的标签只计一次
+    assert matrix.loc['a', 'a'] == 3
+    assert matrix.loc['a', 'b'] == matrix.loc['b', 'a'] == 2
+    assert matrix.loc['a', 'c'] == 1
+    assert matrix.loc['b', 'c'] == 0
+    assert matrix.loc['b', 'b'] == 3
+
+
+def test_tag_cooccurrence_top_n():
+    tags = pd.Series([['a', 'b'], ['a', 'c'], ['a', 'b']])
+    matrix = tag_cooccurrence(tags, top_n=2)
+    assert list(matrix.index) == ['a', 'b']
+    assert matrix.loc['a', 'b'] == 2
+
+
+def test_tag_cooccurrence_without_tags():
+    assert tag_cooccurrence(pd.Series([None, []], dtype=object)).empty
+
+
+def test_top_tags_per_day():
+    df = pd.DataFrame({
+        'created_at': pd.to_datetime(['2024-01-01 08:00', '2024-01-01 09:00', '2024-01-02 10:00']),
+        'tags': [['a', 'b'], ['a'], ['c']]
+    })
+    assert top_tags_per_day(df, 'created_at', k=1) == {'2024-01-01': {'a': 2}, '2024-01-02': {'c': 1}}
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按用户分组的数据摘要
+
+一次性查询时间窗口内所有用户的习惯、待办事项和笔记数据（每张表一次查询），
+再用 groupby(user_id, ...) 同时计算每个用户的分析结果，为每个用户单独输出摘要。
+相比逐个用户调用 generate_weekly_summary，查询次数与用户数量无关。
+
+每个用户的摘要结构与周报摘要一致，daily 模式即窗口只有昨天一天的周报。
+"""
+import argparse
+import logging
+import os
+from datetime import date
+from typing import Any, Dict, Optional
+
+import pandas as pd
+
+from config import config
+from db import COLUMN_TYPES, db
+from tag_analysis import tag_counts_by
+from utils import get_date_range, get_yesterday, save_summary_to_json
+from weekly_summary import calculate_weekly_productivity_score
+
+logger = logging.getLogger(__name__)
+
+
+def load_user_window_data(start_date: date, end_date: date) -> Dict[str, pd.DataFrame]:
+    """查询窗口内所有用户的习惯、待办事项和笔记数据，结果带 user_id 列"""
+    params = {"start_date": start_date, "end_date": end_date, "tz": config.timezone}
+    habits_df = db.query_to_dataframe("""
+    SELECT
+        h.user_id, h.id, h.name, h.category,
+        hc.completion_date, hc.is_completed
+    FROM habits h
+    JOIN habit_completions hc ON h.id = hc.habit_id
+    WHERE hc.completion_date BETWEEN %(start_date)s AND %(end_date)s
+    """, params, **COLUMN_TYPES['habits'])
+    todos_df = db.query_to_dataframe("""
+    SELECT
+        user_id, id, status, completed_at, priority, created_at, tags
+    FROM todos
+    WHERE ((created_at AT TIME ZONE %(tz)s)::date BETWEEN %(start_date)s AND %(end_date)s)
+       OR ((completed_at AT TIME ZONE %(tz)s)::date BETWEEN %(start_date)s AND %(end_date)s)
+    """, params, **COLUMN_TYPES['todos'])
+    notes_df = db.query_to_dataframe("""
+    SELECT
+        user_id, id, tags, created_at, updated_at
+    FROM notes
+    WHERE ((created_at AT TIME ZONE %(tz)s)::date BETWEEN %(start_date)s AND %(end_date)s)
+       OR ((updated_at AT TIME ZONE %(tz)s)::date BETWEEN %(start_date)s AND %(end_date)s)
+    """, params, **COLUMN_TYPES['notes'])
+    return {"habits": habits_df, "todos": todos_df, "notes": notes_df}
+
+
+def _split_by_user(frame, orient: Optional[str] = 'index') -> Dict[Any, Dict]:
+    """把以 (user_id, key) 为索引的分组结果拆成 {user_id: {key: ...}}"""
+    result = {}
+    if frame.empty:
+        return result
+    for user_id, sub in frame.groupby(level=0, sort=False, observed=True):
+        sub = sub.droplevel(0)
+        result[user_id] = sub.to_dict(orient=orient) if orient else sub.to_dict()
+    return result
+
+
+def _rate_stats(df: pd.DataFrame, key: str) -> Dict[Any, Dict]:
+    """按 (user_id, key) 统计总数、完成数和完成率"""
+    stats = df.groupby(['user_id', key], observed=True).agg(
+        total=('id', 'count'),
+        completed=('is_completed', 'sum')
+    )
+    stats['completion_rate'] = (stats['completed'] / stats['total']) * 100
+    return _split_by_user(stats)
+
+
+def analyze_user_habits(df: pd.DataFrame) -> Dict[Any, Dict[str, Any]]:
+    """分组计算所有用户的习惯分析"""
+    if df.empty:
+        return {}
+
+    # 日期转为字符串，保证按天统计的结果可以直接写入JSON
+    df = df.copy()
+    df['is_completed'] = df['is_completed'].fillna(False).astype(bool)
+    df['completion_day'] = df['completion_date'].dt.strftime('%Y-%m-%d')
+
+    totals = df.groupby('user_id', observed=True).agg(
+        total_habits=('name', 'nunique'),
+        total_completions=('id', 'count'),
+        average_completion_rate=('is_completed', 'mean')
+    )
+    daily = _rate_stats(df, 'completion_day')
+    categories = _rate_stats(df, 'category')
+    habits = _rate_stats(df, 'name')
+
+    return {
+        user_id: {
+            "total_habits": int(row['total_habits']),
+            "total_completions": int(row['total_completions']),
+            "average_completion_rate": row['average_completion_rate'] * 100,
+            "daily_completion": daily.get(user_id, {}),
+            "category_stats": categories.get(user_id, {}),
+            "habit_stats": habits.get(user_id, {})
+        }
+        for user_id, row in totals.iterrows()
+    }
+
+
+def analyze_user_todos(df: pd.DataFrame) -> Dict[Any, Dict[str, Any]]:
+    """分组计算所有用户的待办事项分析"""
+    if df.empty:
+        return {}
+
+    df = df.copy()
+    df['is_completed'] = df['status'] == 'completed'
+    df['created_date'] = df['created_at'].dt.strftime('%Y-%m-%d')
+    df['completed_date'] = df['completed_at'].dt.strftime('%Y-%m-%d')
+
+    totals = df.groupby('user_id', observed=True).agg(
+        total_todos=('id', 'count'),
+        new_todos=('created_date', 'count'),
+        completed_todos=('is_completed', 'sum')
+    )
+    daily_created = _split_by_user(df.groupby(['user_id', 'created_date'], observed=True).size(), orient=None)
+    daily_completed = _split_by_user(
+        df.dropna(subset=['completed_date']).groupby(['user_id', 'completed_date'], observed=True).size(), orient=None
+    )
+    priorities = _rate_stats(df, 'priority')
+    tags = tag_counts_by(df, 'user_id')
+
+    return {
+        user_id: {
+            "total_todos": int(row['total_todos']),
+            "new_todos": int(row['new_todos']),
+            "completed_todos": int(row['completed_todos']),
+            "completion_rate": row['completed_todos'] / row['total_todos'] * 100,
+            "daily_created": daily_created.get(user_id, {}),
+            "daily_completed": daily_completed.get(user_id, {}),
+            "priority_stats": priorities.get(user_id, {}),
+            "common_tags": tags.get(user_id, {})
+        }
+        for user_id, row in totals.iterrows()
+    }
+
+
+def analyze_user_notes(df: pd.DataFrame) -> Dict[Any, Dict[str, Any]]:
+    """分组计算所有用户的笔记分析"""
+    if df.empty:
+        return {}
+
+    df = df.copy()
+    df['created_date'] = df['created_at'].dt.strftime('%Y-%m-%d')
+    df['updated_date'] = df['updated_at'].dt.strftime('%Y-%m-%d')
+    # 只计算非创建日的更新
+    df['is_update'] = df['created_date'] != df['updated_date']
+
+    totals = df.groupby('user_id', observed=True).agg(
+        total_notes=('id', 'count'),
+        new_notes=('created_date', 'count'),
+        updated_notes=('is_update', 'sum')
+    )
+    daily_created = _split_by_user(df.groupby(['user_id', 'created_date'], observed=True).size(), orient=None)
+    daily_updated = _split_by_user(
+        df[df['is_update']].groupby(['user_id', 'updated_date'], observed=True).size(), orient=None
+    )
+    tags = tag_counts_by(df, 'user_id')
+
+    return {
+        user_id: {
+            "total_notes": int(row['total_notes']),
+            "new_notes": int(row['new_notes']),
+            "updated_notes": int(row['updated_notes']),
+            "daily_created": daily_created.get(user_id, {}),
+            "daily_updated": daily_updated.get(user_id, {}),
+            "common_tags": tags.get(user_id, {})
+        }
+        for user_id, row in totals.iterrows()
+    }
+
+
+def build_user_summaries(data: Dict[str, pd.DataFrame], period: Dict[str, Any]) -> Dict[Any, Dict[str, Any]]:
+    """根据分组分析结果组装每个用户的摘要，没有某类数据的用户该部分为提示信息"""
+    habits = analyze_user_habits(data["habits"])
+    todos = analyze_user_todos(data["todos"])
+    notes = analyze_user_notes(data["notes"])
+
+    summaries = {}
+    for user_id in sorted(set(habits) | set(todos) | set(notes), key=str):
+        habits_analysis = habits.get(user_id, {"message": "本周期没有习惯数据记录"})
+        todos_analysis = todos.get(user_id, {"message": "本周期没有待办事项数据记录"})
+        notes_analysis = notes.get(user_id, {"message": "本周期没有笔记数据记录"})
+        summaries[user_id] = {
+            "user_id": user_id,
+            "period": period,
+            "habits": habits_analysis,
+            "todos": todos_analysis,
+            "notes": notes_analysis,
+            "overall": {
+                "productivity_score": calculate_weekly_productivity_score(habits_analysis, todos_analysis)
+            }
+        }
+    return summaries
+
+
+def generate_user_summaries(summary_type: str = 'weekly', days: int = 7,
+                            output_dir: str = "output") -> Dict[Any, Dict[str, Any]]:
+    """
+    为所有有数据的用户生成摘要，每个用户写入 output_dir/<user_id>/ 下的JSON文件
+
+    参数:
+        summary_type: daily（昨天）或 weekly（过去days天，与周报日期范围一致）
+        days: weekly 模式的天数范围
+    """
+    if summary_type == 'daily':
+        start_date = end_date = get_yesterday().date()
+    else:
+        date_range = get_date_range(days)
+        start_date = date_range["start_date"].date()
+        end_date = date_range["end_date"].date()
+    start_date_str = start_date.strftime('%Y-%m-%d')
+    end_date_str = end_date.strftime('%Y-%m-%d')
+
+    logger.info(f"开始按用户生成 {start_date_str} 至 {end_date_str} 的{summary_type}摘要...")
+
+    data = load_user_window_data(start_date, end_date)
+    period = {
+        "start_date": start_date_str,
+        "end_date": end_date_str,
+        "days": (end_date - start_date).days + 1
+    }
+    summaries = build_user_summaries(data, period)
+
+    if summary_type == 'daily':
+        filename = f"daily_summary_{start_date_str}.json"
+    else:
+        filename = f"{summary_type}_summary_{start_date_str}_{end_date_str}.json"
+    for user_id, summary in summaries.items():
+        save_summary_to_json(summary, filename, output_dir=os.path.join(output_dir, str(user_id)))
+
+    logger.info(f"完成 {len(summaries)} 名用户的{summary_type}摘要生成")
+    return summaries
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='按用户生成数据摘要')
+    parser.add_argument('type', nargs='?', choices=['daily', 'weekly'], default='weekly', help='摘要类型')
+    parser.add_argument('--days', type=int, default=7, help='天数范围 (仅对weekly有效)')
+    args = parser.parse_args()
+
+    summaries = generate_user_summaries(args.type, args.days)
+    for user_id, summary in summaries.items():
+        print(f"用户 {user_id} 生产力得分: {summary['overall']['productivity_score']:.2f}/100")
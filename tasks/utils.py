@@ -1,7 +1,7 @@
 import logging
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import pytz
 from typing import Dict, List, Any, Optional
 import json
@@ -15,6 +15,11 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def get_today() -> datetime:
+    """获取今天在配置时区中的零点"""
+    tz = pytz.timezone(config.timezone)
+    return datetime.now(tz).replace(hour=0, minute=0, second=0, microsecond=0)
+
 def get_yesterday() -> datetime:
     """获取昨天的日期"""
     tz = pytz.timezone(config.timezone)
@@ -22,6 +27,11 @@ def get_yesterday() -> datetime:
     yesterday = today - timedelta(days=1)
     return yesterday.replace(hour=0, minute=0, second=0, microsecond=0)
 
+def get_day_start(day: date) -> datetime:
+    """获取指定日期在配置时区中的零点，与get_yesterday返回值的形式一致"""
+    tz = pytz.timezone(config.timezone)
+    return tz.localize(datetime(day.year, day.month, day.day))
+
 def get_date_range(days: int = 7) -> Dict[str, datetime]:
     """获取日期范围，默认过去7天"""
     tz = pytz.timezone(config.timezone)
@@ -5,13 +5,14 @@
 """
 import logging
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 from datetime import datetime, timedelta
-import os
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 
-from db import db
+from activity_cube import ActivityCube
+from chart_render import ChartSpec, make_series, render_charts
+from config import config
+from db import COLUMN_TYPES, db, note_text_columns
+from tag_analysis import tag_counts as count_tags, top_tags_per_day
 from utils import get_date_range, save_dataframe_to_csv, save_summary_to_json
 
 logger = logging.getLogger(__name__)
@@ -31,7 +32,7 @@ def get_weekly_habits_data(days=7) -> pd.DataFrame:
     return db.query_to_dataframe(query, {
         "start_date": date_range["start_date"].date(),
         "end_date": date_range["end_date"].date()
-    })
+    }, **COLUMN_TYPES['habits'])
 
 def get_weekly_todos(days=7) -> pd.DataFrame:
     """获取一周的待办事项数据"""
@@ -41,39 +42,80 @@ def get_weekly_todos(days=7) -> pd.DataFrame:
         id, title, description, status, due_date, completed_at, 
         priority, created_at, updated_at, tags
     FROM todos
-    WHERE (DATE(created_at) BETWEEN %(start_date)s AND %(end_date)s) 
-       OR (DATE(completed_at) BETWEEN %(start_date)s AND %(end_date)s)
+    WHERE ((created_at AT TIME ZONE %(tz)s)::date BETWEEN %(start_date)s AND %(end_date)s)
+       OR ((completed_at AT TIME ZONE %(tz)s)::date BETWEEN %(start_date)s AND %(end_date)s)
     ORDER BY priority DESC, created_at
     """
     return db.query_to_dataframe(query, {
         "start_date": date_range["start_date"].date(),
-        "end_date": date_range["end_date"].date()
-    })
+        "end_date": date_range["end_date"].date(),
+        "tz": config.timezone
+    }, **COLUMN_TYPES['todos'])
 
-def get_weekly_notes(days=7) -> pd.DataFrame:
-    """获取一周的笔记数据"""
+def get_weekly_notes(days=7, include_content: bool = False) -> pd.DataFrame:
+    """获取一周的笔记数据，默认只返回正文长度和行数，include_content为True时附带正文"""
     date_range = get_date_range(days)
-    query = """
+    query = f"""
     SELECT 
-        id, title, content, tags, created_at, updated_at
+        id, title, {note_text_columns(include_content)}, tags, created_at, updated_at
     FROM notes
-    WHERE (DATE(created_at) BETWEEN %(start_date)s AND %(end_date)s) 
-       OR (DATE(updated_at) BETWEEN %(start_date)s AND %(end_date)s)
+    WHERE ((created_at AT TIME ZONE %(tz)s)::date BETWEEN %(start_date)s AND %(end_date)s)
+       OR ((updated_at AT TIME ZONE %(tz)s)::date BETWEEN %(start_date)s AND %(end_date)s)
     ORDER BY created_at
     """
     return db.query_to_dataframe(query, {
         "start_date": date_range["start_date"].date(),
-        "end_date": date_range["end_date"].date()
-    })
+        "end_date": date_range["end_date"].date(),
+        "tz": config.timezone
+    }, **COLUMN_TYPES['notes'])
+
+def build_weekly_chart_specs(habits_analysis: Dict[str, Any], todos_analysis: Dict[str, Any],
+                             notes_analysis: Dict[str, Any]) -> List[ChartSpec]:
+    """根据周报分析结果生成图表描述，交给chart_render渲染"""
+    specs = []
+    if "daily_completion" in habits_analysis:
+        rates = {day: stats["completion_rate"] for day, stats in habits_analysis["daily_completion"].items()}
+        specs.append({
+            "kind": "line",
+            "filename": "weekly_habits_trend.png",
+            "title": "每日习惯完成率趋势",
+            "xlabel": "日期",
+            "ylabel": "完成率 (%)",
+            "ylim": [0, 100],
+            "figsize": [10, 6],
+            "series": [make_series(rates)]
+        })
+    if "daily_created" in todos_analysis:
+        specs.append({
+            "kind": "bar",
+            "filename": "weekly_todos_trend.png",
+            "title": "每日待办事项创建和完成情况",
+            "xlabel": "日期",
+            "ylabel": "数量",
+            "series": [
+                make_series(todos_analysis["daily_created"], "新建待办", "blue"),
+                make_series(todos_analysis["daily_completed"], "完成待办", "green")
+            ]
+        })
+    if "daily_created" in notes_analysis:
+        specs.append({
+            "kind": "bar",
+            "filename": "weekly_notes_trend.png",
+            "title": "每日笔记创建和更新情况",
+            "xlabel": "日期",
+            "ylabel": "数量",
+            "series": [
+                make_series(notes_analysis["daily_created"], "新建笔记", "blue"),
+                make_series(notes_analysis["daily_updated"], "更新笔记", "orange")
+            ]
+        })
+    return specs
 
 def analyze_weekly_habits(df: pd.DataFrame) -> Dict[str, Any]:
     """分析一周的习惯数据"""
     if df.empty:
         return {"message": "本周没有习惯数据记录"}
     
-    # 转换日期列
-    df['completion_date'] = pd.to_datetime(df['completion_date'])
-    
     # 按天计算完成率
     daily_completion = df.groupby(df['completion_date'].dt.date).agg(
         total=('id', 'count'),
@@ -82,7 +124,7 @@ def analyze_weekly_habits(df: pd.DataFrame) -> Dict[str, Any]:
     daily_completion['completion_rate'] = (daily_completion['completed'] / daily_completion['total']) * 100
     
     # 按类别统计
-    category_stats = df.groupby('category').agg(
+    category_stats = df.groupby('category', observed=True).agg(
         total=('id', 'count'),
         completed=('is_completed', 'sum')
     )
@@ -95,22 +137,6 @@ def analyze_weekly_habits(df: pd.DataFrame) -> Dict[str, Any]:
     )
     habit_stats['completion_rate'] = (habit_stats['completed'] / habit_stats['total']) * 100
     
-    # 生成日期范围内每天的习惯完成图表
-    plt.figure(figsize=(10, 6))
-    sns.lineplot(x=daily_completion.index, y=daily_completion['completion_rate'])
-    plt.title('每日习惯完成率趋势')
-    plt.xlabel('日期')
-    plt.ylabel('完成率 (%)')
-    plt.ylim(0, 100)
-    plt.grid(True)
-    
-    # 保存图表
-    output_dir = "output"
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    plt.savefig(os.path.join(output_dir, "weekly_habits_trend.png"))
-    plt.close()
-    
     return {
         "total_habits": len(df['name'].unique()),
         "total_completions": len(df),
@@ -120,20 +146,22 @@ def analyze_weekly_habits(df: pd.DataFrame) -> Dict[str, Any]:
         "habit_stats": habit_stats.to_dict(orient='index')
     }
 
-def analyze_weekly_todos(df: pd.DataFrame) -> Dict[str, Any]:
-    """分析一周的待办事项数据"""
+def _created_in_window(created_date: pd.Series, days: int) -> pd.Series:
+    """创建日期是否在周报日期范围内，新建数量只统计窗口内创建的记录，与数据库聚合模式一致"""
+    date_range = get_date_range(days)
+    return created_date.between(date_range["start_date"].date(), date_range["end_date"].date())
+
+def analyze_weekly_todos(df: pd.DataFrame, days=7) -> Dict[str, Any]:
+    """分析一周的待办事项数据，days为查询数据时使用的天数范围"""
     if df.empty:
         return {"message": "本周没有待办事项数据记录"}
     
-    # 转换日期列
-    df['created_at'] = pd.to_datetime(df['created_at'])
-    df['completed_at'] = pd.to_datetime(df['completed_at'])
-    
-    # 计算每天的待办创建和完成数量
+    # 计算每天的待办创建和完成数量，窗口前创建、窗口内完成的待办不计入新建
     df['created_date'] = df['created_at'].dt.date
     df['completed_date'] = df['completed_at'].dt.date
+    created = df[_created_in_window(df['created_date'], days)]
     
-    daily_created = df.groupby('created_date').size()
+    daily_created = created.groupby('created_date').size()
     daily_completed = df.dropna(subset=['completed_date']).groupby('completed_date').size()
     
     # 计算完成率
@@ -141,122 +169,268 @@ def analyze_weekly_todos(df: pd.DataFrame) -> Dict[str, Any]:
     completion_rate = len(completed) / len(df) * 100 if len(df) > 0 else 0
     
     # 按优先级统计
-    priority_stats = df.groupby('priority').agg(
+    priority_stats = df.assign(is_completed=df['status'] == 'completed').groupby('priority', observed=True).agg(
         total=('id', 'count'),
-        completed=(pd.Series(df['status'] == 'completed'), 'sum')
+        completed=('is_completed', 'sum')
     )
     
     # 分析标签
-    tags = []
-    for tags_list in df['tags'].dropna():
-        if isinstance(tags_list, list):
-            tags.extend(tags_list)
-    tag_counts = pd.Series(tags).value_counts().to_dict()
-    
-    # 生成每日创建和完成数量的图表
-    plt.figure(figsize=(12, 6))
-    ax = plt.gca()
-    daily_created.plot(kind='bar', ax=ax, color='blue', alpha=0.6, label='新建待办')
-    daily_completed.plot(kind='bar', ax=ax, color='green', alpha=0.6, label='完成待办')
-    plt.title('每日待办事项创建和完成情况')
-    plt.xlabel('日期')
-    plt.ylabel('数量')
-    plt.legend()
-    plt.grid(True, axis='y')
-    
-    # 保存图表
-    output_dir = "output"
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    plt.savefig(os.path.join(output_dir, "weekly_todos_trend.png"))
-    plt.close()
+    tag_counts = count_tags(df['tags'])
     
     return {
         "total_todos": len(df),
-        "new_todos": len(df.dropna(subset=['created_date'])),
+        "new_todos": len(created),
         "completed_todos": len(completed),
         "completion_rate": completion_rate,
         "daily_created": daily_created.to_dict(),
         "daily_completed": daily_completed.to_dict(),
         "priority_stats": priority_stats.to_dict(orient='index'),
-        "common_tags": tag_counts
+        "common_tags": tag_counts,
+        "daily_top_tags": top_tags_per_day(df, 'created_at', k=3)
     }
 
-def analyze_weekly_notes(df: pd.DataFrame) -> Dict[str, Any]:
-    """分析一周的笔记数据"""
+def analyze_weekly_notes(df: pd.DataFrame, days=7) -> Dict[str, Any]:
+    """分析一周的笔记数据，days为查询数据时使用的天数范围"""
     if df.empty:
         return {"message": "本周没有笔记数据记录"}
     
-    # 转换日期列
-    df['created_at'] = pd.to_datetime(df['created_at'])
-    df['updated_at'] = pd.to_datetime(df['updated_at'])
-    
-    # 计算每天的笔记创建和更新数量
+    # 计算每天的笔记创建和更新数量，窗口前创建、窗口内更新的笔记不计入新建
     df['created_date'] = df['created_at'].dt.date
     df['updated_date'] = df['updated_at'].dt.date
+    created = df[_created_in_window(df['created_date'], days)]
     
-    daily_created = df.groupby('created_date').size()
+    daily_created = created.groupby('created_date').size()
     
     # 只计算非创建日的更新
     df['is_update'] = df['created_date'] != df['updated_date']
     daily_updated = df[df['is_update']].groupby('updated_date').size()
     
     # 分析标签
-    tags = []
-    for tags_list in df['tags'].dropna():
-        if isinstance(tags_list, list):
-            tags.extend(tags_list)
-    tag_counts = pd.Series(tags).value_counts().to_dict()
-    
-    # 生成每日笔记创建和更新数量的图表
-    plt.figure(figsize=(12, 6))
-    ax = plt.gca()
-    daily_created.plot(kind='bar', ax=ax, color='blue', alpha=0.6, label='新建笔记')
-    daily_updated.plot(kind='bar', ax=ax, color='orange', alpha=0.6, label='更新笔记')
-    plt.title('每日笔记创建和更新情况')
-    plt.xlabel('日期')
-    plt.ylabel('数量')
-    plt.legend()
-    plt.grid(True, axis='y')
-    
-    # 保存图表
-    output_dir = "output"
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    plt.savefig(os.path.join(output_dir, "weekly_notes_trend.png"))
-    plt.close()
+    tag_counts = count_tags(df['tags'])
     
     return {
         "total_notes": len(df),
-        "new_notes": len(df.dropna(subset=['created_date'])),
+        "new_notes": len(created),
         "updated_notes": len(df[df['is_update']]),
         "daily_created": daily_created.to_dict(),
         "daily_updated": daily_updated.to_dict(),
-        "common_tags": tag_counts
+        "common_tags": tag_counts,
+        "daily_top_tags": top_tags_per_day(df, 'updated_at', k=3)
     }
 
-def generate_weekly_summary(days=7) -> Dict[str, Any]:
-    """生成周报摘要"""
+def _query_weekly_aggregates(query: str, days: int) -> Dict[str, pd.DataFrame]:
+    """
+    执行返回 (dimension, key, total, matched) 的聚合查询，按dimension拆分结果
+
+    各维度的分组统计在PostgreSQL中用一条 UNION ALL 查询完成，只返回聚合后的小结果集。
+    日期按配置的时区计算（参数tz），与pandas路径中to_local_datetime转换后的日期一致。
+    """
+    date_range = get_date_range(days)
+    df = db.query_to_dataframe(query, {
+        "start_date": date_range["start_date"].date(),
+        "end_date": date_range["end_date"].date(),
+        "tz": config.timezone
+    })
+    return {
+        dimension: group.dropna(subset=['key']).set_index('key')[['total', 'matched']].astype(int)
+        if dimension != 'total' else group[['total', 'matched']].astype(int)
+        for dimension, group in df.groupby('dimension')
+    }
+
+def _top_tags_from_aggregates(stats: pd.DataFrame, k: int = 3) -> Dict[str, Dict[str, int]]:
+    """把键为 "YYYY-MM-DD|标签" 的按天标签计数转换为与top_tags_per_day一致的结构"""
+    if stats.empty:
+        return {}
+    keys = stats.index.to_series().str.split('|', n=1, expand=True)
+    counts = (
+        pd.DataFrame({'day': keys[0].values, 'tag': keys[1].values, 'count': stats['total'].values})
+        .sort_values(['day', 'count', 'tag'], ascending=[True, False, True])
+    )
+    result: Dict[str, Dict[str, int]] = {}
+    for day, tag, count in counts.groupby('day', sort=False).head(k).itertuples(index=False):
+        result.setdefault(day, {})[tag] = int(count)
+    return result
+
+def _rate_table(stats: pd.DataFrame) -> pd.DataFrame:
+    """把 total/matched 聚合结果转换为 total/completed/completion_rate"""
+    table = stats.rename(columns={'matched': 'completed'}).sort_index()
+    table['completion_rate'] = (table['completed'] / table['total']) * 100
+    return table
+
+def load_weekly_cube(days=7) -> ActivityCube:
+    """加载周报日期范围内的活动立方体"""
+    date_range = get_date_range(days)
+    return ActivityCube.load(date_range["start_date"].date(), date_range["end_date"].date())
+
+def analyze_weekly_habits_sql(days=7, cube: Optional[ActivityCube] = None) -> Dict[str, Any]:
+    """在数据库中聚合一周的习惯数据，返回结构与analyze_weekly_habits一致，按天的数据从活动立方体得到"""
+    query = """
+    WITH window_habits AS (
+        SELECT h.id, h.name, h.category, hc.completion_date, hc.is_completed::int AS is_completed
+        FROM habits h
+        JOIN habit_completions hc ON h.id = hc.habit_id
+        WHERE hc.completion_date BETWEEN %(start_date)s AND %(end_date)s
+    )
+    SELECT 'total' AS dimension, NULL AS key, COUNT(id) AS total, COALESCE(SUM(is_completed), 0) AS matched
+    FROM window_habits
+    UNION ALL
+    SELECT 'category', category::text, COUNT(id), COALESCE(SUM(is_completed), 0)
+    FROM window_habits GROUP BY category
+    UNION ALL
+    SELECT 'habit', name::text, COUNT(id), COALESCE(SUM(is_completed), 0)
+    FROM window_habits GROUP BY name
+    """
+    aggregates = _query_weekly_aggregates(query, days)
+    totals = aggregates['total'].iloc[0]
+    if totals['total'] == 0:
+        return {"message": "本周没有习惯数据记录"}
+
+    empty = pd.DataFrame(columns=['total', 'matched'])
+    daily = (cube or load_weekly_cube(days)).daily_breakdown()["habits"]
+    habit_stats = _rate_table(aggregates.get('habit', empty))
+
+    return {
+        "total_habits": len(habit_stats),
+        "total_completions": int(totals['total']),
+        "average_completion_rate": totals['matched'] / totals['total'] * 100,
+        "daily_completion": daily["daily_completion"],
+        "category_stats": _rate_table(aggregates.get('category', empty)).to_dict(orient='index'),
+        "habit_stats": habit_stats.to_dict(orient='index')
+    }
+
+def analyze_weekly_todos_sql(days=7, cube: Optional[ActivityCube] = None) -> Dict[str, Any]:
+    """在数据库中聚合一周的待办事项数据，标签频次通过unnest(tags)统计，按天的数据从活动立方体得到"""
+    query = """
+    WITH window_todos AS (
+        SELECT id, priority, tags,
+               (created_at AT TIME ZONE %(tz)s)::date AS created_date,
+               (completed_at AT TIME ZONE %(tz)s)::date AS completed_date,
+               (status = 'completed')::int AS is_completed
+        FROM todos
+        WHERE ((created_at AT TIME ZONE %(tz)s)::date BETWEEN %(start_date)s AND %(end_date)s)
+           OR ((completed_at AT TIME ZONE %(tz)s)::date BETWEEN %(start_date)s AND %(end_date)s)
+    )
+    SELECT 'total' AS dimension, NULL AS key, COUNT(id) AS total, COALESCE(SUM(is_completed), 0) AS matched
+    FROM window_todos
+    UNION ALL
+    SELECT 'priority', priority::text, COUNT(id), COALESCE(SUM(is_completed), 0)
+    FROM window_todos GROUP BY priority
+    UNION ALL
+    SELECT 'tag', tag::text, COUNT(*), 0
+    FROM window_todos, unnest(tags) AS tag GROUP BY tag
+    UNION ALL
+    SELECT 'day_tag', created_date::text || '|' || tag::text, COUNT(*), 0
+    FROM window_todos, unnest(tags) AS tag WHERE created_date IS NOT NULL GROUP BY created_date, tag
+    """
+    aggregates = _query_weekly_aggregates(query, days)
+    totals = aggregates['total'].iloc[0]
+    if totals['total'] == 0:
+        return {"message": "本周没有待办事项数据记录"}
+
+    empty = pd.DataFrame(columns=['total', 'matched'])
+    daily = (cube or load_weekly_cube(days)).daily_breakdown()["todos"]
+    tag_counts = aggregates.get('tag', empty)['total'].sort_values(ascending=False)
+
+    return {
+        "total_todos": int(totals['total']),
+        "new_todos": sum(daily["daily_created"].values()),
+        "completed_todos": int(totals['matched']),
+        "completion_rate": totals['matched'] / totals['total'] * 100,
+        "daily_created": daily["daily_created"],
+        "daily_completed": daily["daily_completed"],
+        "priority_stats": _rate_table(aggregates.get('priority', empty)).to_dict(orient='index'),
+        "common_tags": tag_counts.to_dict(),
+        "daily_top_tags": _top_tags_from_aggregates(aggregates.get('day_tag', empty), k=3)
+    }
+
+def analyze_weekly_notes_sql(days=7, cube: Optional[ActivityCube] = None) -> Dict[str, Any]:
+    """在数据库中聚合一周的笔记数据，不读取笔记内容，按天的数据从活动立方体得到"""
+    query = """
+    WITH window_notes AS (
+        SELECT id, tags, created_date, updated_date,
+               (created_date IS DISTINCT FROM updated_date)::int AS is_update
+        FROM (
+            SELECT id, tags,
+                   (created_at AT TIME ZONE %(tz)s)::date AS created_date,
+                   (updated_at AT TIME ZONE %(tz)s)::date AS updated_date
+            FROM notes
+        ) local_notes
+        WHERE (created_date BETWEEN %(start_date)s AND %(end_date)s)
+           OR (updated_date BETWEEN %(start_date)s AND %(end_date)s)
+    )
+    SELECT 'total' AS dimension, NULL AS key, COUNT(id) AS total, COALESCE(SUM(is_update), 0) AS matched
+    FROM window_notes
+    UNION ALL
+    SELECT 'tag', tag::text, COUNT(*), 0
+    FROM window_notes, unnest(tags) AS tag GROUP BY tag
+    UNION ALL
+    SELECT 'day_tag', updated_date::text || '|' || tag::text, COUNT(*), 0
+    FROM window_notes, unnest(tags) AS tag WHERE updated_date IS NOT NULL GROUP BY updated_date, tag
+    """
+    aggregates = _query_weekly_aggregates(query, days)
+    totals = aggregates['total'].iloc[0]
+    if totals['total'] == 0:
+        return {"message": "本周没有笔记数据记录"}
+
+    empty = pd.DataFrame(columns=['total', 'matched'])
+    daily = (cube or load_weekly_cube(days)).daily_breakdown()["notes"]
+    tag_counts = aggregates.get('tag', empty)['total'].sort_values(ascending=False)
+
+    return {
+        "total_notes": int(totals['total']),
+        "new_notes": sum(daily["daily_created"].values()),
+        "updated_notes": int(totals['matched']),
+        "daily_created": daily["daily_created"],
+        "daily_updated": daily["daily_updated"],
+        "common_tags": tag_counts.to_dict(),
+        "daily_top_tags": _top_tags_from_aggregates(aggregates.get('day_tag', empty), k=3)
+    }
+
+def generate_weekly_summary(days=7, pushdown: bool = False, charts: bool = True,
+                            chart_workers: Optional[int] = None,
+                            cube: Optional[ActivityCube] = None) -> Dict[str, Any]:
+    """
+    生成周报摘要
+
+    参数:
+        days: 天数范围
+        pushdown: 是否在数据库中完成按天、类别、优先级和标签的聚合，
+                  只传输聚合结果（此模式不保存原始数据CSV）
+        charts: 是否渲染趋势图表，为False时不会导入matplotlib
+        chart_workers: 图表渲染进程数，None表示在当前进程中渲染
+        cube: 数据库聚合模式使用的活动立方体，可以传入覆盖更长时间的立方体，
+              会切片到本周的日期范围；None表示单独加载
+    """
     date_range = get_date_range(days)
     start_date_str = date_range["start_date"].strftime('%Y-%m-%d')
     end_date_str = date_range["end_date"].strftime('%Y-%m-%d')
     
     logger.info(f"开始生成 {start_date_str} 至 {end_date_str} 的周报摘要...")
     
-    # 获取数据
-    habits_df = get_weekly_habits_data(days)
-    todos_df = get_weekly_todos(days)
-    notes_df = get_weekly_notes(days)
-    
-    # 保存原始数据
-    save_dataframe_to_csv(habits_df, f"weekly_habits_{start_date_str}_{end_date_str}.csv")
-    save_dataframe_to_csv(todos_df, f"weekly_todos_{start_date_str}_{end_date_str}.csv")
-    save_dataframe_to_csv(notes_df, f"weekly_notes_{start_date_str}_{end_date_str}.csv")
-    
-    # 分析数据
-    habits_analysis = analyze_weekly_habits(habits_df)
-    todos_analysis = analyze_weekly_todos(todos_df)
-    notes_analysis = analyze_weekly_notes(notes_df)
+    if pushdown:
+        # 在数据库中聚合，只传输聚合结果，三类数据的按天统计共用同一个活动立方体
+        if cube is None:
+            cube = load_weekly_cube(days)
+        else:
+            cube = cube.slice(start_date=date_range["start_date"].date(), end_date=date_range["end_date"].date())
+        habits_analysis = analyze_weekly_habits_sql(days, cube)
+        todos_analysis = analyze_weekly_todos_sql(days, cube)
+        notes_analysis = analyze_weekly_notes_sql(days, cube)
+    else:
+        # 获取数据
+        habits_df = get_weekly_habits_data(days)
+        todos_df = get_weekly_todos(days)
+        notes_df = get_weekly_notes(days)
+        
+        # 保存原始数据
+        save_dataframe_to_csv(habits_df, f"weekly_habits_{start_date_str}_{end_date_str}.csv")
+        save_dataframe_to_csv(todos_df, f"weekly_todos_{start_date_str}_{end_date_str}.csv")
+        save_dataframe_to_csv(notes_df, f"weekly_notes_{start_date_str}_{end_date_str}.csv")
+        
+        # 分析数据
+        habits_analysis = analyze_weekly_habits(habits_df)
+        todos_analysis = analyze_weekly_todos(todos_df, days)
+        notes_analysis = analyze_weekly_notes(notes_df, days)
     
     # 生成摘要
     summary = {
@@ -276,6 +450,11 @@ def generate_weekly_summary(days=7) -> Dict[str, Any]:
     # 保存摘要
     save_summary_to_json(summary, f"weekly_summary_{start_date_str}_{end_date_str}.json")
     
+    # 渲染图表
+    if charts:
+        render_charts(build_weekly_chart_specs(habits_analysis, todos_analysis, notes_analysis),
+                      workers=chart_workers)
+    
     logger.info(f"完成 {start_date_str} 至 {end_date_str} 的周报摘要生成")
     return summary
 